@@ -27,6 +27,7 @@ from config import cfg
 from config import update_config
 from core.function import get_final_preds
 from utils.transforms import get_affine_transform
+from utils.transforms import crop_source_window
 
 COCO_KEYPOINT_INDEXES = {
     0: 'nose',
@@ -123,6 +124,8 @@ def get_pose_estimation_prediction(pose_model, image, center, scale):
 
     # pose estimation transformation
     trans = get_affine_transform(center, scale, rotation, cfg.MODEL.IMAGE_SIZE)
+    # warp only the part of the frame the crop covers
+    image, trans, _ = crop_source_window(image, trans, cfg.MODEL.IMAGE_SIZE)
     model_input = cv2.warpAffine(
         image,
         trans,
@@ -275,9 +278,10 @@ def main():
 
                 # pose estimation
                 if len(pred_boxes) >= 1:
+                    # the poses are drawn on image_bgr, estimate on a clean copy
+                    image_pose = image if cfg.DATASET.COLOR_RGB else image_bgr.copy()
                     for box in pred_boxes:
                         center, scale = box_to_center_scale(box, cfg.MODEL.IMAGE_SIZE[0], cfg.MODEL.IMAGE_SIZE[1])
-                        image_pose = image.copy() if cfg.DATASET.COLOR_RGB else image_bgr.copy()
                         pose_preds = get_pose_estimation_prediction(pose_model, image_pose, center, scale)
                         if len(pose_preds)>=1:
                             for kpt in pose_preds:
@@ -318,9 +322,10 @@ def main():
 
         # pose estimation
         if len(pred_boxes) >= 1:
+            # the poses are drawn on image_bgr, estimate on a clean copy
+            image_pose = image if cfg.DATASET.COLOR_RGB else image_bgr.copy()
             for box in pred_boxes:
                 center, scale = box_to_center_scale(box, cfg.MODEL.IMAGE_SIZE[0], cfg.MODEL.IMAGE_SIZE[1])
-                image_pose = image.copy() if cfg.DATASET.COLOR_RGB else image_bgr.copy()
                 pose_preds = get_pose_estimation_prediction(pose_model, image_pose, center, scale)
                 if len(pose_preds)>=1:
                     for kpt in pose_preds:
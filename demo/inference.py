@@ -28,7 +28,8 @@ import models
 from config import cfg
 from config import update_config
 from core.inference import get_final_preds
-from utils.transforms import get_affine_transform
+from utils.transforms import get_affine_transforms
+from utils.transforms import crop_source_window
 
 CTX = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
 
@@ -95,11 +96,14 @@ def get_pose_estimation_prediction(pose_model, image, centers, scales, transform
 
     # pose estimation transformation
     model_inputs = []
-    for center, scale in zip(centers, scales):
-        trans = get_affine_transform(center, scale, rotation, cfg.MODEL.IMAGE_SIZE)
-        # Crop smaller image of people
+    all_trans = get_affine_transforms(
+        centers, scales, rotation, cfg.MODEL.IMAGE_SIZE)
+    for trans in all_trans:
+        # Crop smaller image of people, from the part of the frame it covers
+        window, trans, _ = crop_source_window(
+            image, trans, cfg.MODEL.IMAGE_SIZE)
         model_input = cv2.warpAffine(
-            image,
+            window,
             trans,
             (int(cfg.MODEL.IMAGE_SIZE[0]), int(cfg.MODEL.IMAGE_SIZE[1])),
             flags=cv2.INTER_LINEAR)
@@ -259,10 +263,10 @@ def main():
         # Clone 2 image for person detection and pose estimation
         if cfg.DATASET.COLOR_RGB:
             image_per = image_rgb.copy()
-            image_pose = image_rgb.copy()
+            image_pose = image_rgb
         else:
             image_per = image_bgr.copy()
-            image_pose = image_bgr.copy()
+            image_pose = image_bgr
 
         # Clone 1 image for debugging purpose
         image_debug = image_bgr.copy()
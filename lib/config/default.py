@@ -39,6 +39,7 @@ _C.MODEL.INIT_WEIGHTS = True
 _C.MODEL.PRETRAINED = ''
 _C.MODEL.NUM_JOINTS = 17
 _C.MODEL.TAG_PER_JOINT = True
+# 'gaussian' heatmaps, or 'integral' joint locations regressed by soft-argmax
 _C.MODEL.TARGET_TYPE = 'gaussian'
 _C.MODEL.IMAGE_SIZE = [256, 256]  # width * height, ex: 192 * 256
 _C.MODEL.HEATMAP_SIZE = [64, 64]  # width * height, ex: 24 * 32
@@ -57,9 +58,37 @@ _C.DATASET.ROOT = ''
 _C.DATASET.DATASET = 'mpii'
 _C.DATASET.TRAIN_SET = 'train'
 _C.DATASET.TEST_SET = 'valid'
+# 'jpg' files, 'zip' archives or 'shards' built by tools/build_shards.py
 _C.DATASET.DATA_FORMAT = 'jpg'
 _C.DATASET.HYBRID_JOINTS_TYPE = ''
 _C.DATASET.SELECT_DATA = False
+# '' reads DATA_FORMAT files; 'memmap' (whole images) or 'patch' (one padded
+# region per instance) read the store built by tools/build_image_cache.py
+_C.DATASET.CACHE_MODE = ''
+_C.DATASET.CACHE_DIR = ''
+_C.DATASET.CACHE_MAX_SIDE = 0
+# decoded images kept per worker, pair with GROUP_BY_IMAGE
+_C.DATASET.LRU_CACHE_MB = 0
+# validation predictions go back to db order before evaluation
+_C.DATASET.GROUP_BY_IMAGE = False
+# keep the processed db under CACHE_DIR for faster startup
+_C.DATASET.DB_CACHE = False
+# records in the shuffle buffer of the streamed training shards
+_C.DATASET.SHUFFLE_BUFFER = 2048
+# threads per worker reading and decoding the images of a batch, 0 loads
+# one sample at a time
+_C.DATASET.PREFETCH_THREADS = 0
+# decode jpegs at 1/2, 1/4 or 1/8 when the crop samples them that coarsely
+_C.DATASET.REDUCED_DECODE = False
+# images with a longer side of at least this keep only the window their
+# crop samples, 0 keeps the full images
+_C.DATASET.ROI_MIN_SIDE = 0
+# 'cv2' crops every sample in the workers, 'torch' ships the full images
+# and warps and normalizes the whole batch on the device
+_C.DATASET.CROP_BACKEND = 'cv2'
+# workers ship uint8 HWC crops without the ToTensor / Normalize transform,
+# train and validate normalize the batch on the device
+_C.DATASET.UINT8_INPUT = False
 
 # training data augmentation
 _C.DATASET.FLIP = True
@@ -91,6 +120,12 @@ _C.TRAIN.CHECKPOINT = ''
 
 _C.TRAIN.BATCH_SIZE_PER_GPU = 32
 _C.TRAIN.SHUFFLE = True
+# pck accuracy on the model's device, and only on PRINT_FREQ batches
+_C.TRAIN.ACCURACY_ON_DEVICE = False
+_C.TRAIN.ACCURACY_AT_PRINT_FREQ = False
+# workers ship the gaussian centers, the training step renders the targets,
+# 'gaussian' MODEL.TARGET_TYPE only
+_C.TRAIN.TARGET_ON_DEVICE = False
 
 # testing
 _C.TEST = CN()
@@ -101,6 +136,8 @@ _C.TEST.BATCH_SIZE_PER_GPU = 32
 _C.TEST.FLIP_TEST = False
 _C.TEST.POST_PROCESS = False
 _C.TEST.SHIFT_HEATMAP = False
+# flip back, accuracy and final preds in torch on the model's device
+_C.TEST.DECODE_ON_DEVICE = False
 
 _C.TEST.USE_GT_BBOX = False
 
@@ -110,6 +147,16 @@ _C.TEST.NMS_THRE = 0.6
 _C.TEST.SOFT_NMS = False
 _C.TEST.OKS_THRE = 0.5
 _C.TEST.IN_VIS_THRE = 0.0
+# processes running the per-image oks nms in evaluate, 1 runs it inline
+_C.TEST.NMS_WORKERS = 1
+# evaluate from memory, write the results json only if SAVE_RESULTS
+# (always for test sets), in a background thread if ASYNC_SAVE
+_C.TEST.SAVE_RESULTS = True
+_C.TEST.ASYNC_SAVE = False
+# keypoint AP/AR with 'pycocotools' COCOeval or the 'native' vectorized port
+_C.TEST.KEYPOINT_EVAL = 'pycocotools'
+# also save the results as npz arrays next to the results json
+_C.TEST.RESULTS_NPZ = False
 _C.TEST.COCO_BBOX_FILE = ''
 _C.TEST.BBOX_THRE = 1.0
 _C.TEST.MODEL_FILE = ''
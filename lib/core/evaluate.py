@@ -9,23 +9,33 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
+import torch
 
 from core.inference import get_max_preds
+from core.inference import get_max_preds_torch
 
 
 def calc_dists(preds, target, normalize):
+    '''
+    Normalized distance of every joint, -1 where the target is not visible.
+    :return: [num_joints, batch_size]
+    '''
     preds = preds.astype(np.float32)
     target = target.astype(np.float32)
-    dists = np.zeros((preds.shape[1], preds.shape[0]))
-    for n in range(preds.shape[0]):
-        for c in range(preds.shape[1]):
-            if target[n, c, 0] > 1 and target[n, c, 1] > 1:
-                normed_preds = preds[n, c, :] / normalize[n]
-                normed_targets = target[n, c, :] / normalize[n]
-                dists[c, n] = np.linalg.norm(normed_preds - normed_targets)
-            else:
-                dists[c, n] = -1
-    return dists
+    normalize = np.asarray(normalize)
+    if normalize.ndim == 2:
+        normalize = normalize[:, None, :]
+    visible = (target[:, :, 0] > 1) & (target[:, :, 1] > 1)
+    dists = np.linalg.norm(preds / normalize - target / normalize, axis=2)
+    return np.where(visible, dists, -1).T
+
+
+def calc_dists_torch(preds, target, normalize):
+    ''' calc_dists on torch tensors, normalize is [batch_size, 2] '''
+    normalize = normalize.unsqueeze(1)
+    visible = (target[:, :, 0] > 1) & (target[:, :, 1] > 1)
+    dists = torch.norm(preds / normalize - target / normalize, dim=2)
+    return torch.where(visible, dists, torch.full_like(dists, -1)).t()
 
 
 def dist_acc(dists, thr=0.5):
@@ -38,36 +48,60 @@ def dist_acc(dists, thr=0.5):
         return -1
 
 
+def joint_accs(dists, thr=0.5):
+    ''' dist_acc of every row of dists at once, numpy or torch '''
+    dist_cal = dists != -1
+    num_dist_cal = dist_cal.sum(1)
+    num_below = ((dists < thr) & dist_cal).sum(1)
+    if isinstance(dists, torch.Tensor):
+        accs = num_below.float() / num_dist_cal.clamp(min=1).float()
+        return torch.where(num_dist_cal > 0, accs, torch.full_like(accs, -1))
+    accs = num_below * 1.0 / np.maximum(num_dist_cal, 1)
+    return np.where(num_dist_cal > 0, accs, -1)
+
+
 def accuracy(output, target, hm_type='gaussian', thr=0.5):
     '''
     Calculate accuracy according to PCK,
     but uses ground truth heatmap rather than x,y locations
     First value to be returned is average accuracy across 'idxs',
     followed by individual accuracies
+    target are heatmaps, or [batch_size, num_joints, 3] joint locations
+    and visibility in heatmap pixels
+    output and target are numpy arrays, or torch tensors for which the
+    whole computation runs on their device and only the per joint
+    accuracies and joint locations are copied to host
     '''
-    idx = list(range(output.shape[1]))
     norm = 1.0
-    if hm_type == 'gaussian':
-        pred, _ = get_max_preds(output)
-        target, _ = get_max_preds(target)
+    # joint coordinates such as the 'integral' target, not heatmaps
+    joints_target = target.ndim == 3
+    if joints_target:
+        target = target[:, :, 0:2] * (target[:, :, 2:3] > 0)
+    if isinstance(output, torch.Tensor):
+        pred = get_max_preds_torch(output)[0]
+        if not joints_target:
+            target = get_max_preds_torch(target)[0]
         h = output.shape[2]
         w = output.shape[3]
-        norm = np.ones((pred.shape[0], 2)) * np.array([h, w]) / 10
-    dists = calc_dists(pred, target, norm)
-
-    acc = np.zeros((len(idx) + 1))
-    avg_acc = 0
-    cnt = 0
-
-    for i in range(len(idx)):
-        acc[i + 1] = dist_acc(dists[idx[i]])
-        if acc[i + 1] >= 0:
-            avg_acc = avg_acc + acc[i + 1]
-            cnt += 1
+        norm = pred.new_tensor([h, w]).expand(pred.shape[0], 2) / 10
+        accs = joint_accs(calc_dists_torch(pred, target, norm), thr)
+        accs = accs.cpu().numpy().astype(np.float64)
+        pred = pred.cpu().numpy()
+    else:
+        if hm_type == 'gaussian':
+            pred, _ = get_max_preds(output)
+            if not joints_target:
+                target, _ = get_max_preds(target)
+            h = output.shape[2]
+            w = output.shape[3]
+            norm = np.ones((pred.shape[0], 2)) * np.array([h, w]) / 10
+        accs = joint_accs(calc_dists(pred, target, norm), thr)
 
-    avg_acc = avg_acc / cnt if cnt != 0 else 0
+    acc = np.zeros((len(accs) + 1))
+    acc[1:] = accs
+    valid = accs >= 0
+    cnt = int(valid.sum())
+    avg_acc = accs[valid].mean() if cnt != 0 else 0
     if cnt != 0:
         acc[0] = avg_acc
     return acc, avg_acc, cnt, pred
-
-
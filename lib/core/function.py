@@ -17,7 +17,12 @@ import torch
 
 from core.evaluate import accuracy
 from core.inference import get_final_preds
+from core.inference import get_final_preds_torch
+from core.target import render_gaussian_targets
+from dataset.sampler import ImageGroupedSampler
 from utils.transforms import flip_back
+from utils.transforms import normalize_torch
+from utils.transforms import warp_affine_torch
 from utils.vis import save_debug_images
 
 
@@ -39,11 +44,20 @@ def train(config, train_loader, model, criterion, optimizer, epoch,
         # measure data loading time
         data_time.update(time.time() - end)
 
+        if config.DATASET.CROP_BACKEND == 'torch':
+            input = crop_batch(config, input, meta)
+        elif config.DATASET.UINT8_INPUT:
+            input = normalize_batch(input)
+
         # compute output
         outputs = model(input)
 
         target = target.cuda(non_blocking=True)
         target_weight = target_weight.cuda(non_blocking=True)
+        if config.TRAIN.TARGET_ON_DEVICE:
+            target = render_gaussian_targets(
+                target, train_loader.dataset.gaussian,
+                config.MODEL.HEATMAP_SIZE)
 
         if isinstance(outputs, list):
             loss = criterion(outputs[0], target, target_weight)
@@ -63,9 +77,15 @@ def train(config, train_loader, model, criterion, optimizer, epoch,
         # measure accuracy and record loss
         losses.update(loss.item(), input.size(0))
 
-        _, avg_acc, cnt, pred = accuracy(output.detach().cpu().numpy(),
-                                         target.detach().cpu().numpy())
-        acc.update(avg_acc, cnt)
+        if not config.TRAIN.ACCURACY_AT_PRINT_FREQ \
+                or i % config.PRINT_FREQ == 0:
+            if config.TRAIN.ACCURACY_ON_DEVICE:
+                _, avg_acc, cnt, pred = accuracy(output.detach(), target)
+            else:
+                _, avg_acc, cnt, pred = accuracy(
+                    output.detach().cpu().numpy(),
+                    target.detach().cpu().numpy())
+            acc.update(avg_acc, cnt)
 
         # measure elapsed time
         batch_time.update(time.time() - end)
@@ -116,6 +136,11 @@ def validate(config, val_loader, val_dataset, model, criterion, output_dir,
     with torch.no_grad():
         end = time.time()
         for i, (input, target, target_weight, meta) in enumerate(val_loader):
+            if config.DATASET.CROP_BACKEND == 'torch':
+                input = crop_batch(config, input, meta)
+            elif config.DATASET.UINT8_INPUT:
+                input = normalize_batch(input)
+
             # compute output
             outputs = model(input)
             if isinstance(outputs, list):
@@ -132,9 +157,14 @@ def validate(config, val_loader, val_dataset, model, criterion, output_dir,
                 else:
                     output_flipped = outputs_flipped
 
-                output_flipped = flip_back(output_flipped.cpu().numpy(),
-                                           val_dataset.flip_pairs)
-                output_flipped = torch.from_numpy(output_flipped.copy()).cuda()
+                if config.TEST.DECODE_ON_DEVICE:
+                    output_flipped = flip_back(output_flipped,
+                                               val_dataset.flip_pairs)
+                else:
+                    output_flipped = flip_back(output_flipped.cpu().numpy(),
+                                               val_dataset.flip_pairs)
+                    output_flipped = torch.from_numpy(
+                        output_flipped.copy()).cuda()
 
 
                 # feature is not aligned, shift flipped heatmap for higher accuracy
@@ -152,8 +182,11 @@ def validate(config, val_loader, val_dataset, model, criterion, output_dir,
             num_images = input.size(0)
             # measure accuracy and record loss
             losses.update(loss.item(), num_images)
-            _, avg_acc, cnt, pred = accuracy(output.cpu().numpy(),
-                                             target.cpu().numpy())
+            if config.TEST.DECODE_ON_DEVICE:
+                _, avg_acc, cnt, pred = accuracy(output, target)
+            else:
+                _, avg_acc, cnt, pred = accuracy(output.cpu().numpy(),
+                                                 target.cpu().numpy())
 
             acc.update(avg_acc, cnt)
 
@@ -165,8 +198,12 @@ def validate(config, val_loader, val_dataset, model, criterion, output_dir,
             s = meta['scale'].numpy()
             score = meta['score'].numpy()
 
-            preds, maxvals = get_final_preds(
-                config, output.clone().cpu().numpy(), c, s)
+            if config.TEST.DECODE_ON_DEVICE:
+                preds, maxvals = get_final_preds_torch(config, output, c, s)
+                preds, maxvals = preds.cpu().numpy(), maxvals.cpu().numpy()
+            else:
+                preds, maxvals = get_final_preds(
+                    config, output.clone().cpu().numpy(), c, s)
 
             all_preds[idx:idx + num_images, :, 0:2] = preds[:, :, 0:2]
             all_preds[idx:idx + num_images, :, 2:3] = maxvals
@@ -194,6 +231,12 @@ def validate(config, val_loader, val_dataset, model, criterion, output_dir,
                 save_debug_images(config, input, meta, target, pred*4, output,
                                   prefix)
 
+        if isinstance(val_loader.sampler, ImageGroupedSampler):
+            # evaluate() matches the predictions to the db by position
+            all_preds = val_loader.sampler.to_db_order(all_preds)
+            all_boxes = val_loader.sampler.to_db_order(all_boxes)
+            image_path = val_loader.sampler.to_db_order(image_path)
+
         name_values, perf_indicator = val_dataset.evaluate(
             config, all_preds, output_dir, all_boxes, image_path,
             filenames, imgnums
@@ -237,6 +280,29 @@ def validate(config, val_loader, val_dataset, model, criterion, output_dir,
     return perf_indicator
 
 
+def crop_batch(config, input, meta):
+    '''
+    network input of the torch crop backend: the zero padded full images
+    of the batch warped, and normalized, on the device
+    '''
+    return warp_affine_torch(
+        input.cuda(non_blocking=True), meta['trans'],
+        config.MODEL.IMAGE_SIZE,
+        mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225],
+        bgr_to_rgb=config.DATASET.COLOR_RGB
+    )
+
+
+def normalize_batch(input):
+    '''
+    network input of DATASET.UINT8_INPUT: the uint8 HWC crops of the
+    batch converted and normalized on the device
+    '''
+    input = input.cuda(non_blocking=True).permute(0, 3, 1, 2).float()
+    return normalize_torch(
+        input, mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+
+
 # markdown format output
 def _print_name_value(name_value, full_arch_name):
     names = name_value.keys()
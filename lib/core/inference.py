@@ -8,11 +8,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import math
-
 import numpy as np
+import torch
 
-from utils.transforms import transform_preds
+from utils.transforms import get_affine_transforms
+from utils.transforms import affine_transforms
 
 
 def get_max_preds(batch_heatmaps):
@@ -46,34 +46,149 @@ def get_max_preds(batch_heatmaps):
     return preds, maxvals
 
 
+def get_integral_preds(batch_heatmaps):
+    '''
+    get predictions of the 'integral' target type: the expected location
+    under the softmax of every heatmap (soft-argmax), maxvals are the
+    heatmap maxima as in get_max_preds
+    heatmaps: numpy.ndarray([batch_size, num_joints, height, width])
+    '''
+    assert batch_heatmaps.ndim == 4, 'batch_images should be 4-ndim'
+
+    batch_size, num_joints, height, width = batch_heatmaps.shape
+    heatmaps_reshaped = batch_heatmaps.reshape(
+        (batch_size, num_joints, -1)).astype(np.float32)
+    maxvals = np.amax(heatmaps_reshaped, 2, keepdims=True)
+
+    prob = np.exp(heatmaps_reshaped - maxvals)
+    prob /= prob.sum(2, keepdims=True)
+    prob = prob.reshape((batch_size, num_joints, height, width))
+    x = np.dot(prob.sum(2), np.arange(width, dtype=np.float32))
+    y = np.dot(prob.sum(3), np.arange(height, dtype=np.float32))
+
+    preds = np.stack([x, y], axis=2)
+    return preds, maxvals
+
+
 def get_final_preds(config, batch_heatmaps, center, scale):
-    coords, maxvals = get_max_preds(batch_heatmaps)
-
-    heatmap_height = batch_heatmaps.shape[2]
-    heatmap_width = batch_heatmaps.shape[3]
-
-    # post-processing
-    if config.TEST.POST_PROCESS:
-        for n in range(coords.shape[0]):
-            for p in range(coords.shape[1]):
-                hm = batch_heatmaps[n][p]
-                px = int(math.floor(coords[n][p][0] + 0.5))
-                py = int(math.floor(coords[n][p][1] + 0.5))
-                if 1 < px < heatmap_width-1 and 1 < py < heatmap_height-1:
-                    diff = np.array(
-                        [
-                            hm[py][px+1] - hm[py][px-1],
-                            hm[py+1][px]-hm[py-1][px]
-                        ]
-                    )
-                    coords[n][p] += np.sign(diff) * .25
-
-    preds = coords.copy()
+    integral = config.MODEL.TARGET_TYPE == 'integral'
+    if integral:
+        coords, maxvals = get_integral_preds(batch_heatmaps)
+    else:
+        coords, maxvals = get_max_preds(batch_heatmaps)
+
+    batch_size, num_joints, heatmap_height, heatmap_width = \
+        batch_heatmaps.shape
+
+    # post-processing, soft-argmax is already sub-pixel
+    if config.TEST.POST_PROCESS and not integral:
+        px = np.floor(coords[:, :, 0] + 0.5).astype(np.int64)
+        py = np.floor(coords[:, :, 1] + 0.5).astype(np.int64)
+        valid = (1 < px) & (px < heatmap_width - 1) \
+            & (1 < py) & (py < heatmap_height - 1)
+        px = np.where(valid, px, 2)
+        py = np.where(valid, py, 2)
+
+        # right, left, below and above neighbours of every maximum
+        idx = py * heatmap_width + px
+        idx = np.stack([idx + 1, idx - 1,
+                        idx + heatmap_width, idx - heatmap_width], axis=2)
+        hm = batch_heatmaps.reshape((batch_size, num_joints, -1))
+        neighbours = np.take_along_axis(hm, idx, axis=2)
+        diff = neighbours[:, :, 0::2] - neighbours[:, :, 1::2]
+        coords += np.sign(diff) * .25 * valid[:, :, None]
+
+    # Transform back
+    trans = get_affine_transforms(
+        center, scale, 0, [heatmap_width, heatmap_height], inv=1)
+    preds = affine_transforms(coords, trans).astype(np.float32)
+
+    return preds, maxvals
+
+
+def get_max_preds_torch(batch_heatmaps):
+    '''
+    get_max_preds on a torch.Tensor, on the device of the heatmaps
+    heatmaps: torch.Tensor([batch_size, num_joints, height, width])
+    '''
+    assert batch_heatmaps.dim() == 4, 'batch_images should be 4-ndim'
+
+    batch_size, num_joints, _, width = batch_heatmaps.shape
+    heatmaps_reshaped = batch_heatmaps.reshape((batch_size, num_joints, -1))
+    idx = torch.argmax(heatmaps_reshaped, 2, keepdim=True)
+    maxvals = torch.gather(heatmaps_reshaped, 2, idx)
+
+    preds = torch.cat([idx % width, idx // width], dim=2).float()
+    preds *= (maxvals > 0.0).float()
+    return preds, maxvals
+
+
+def get_integral_preds_torch(batch_heatmaps):
+    '''
+    get_integral_preds on a torch.Tensor, differentiable, so that the
+    'integral' loss trains through it
+    '''
+    assert batch_heatmaps.dim() == 4, 'batch_images should be 4-ndim'
+
+    batch_size, num_joints, height, width = batch_heatmaps.shape
+    heatmaps_reshaped = batch_heatmaps.reshape((batch_size, num_joints, -1))
+    maxvals, _ = torch.max(heatmaps_reshaped, 2, keepdim=True)
+
+    prob = torch.softmax(heatmaps_reshaped.float(), 2)
+    prob = prob.reshape((batch_size, num_joints, height, width))
+    x = torch.matmul(prob.sum(2), torch.arange(
+        width, dtype=prob.dtype, device=prob.device))
+    y = torch.matmul(prob.sum(3), torch.arange(
+        height, dtype=prob.dtype, device=prob.device))
+
+    preds = torch.stack([x, y], dim=2)
+    return preds, maxvals
+
+
+def get_final_preds_torch(config, batch_heatmaps, center, scale):
+    '''
+    get_final_preds on a torch.Tensor without copying the heatmaps to host
+    center, scale: [batch_size, 2], numpy or torch
+    return: preds [batch_size, num_joints, 2], maxvals [.., 1] as tensors
+            on the device of the heatmaps
+    '''
+    integral = config.MODEL.TARGET_TYPE == 'integral'
+    if integral:
+        coords, maxvals = get_integral_preds_torch(batch_heatmaps)
+    else:
+        coords, maxvals = get_max_preds_torch(batch_heatmaps)
+
+    batch_size, num_joints, heatmap_height, heatmap_width = \
+        batch_heatmaps.shape
+
+    # post-processing, soft-argmax is already sub-pixel
+    if config.TEST.POST_PROCESS and not integral:
+        px = torch.floor(coords[:, :, 0] + 0.5).long()
+        py = torch.floor(coords[:, :, 1] + 0.5).long()
+        valid = (1 < px) & (px < heatmap_width - 1) \
+            & (1 < py) & (py < heatmap_height - 1)
+        px = torch.where(valid, px, torch.full_like(px, 2))
+        py = torch.where(valid, py, torch.full_like(py, 2))
+
+        # right, left, below and above neighbours of every maximum
+        idx = py * heatmap_width + px
+        idx = torch.stack([idx + 1, idx - 1,
+                           idx + heatmap_width, idx - heatmap_width], dim=2)
+        hm = batch_heatmaps.reshape((batch_size, num_joints, -1))
+        neighbours = torch.gather(hm, 2, idx)
+        diff = neighbours[:, :, 0::2] - neighbours[:, :, 1::2]
+        coords += torch.sign(diff) * .25 * valid.unsqueeze(2).float()
 
     # Transform back
-    for i in range(coords.shape[0]):
-        preds[i] = transform_preds(
-            coords[i], center[i], scale[i], [heatmap_width, heatmap_height]
-        )
+    if isinstance(center, torch.Tensor):
+        center = center.cpu().numpy()
+    if isinstance(scale, torch.Tensor):
+        scale = scale.cpu().numpy()
+    trans = get_affine_transforms(
+        center, scale, 0, [heatmap_width, heatmap_height], inv=1)
+    trans = torch.from_numpy(trans).to(
+        device=coords.device, dtype=coords.dtype)
+    preds = torch.einsum('nij,nkj->nki', trans[:, :, :2], coords) \
+        + trans[:, None, :, 2]
 
     return preds, maxvals
@@ -11,6 +11,8 @@ from __future__ import print_function
 import torch
 import torch.nn as nn
 
+from core.inference import get_integral_preds_torch
+
 
 class JointsMSELoss(nn.Module):
     def __init__(self, use_target_weight):
@@ -21,22 +23,15 @@ class JointsMSELoss(nn.Module):
     def forward(self, output, target, target_weight):
         batch_size = output.size(0)
         num_joints = output.size(1)
-        heatmaps_pred = output.reshape((batch_size, num_joints, -1)).split(1, 1)
-        heatmaps_gt = target.reshape((batch_size, num_joints, -1)).split(1, 1)
-        loss = 0
-
-        for idx in range(num_joints):
-            heatmap_pred = heatmaps_pred[idx].squeeze()
-            heatmap_gt = heatmaps_gt[idx].squeeze()
-            if self.use_target_weight:
-                loss += 0.5 * self.criterion(
-                    heatmap_pred.mul(target_weight[:, idx]),
-                    heatmap_gt.mul(target_weight[:, idx])
-                )
-            else:
-                loss += 0.5 * self.criterion(heatmap_pred, heatmap_gt)
+        heatmaps_pred = output.reshape((batch_size, num_joints, -1))
+        heatmaps_gt = target.reshape((batch_size, num_joints, -1))
+        if self.use_target_weight:
+            heatmaps_pred = heatmaps_pred.mul(target_weight)
+            heatmaps_gt = heatmaps_gt.mul(target_weight)
 
-        return loss / num_joints
+        # every joint has the same number of pixels, so the mean over
+        # joints of the per joint means is the mean over everything
+        return 0.5 * self.criterion(heatmaps_pred, heatmaps_gt)
 
 
 class JointsOHKMMSELoss(nn.Module):
@@ -47,38 +42,42 @@ class JointsOHKMMSELoss(nn.Module):
         self.topk = topk
 
     def ohkm(self, loss):
-        ohkm_loss = 0.
-        for i in range(loss.size()[0]):
-            sub_loss = loss[i]
-            topk_val, topk_idx = torch.topk(
-                sub_loss, k=self.topk, dim=0, sorted=False
-            )
-            tmp_loss = torch.gather(sub_loss, 0, topk_idx)
-            ohkm_loss += torch.sum(tmp_loss) / self.topk
-        ohkm_loss /= loss.size()[0]
-        return ohkm_loss
+        # mean of the topk joint losses of each sample, over the batch
+        topk_val, _ = torch.topk(loss, k=self.topk, dim=1, sorted=False)
+        return topk_val.mean()
 
     def forward(self, output, target, target_weight):
         batch_size = output.size(0)
         num_joints = output.size(1)
-        heatmaps_pred = output.reshape((batch_size, num_joints, -1)).split(1, 1)
-        heatmaps_gt = target.reshape((batch_size, num_joints, -1)).split(1, 1)
-
-        loss = []
-        for idx in range(num_joints):
-            heatmap_pred = heatmaps_pred[idx].squeeze()
-            heatmap_gt = heatmaps_gt[idx].squeeze()
-            if self.use_target_weight:
-                loss.append(0.5 * self.criterion(
-                    heatmap_pred.mul(target_weight[:, idx]),
-                    heatmap_gt.mul(target_weight[:, idx])
-                ))
-            else:
-                loss.append(
-                    0.5 * self.criterion(heatmap_pred, heatmap_gt)
-                )
-
-        loss = [l.mean(dim=1).unsqueeze(dim=1) for l in loss]
-        loss = torch.cat(loss, dim=1)
+        heatmaps_pred = output.reshape((batch_size, num_joints, -1))
+        heatmaps_gt = target.reshape((batch_size, num_joints, -1))
+        if self.use_target_weight:
+            heatmaps_pred = heatmaps_pred.mul(target_weight)
+            heatmaps_gt = heatmaps_gt.mul(target_weight)
+
+        loss = 0.5 * self.criterion(heatmaps_pred, heatmaps_gt).mean(dim=2)
 
         return self.ohkm(loss)
+
+
+class JointsIntegralLoss(nn.Module):
+    '''
+    L1 loss between the soft-argmax of the heatmaps and the joints of the
+    'integral' target, in units of the heatmap size
+    '''
+    def __init__(self, use_target_weight):
+        super(JointsIntegralLoss, self).__init__()
+        self.criterion = nn.L1Loss(reduction='mean')
+        self.use_target_weight = use_target_weight
+
+    def forward(self, output, target, target_weight):
+        heatmap_height, heatmap_width = output.shape[2:]
+        coords, _ = get_integral_preds_torch(output)
+        size = coords.new_tensor([heatmap_width, heatmap_height])
+        coords = coords / size
+        joints = target[:, :, 0:2] / size
+        if self.use_target_weight:
+            coords = coords.mul(target_weight)
+            joints = joints.mul(target_weight)
+
+        return self.criterion(coords, joints)
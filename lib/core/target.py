@@ -0,0 +1,46 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+
+
+def render_gaussian_targets(centers, kernel, heatmap_size):
+    '''
+    Render the 'gaussian' target of a whole batch on the device of centers,
+    the same heatmaps JointsDataset._gaussian_target builds per sample
+    centers: torch.Tensor([batch_size, num_joints, 3]), peak pixel (x, y)
+             and 1 if the gaussian is drawn, from _gaussian_centers
+    kernel: numpy.ndarray([size, size]), the dataset's gaussian patch
+    heatmap_size: (width, height)
+    return: torch.Tensor([batch_size, num_joints, height, width])
+    '''
+    width, height = int(heatmap_size[0]), int(heatmap_size[1])
+    batch_size, num_joints = centers.shape[0:2]
+    size = kernel.shape[0]
+    kernel = torch.as_tensor(kernel, device=centers.device)
+
+    # Paste every gaussian into its own canvas padded by one kernel on
+    # each side, then crop, as the dataset does. Gaussians that are not
+    # drawn are pasted as zeros somewhere inside their canvas, so that no
+    # host sync is needed to select the drawn ones.
+    draw = centers[:, :, 2].reshape(-1) > 0
+    ul = centers[:, :, 0:2].reshape(-1, 2).long() - size // 2
+    ul_x = ul[:, 0].clamp(-size, width) + size
+    ul_y = ul[:, 1].clamp(-size, height) + size
+
+    rng = torch.arange(size, device=centers.device)
+    rows = ul_y[:, None, None] + rng[None, :, None]
+    cols = ul_x[:, None, None] + rng[None, None, :]
+    index = torch.arange(len(ul), device=centers.device)[:, None, None]
+
+    target = kernel.new_zeros(
+        (len(ul), height + 2 * size, width + 2 * size))
+    target[index, rows, cols] = kernel * draw[:, None, None].to(kernel.dtype)
+    target = target[:, size:size + height, size:size + width]
+    return target.reshape((batch_size, num_joints, height, width))
@@ -8,8 +8,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from concurrent.futures import ThreadPoolExecutor
 import copy
+import hashlib
 import logging
+import os
 import random
 
 import cv2
@@ -17,13 +20,59 @@ import numpy as np
 import torch
 from torch.utils.data import Dataset
 
+from dataset.columnar import ColumnarDB
+from dataset.shards import ShardReader
+from dataset.shards import shard_key
 from utils.transforms import get_affine_transform
-from utils.transforms import affine_transform
+from utils.transforms import affine_transforms
+from utils.transforms import crop_source_window
 from utils.transforms import fliplr_joints
+from utils.transforms import get_scale_transform
+from utils.image_store import ImageStore
+from utils.image_store import LRUImageCache
 
 
 logger = logging.getLogger(__name__)
 
+# bump whenever _get_db, select_data or ColumnarDB change what they produce
+DB_CACHE_VERSION = 2
+# bump whenever image_store_key or patch_region change the patches
+PATCH_STORE_VERSION = 2
+
+_REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def _jpeg_size(data):
+    '''
+    (width, height) from the SOF header of jpeg bytes, None when data is
+    not a jpeg
+    '''
+    data = memoryview(data).cast('B')
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+            i += 2
+            continue
+        # SOF0-15 except DHT, JPG and DAC carry the frame size
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
 
 class JointsDataset(Dataset):
     def __init__(self, cfg, root, image_set, is_train, transform=None):
@@ -38,6 +87,10 @@ class JointsDataset(Dataset):
 
         self.output_path = cfg.OUTPUT_DIR
         self.data_format = cfg.DATASET.DATA_FORMAT
+        self.cache_mode = cfg.DATASET.CACHE_MODE
+        self.cache_dir = cfg.DATASET.CACHE_DIR \
+            if cfg.DATASET.CACHE_DIR else os.path.join(root, 'cache')
+        self.cache_max_side = cfg.DATASET.CACHE_MAX_SIDE
 
         self.scale_factor = cfg.DATASET.SCALE_FACTOR
         self.rotation_factor = cfg.DATASET.ROT_FACTOR
@@ -45,32 +98,109 @@ class JointsDataset(Dataset):
         self.num_joints_half_body = cfg.DATASET.NUM_JOINTS_HALF_BODY
         self.prob_half_body = cfg.DATASET.PROB_HALF_BODY
         self.color_rgb = cfg.DATASET.COLOR_RGB
+        self.crop_on_batch = cfg.DATASET.CROP_BACKEND == 'torch'
 
         self.target_type = cfg.MODEL.TARGET_TYPE
+        self.target_on_device = is_train and cfg.TRAIN.TARGET_ON_DEVICE
+        if self.target_on_device \
+                and self.target_type not in self.device_target_encoders:
+            raise ValueError(
+                'TRAIN.TARGET_ON_DEVICE only supports {} targets, not '
+                'MODEL.TARGET_TYPE {}'.format(
+                    ' or '.join(sorted(self.device_target_encoders)),
+                    self.target_type))
         self.image_size = np.array(cfg.MODEL.IMAGE_SIZE)
         self.heatmap_size = np.array(cfg.MODEL.HEATMAP_SIZE)
         self.sigma = cfg.MODEL.SIGMA
         self.use_different_joints_weight = cfg.LOSS.USE_DIFFERENT_JOINTS_WEIGHT
         self.joints_weight = 1
+        self.feat_stride = self.image_size / self.heatmap_size
+        self.gaussian = self._gaussian_kernel()
 
         self.transform = transform
         self.db = []
+        self.db_cache = cfg.DATASET.DB_CACHE
+        self.select = is_train and cfg.DATASET.SELECT_DATA
+        self.db_cache_fields = [
+            cfg.DATASET.ROOT, cfg.DATASET.DATA_FORMAT, self.select,
+            list(cfg.MODEL.IMAGE_SIZE), cfg.MODEL.NUM_JOINTS,
+            cfg.TEST.USE_GT_BBOX, cfg.TEST.IMAGE_THRE,
+        ]
+
+        self.image_store = None
+        if self.cache_mode in ('memmap', 'patch'):
+            store_path = self.image_store_path()
+            if ImageStore.exists(store_path):
+                self.image_store = ImageStore(store_path)
+            else:
+                logger.warning(
+                    '=> image store {} not found, build it with '
+                    'tools/build_image_cache.py; reading {} files'.format(
+                        store_path, self.data_format))
+
+        self.shard_reader = None
+        self.prefetch_threads = cfg.DATASET.PREFETCH_THREADS
+        self.reduced_decode = cfg.DATASET.REDUCED_DECODE
+        self.roi_min_side = cfg.DATASET.ROI_MIN_SIDE
+        self._prefetch = None
+
+        # per worker, for images shared by several records
+        self.image_lru = LRUImageCache(cfg.DATASET.LRU_CACHE_MB * 1024 ** 2) \
+            if cfg.DATASET.LRU_CACHE_MB > 0 else None
 
     def _get_db(self):
         raise NotImplementedError
 
+    def load_db(self, sources):
+        '''
+        _get_db and select_data as a ColumnarDB, cached under cache_dir
+        when DATASET.DB_CACHE is on. The cache is keyed by the content of
+        the source files, the config fields the db depends on and
+        DB_CACHE_VERSION.
+        '''
+        if not self.db_cache:
+            return self._build_db()
+
+        key = hashlib.sha1()
+        key.update(repr([
+            DB_CACHE_VERSION, type(self).__name__, self.image_set,
+            self.is_train, self.db_cache_fields
+        ]).encode())
+        for source in sources:
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 24), b''):
+                    key.update(chunk)
+        cache_file = os.path.join(
+            self.cache_dir,
+            'db_{}_{}.npz'.format(self.image_set, key.hexdigest()[:16])
+        )
+
+        if os.path.isfile(cache_file):
+            logger.info('=> load db from {}'.format(cache_file))
+            return ColumnarDB.load(cache_file)
+
+        db = self._build_db()
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            db.save(cache_file)
+            logger.info('=> saved db to {}'.format(cache_file))
+        except OSError as e:
+            logger.warning('=> fail to save db cache {}: {}'.format(
+                cache_file, e))
+        return db
+
+    def _build_db(self):
+        db = self._get_db()
+        if self.select:
+            db = self.select_data(db)
+        return ColumnarDB(db)
+
     def evaluate(self, cfg, preds, output_dir, *args, **kwargs):
         raise NotImplementedError
 
     def half_body_transform(self, joints, joints_vis):
-        upper_joints = []
-        lower_joints = []
-        for joint_id in range(self.num_joints):
-            if joints_vis[joint_id][0] > 0:
-                if joint_id in self.upper_body_ids:
-                    upper_joints.append(joints[joint_id])
-                else:
-                    lower_joints.append(joints[joint_id])
+        upper_joints, lower_joints = self._half_body_joints(joints, joints_vis)
 
         if np.random.randn() < 0.5 and len(upper_joints) > 2:
             selected_joints = upper_joints
@@ -81,6 +211,20 @@ class JointsDataset(Dataset):
         if len(selected_joints) < 2:
             return None, None
 
+        return self._half_body_box(selected_joints)
+
+    def _half_body_joints(self, joints, joints_vis):
+        upper_joints = []
+        lower_joints = []
+        for joint_id in range(self.num_joints):
+            if joints_vis[joint_id][0] > 0:
+                if joint_id in self.upper_body_ids:
+                    upper_joints.append(joints[joint_id])
+                else:
+                    lower_joints.append(joints[joint_id])
+        return upper_joints, lower_joints
+
+    def _half_body_box(self, selected_joints):
         selected_joints = np.array(selected_joints, dtype=np.float32)
         center = selected_joints.mean(axis=0)[:2]
 
@@ -107,40 +251,253 @@ class JointsDataset(Dataset):
 
         return center, scale
 
+    def half_body_boxes(self, joints, joints_vis):
+        '''
+        every (center, scale) half_body_transform can return for the
+        joints, before the scale augmentation
+        '''
+        if np.sum(joints_vis[:, 0]) <= self.num_joints_half_body:
+            return []
+        upper_joints, lower_joints = self._half_body_joints(joints, joints_vis)
+        candidates = []
+        if len(upper_joints) > 2:
+            candidates.append(upper_joints)
+        candidates.append(
+            lower_joints if len(lower_joints) > 2 else upper_joints)
+        return [self._half_body_box(selected_joints)
+                for selected_joints in candidates
+                if len(selected_joints) >= 2]
+
     def __len__(self,):
         return len(self.db)
 
-    def __getitem__(self, idx):
-        db_rec = copy.deepcopy(self.db[idx])
+    def image_store_path(self):
+        if self.cache_mode == 'patch':
+            name = '{}_patch{}'.format(self.image_set, PATCH_STORE_VERSION)
+            if self.is_train:
+                name += '_s{}_r{}_h{}'.format(
+                    self.scale_factor, self.rotation_factor,
+                    self.prob_half_body)
+        else:
+            name = self.image_set
+        name += '_{}'.format(
+            self.cache_max_side if self.cache_max_side > 0 else 'full'
+        )
+        return os.path.join(self.cache_dir, name)
+
+    def image_store_key(self, db_rec):
+        if self.cache_mode != 'patch':
+            return db_rec['image']
+        # one patch per instance, identified by its exact box
+        return '{}:{!r},{!r},{!r},{!r}'.format(
+            db_rec['image'],
+            float(db_rec['center'][0]), float(db_rec['center'][1]),
+            float(db_rec['scale'][0]), float(db_rec['scale'][1])
+        )
 
-        image_file = db_rec['image']
-        filename = db_rec['filename'] if 'filename' in db_rec else ''
-        imgnum = db_rec['imgnum'] if 'imgnum' in db_rec else ''
+    def _crop_extent(self, center, scale, max_scale, max_rot):
+        """ [x1, y1, x2, y2] covering every crop reachable by augmentation """
+        half_w = scale[0] * self.pixel_std * 0.5 * max_scale
+        half_h = half_w * self.image_size[1] / self.image_size[0]
+        if max_rot > 0:
+            half_w = half_h = np.sqrt(half_w ** 2 + half_h ** 2)
+        return np.array([center[0] - half_w, center[1] - half_h,
+                         center[0] + half_w, center[1] + half_h])
 
+    def patch_region(self, db_rec, image_size):
+        '''
+        region [x0, y0, x1, y1) of the image that __getitem__ can sample
+        for db_rec, padded for scale/rotation/half body augmentation
+        '''
+        if self.is_train:
+            max_scale = 1 + self.scale_factor
+            max_rot = 2 * self.rotation_factor
+        else:
+            max_scale, max_rot = 1, 0
+        extent = self._crop_extent(
+            db_rec['center'], db_rec['scale'], max_scale, max_rot)
+
+        if self.is_train and self.prob_half_body > 0:
+            for center, scale in self.half_body_boxes(
+                    db_rec['joints_3d'], db_rec['joints_3d_vis']):
+                half_body = self._crop_extent(
+                    center, scale, max_scale, max_rot)
+                extent = np.concatenate(
+                    [np.minimum(extent[:2], half_body[:2]),
+                     np.maximum(extent[2:], half_body[2:])])
+
+        # one pixel more for bilinear interpolation
+        x0 = int(np.clip(np.floor(extent[0]) - 1, 0, image_size[0]))
+        y0 = int(np.clip(np.floor(extent[1]) - 1, 0, image_size[1]))
+        x1 = int(np.clip(np.ceil(extent[2]) + 2, x0 + 1, image_size[0]))
+        y1 = int(np.clip(np.ceil(extent[3]) + 2, y0 + 1, image_size[1]))
+        return x0, y0, x1, y1
+
+    def shard_prefix(self):
+        return os.path.join(self.cache_dir, 'shards', self.image_set)
+
+    def read_image_bytes(self, image_file):
+        ''' the encoded image, as a uint8 array '''
         if self.data_format == 'zip':
             from utils import zipreader
-            data_numpy = zipreader.imread(
-                image_file, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
-            )
-        else:
-            data_numpy = cv2.imread(
-                image_file, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
-            )
-
-        if self.color_rgb:
-            data_numpy = cv2.cvtColor(data_numpy, cv2.COLOR_BGR2RGB)
+            return zipreader.read(image_file)
+        if self.data_format == 'shards':
+            if self.shard_reader is None:
+                self.shard_reader = ShardReader(self.shard_prefix())
+            return self.shard_reader.read(shard_key(image_file, self.root))
+        return np.fromfile(image_file, dtype=np.uint8)
+
+    def decode_image(self, data, image_file, flags=cv2.IMREAD_COLOR):
+        data_numpy = cv2.imdecode(
+            data, flags | cv2.IMREAD_IGNORE_ORIENTATION
+        ) if data is not None and len(data) else None
 
         if data_numpy is None:
             logger.error('=> fail to read {}'.format(image_file))
             raise ValueError('Fail to read {}'.format(image_file))
 
+        return data_numpy
+
+    def decode_reduced(self, data, image_file, reduce):
+        '''
+        decode a jpeg at 1/reduce of its size with libjpeg's DCT scaling,
+        other formats and reduce 1 at full size
+        :return: image, size (width, height) of the full image and the
+                 affine from it to the image, None at full size
+        '''
+        size = _jpeg_size(data) \
+            if reduce > 1 and data is not None else None
+        if size is None:
+            data_numpy = self.decode_image(data, image_file)
+            return data_numpy, (data_numpy.shape[1], data_numpy.shape[0]), \
+                None
+
+        data_numpy = self.decode_image(
+            data, image_file, _REDUCED_DECODE_FLAGS[reduce])
+        # reduced pixel x covers the block centered on original
+        # reduce * x + (reduce - 1) / 2
+        return data_numpy, size, get_scale_transform(
+            size, (size[0] / reduce, size[1] / reduce))
+
+    def decode_reduction(self, scale):
+        '''
+        largest of 8, 4, 2 original pixels per network input pixel that
+        a crop of scale samples at most, 1 without DATASET.REDUCED_DECODE
+        '''
+        if not self.reduced_decode:
+            return 1
+        ratio = scale[0] * self.pixel_std / self.image_size[0]
+        for reduce in (8, 4, 2):
+            if ratio >= reduce:
+                return reduce
+        return 1
+
+    def _read_bytes_or_none(self, image_file):
+        try:
+            return self.read_image_bytes(image_file)
+        except (IOError, OSError, KeyError):
+            return None
+
+    def read_image(self, image_file):
+        return self.decode_image(
+            self._read_bytes_or_none(image_file), image_file)
+
+    def read_patch(self, db_rec):
+        data_numpy = self.read_image(db_rec['image'])
+        height, width = data_numpy.shape[:2]
+        x0, y0, x1, y1 = self.patch_region(db_rec, (width, height))
+        return data_numpy[y0:y1, x0:x1], (width, height), (x0, y0)
+
+    def load_image(self, db_rec, reduce=1):
+        '''
+        :return: image in BGR, size (width, height) of the original image
+                 and the 2x3 affine from original pixel coords to the
+                 returned array, None when it is the full-size image
+        '''
+        if self.image_store is not None:
+            key = self.image_store_key(db_rec)
+            if key in self.image_store:
+                return self.image_store.get(key)
+
+        lru_key = (db_rec['image'], reduce)
+        if self.image_lru is not None:
+            cached = self.image_lru.get(lru_key)
+            lookups = self.image_lru.hits + self.image_lru.misses
+            if lookups % len(self.db) == 0:
+                logger.info('=> image cache: {}'.format(
+                    self.image_lru.stats()))
+            if cached is not None:
+                return cached
+
+        image = self.decode_reduced(
+            self._read_bytes_or_none(db_rec['image']), db_rec['image'],
+            reduce)
+        if self.image_lru is not None:
+            self.image_lru.put(lru_key, *image)
+
+        return image
+
+    def _db_record(self, idx):
+        if isinstance(self.db, ColumnarDB):
+            return self.db[idx]
+        return copy.deepcopy(self.db[idx])
+
+    def __getitem__(self, idx):
+        db_rec = self._db_record(idx)
+        augmentation = self.sample_augmentation(db_rec)
+        # not held here, so a large image can go once process cut it
+        return self.process(
+            db_rec,
+            *self.load_image(db_rec, self.decode_reduction(augmentation[1])),
+            augmentation=augmentation)
+
+    def __getitems__(self, indices):
+        '''
+        the samples of a batch. With DATASET.PREFETCH_THREADS the images
+        of the whole batch are read and decoded by a thread pool of this
+        worker while this thread processes those already loaded. The
+        augmentation is drawn first, in batch order, so it draws the same
+        random numbers as __getitem__
+        '''
+        if self.prefetch_threads <= 0:
+            return [self[idx] for idx in indices]
+
+        db_recs = [self._db_record(idx) for idx in indices]
+        augmentations = [self.sample_augmentation(db_rec)
+                         for db_rec in db_recs]
+        pool = self._prefetch_pool()
+        images = [
+            pool.submit(self.load_image, db_rec, self.decode_reduction(aug[1]))
+            for db_rec, aug in zip(db_recs, augmentations)
+        ]
+        return [self.process(db_rec, *image.result(), augmentation=aug)
+                for db_rec, image, aug in zip(db_recs, images, augmentations)]
+
+    def __getstate__(self):
+        # the thread pool is per process, spawned workers start their own
+        state = self.__dict__.copy()
+        state['_prefetch'] = None
+        return state
+
+    def _prefetch_pool(self):
+        # one pool per process, a forked worker does not inherit threads
+        if self._prefetch is None or self._prefetch[0] != os.getpid():
+            self._prefetch = (os.getpid(), ThreadPoolExecutor(
+                max_workers=self.prefetch_threads))
+        return self._prefetch[1]
+
+    def sample_augmentation(self, db_rec):
+        '''
+        center, scale, rotation and flip of the crop of db_rec, drawn
+        before its image is loaded
+        '''
         joints = db_rec['joints_3d']
         joints_vis = db_rec['joints_3d_vis']
 
         c = db_rec['center']
         s = db_rec['scale']
-        score = db_rec['score'] if 'score' in db_rec else 1
         r = 0
+        flip = False
 
         if self.is_train:
             if (np.sum(joints_vis[:, 0]) > self.num_joints_half_body
@@ -158,25 +515,65 @@ class JointsDataset(Dataset):
             r = np.clip(np.random.randn()*rf, -rf*2, rf*2) \
                 if random.random() <= 0.6 else 0
 
-            if self.flip and random.random() <= 0.5:
+            flip = self.flip and random.random() <= 0.5
+
+        return c, s, r, flip
+
+    def process(self, db_rec, data_numpy, im_size, im_trans,
+                augmentation=None):
+        '''
+        input, target, target_weight and meta of db_rec, from its image
+        as load_image returns it and its sample_augmentation
+        '''
+        image_file = db_rec['image']
+        filename = db_rec['filename'] if 'filename' in db_rec else ''
+        imgnum = db_rec['imgnum'] if 'imgnum' in db_rec else ''
+
+        if augmentation is None:
+            augmentation = self.sample_augmentation(db_rec)
+        c, s, r, flip = augmentation
+
+        if 0 < self.roi_min_side <= max(data_numpy.shape[:2]):
+            data_numpy, im_trans = self._source_window(
+                data_numpy, im_size, im_trans, c, s, r, flip)
+
+        if self.color_rgb and not self.crop_on_batch:
+            data_numpy = cv2.cvtColor(data_numpy, cv2.COLOR_BGR2RGB)
+
+        joints = db_rec['joints_3d']
+        joints_vis = db_rec['joints_3d_vis']
+        score = db_rec['score'] if 'score' in db_rec else 1
+        flipped = False
+        array_flipped = False
+
+        if flip:
+            if im_trans is None and not self.crop_on_batch:
                 data_numpy = data_numpy[:, ::-1, :]
-                joints, joints_vis = fliplr_joints(
-                    joints, joints_vis, data_numpy.shape[1], self.flip_pairs)
-                c[0] = data_numpy.shape[1] - c[0] - 1
+                array_flipped = True
+            joints, joints_vis = fliplr_joints(
+                joints, joints_vis, im_size[0], self.flip_pairs)
+            c[0] = im_size[0] - c[0] - 1
+            flipped = True
 
         trans = get_affine_transform(c, s, r, self.image_size)
-        input = cv2.warpAffine(
-            data_numpy,
-            trans,
-            (int(self.image_size[0]), int(self.image_size[1])),
-            flags=cv2.INTER_LINEAR)
+        src_trans = self._source_transform(
+            trans, im_size, im_trans, flipped and not array_flipped)
+        if self.crop_on_batch:
+            # warped with the whole batch by utils.transforms.warp_affine_torch
+            input = data_numpy
+        else:
+            input = cv2.warpAffine(
+                data_numpy,
+                src_trans,
+                (int(self.image_size[0]), int(self.image_size[1])),
+                flags=cv2.INTER_LINEAR)
 
-        if self.transform:
-            input = self.transform(input)
+            if self.transform:
+                input = self.transform(input)
 
-        for i in range(self.num_joints):
-            if joints_vis[i, 0] > 0.0:
-                joints[i, 0:2] = affine_transform(joints[i, 0:2], trans)
+        vis = joints_vis[:, 0] > 0.0
+        joints[vis, 0:2] = affine_transforms(
+            joints[None, vis, 0:2], trans[None])[0]
 
         target, target_weight = self.generate_target(joints, joints_vis)
 
@@ -194,9 +591,51 @@ class JointsDataset(Dataset):
             'rotation': r,
             'score': score
         }
+        if self.crop_on_batch:
+            meta['trans'] = src_trans
 
         return input, target, target_weight, meta
 
+    def _source_window(self, data_numpy, im_size, im_trans, c, s, r, flip):
+        '''
+        the window of the loaded array the crop samples, copied, and
+        im_trans shifted onto it
+        '''
+        if flip:
+            c = np.array([im_size[0] - c[0] - 1, c[1]])
+        trans = self._source_transform(
+            get_affine_transform(c, s, r, self.image_size),
+            im_size, im_trans, flip)
+        window, _, (x0, y0) = crop_source_window(
+            data_numpy, trans, self.image_size)
+
+        shift = np.array([[1, 0, -x0], [0, 1, -y0]], dtype=np.float64)
+        if im_trans is None:
+            return window, shift
+        return window, np.dot(shift, np.vstack([im_trans, [0, 0, 1]]))
+
+    def _source_transform(self, trans, im_size, im_trans, flipped):
+        '''
+        trans maps the (flipped) original image to the network input;
+        rebase it onto the loaded array when that is not the full image
+        or, with flipped, was not flipped itself
+        '''
+        if im_trans is None and not flipped:
+            return trans
+
+        trans = np.vstack([trans, [0, 0, 1]])
+        if flipped:
+            flip = np.array(
+                [[-1, 0, im_size[0] - 1], [0, 1, 0], [0, 0, 1]],
+                dtype=np.float64
+            )
+            trans = np.dot(trans, flip)
+        if im_trans is not None:
+            im_trans_inv = np.linalg.inv(np.vstack([im_trans, [0, 0, 1]]))
+            trans = np.dot(trans, im_trans_inv)
+
+        return trans[:2]
+
     def select_data(self, db):
         db_selected = []
         for rec in db:
@@ -230,6 +669,27 @@ class JointsDataset(Dataset):
         logger.info('=> num selected db: {}'.format(len(db_selected)))
         return db_selected
 
+    def _gaussian_kernel(self):
+        tmp_size = self.sigma * 3
+        size = 2 * tmp_size + 1
+        x = np.arange(0, size, 1, np.float32)
+        y = x[:, np.newaxis]
+        x0 = y0 = size // 2
+        # The gaussian is not normalized, we want the center value to equal 1
+        return np.exp(- ((x - x0) ** 2 + (y - y0) ** 2) / (2 * self.sigma ** 2))
+
+    # MODEL.TARGET_TYPE -> method encoding the joints as the training
+    # target, it also zeroes target_weight of joints it cannot encode
+    target_encoders = {
+        'gaussian': '_gaussian_target',
+        'integral': '_integral_target',
+    }
+    # sparse encoders for TRAIN.TARGET_ON_DEVICE, the training step
+    # renders the dense target from them on its device
+    device_target_encoders = {
+        'gaussian': '_gaussian_centers',
+    }
+
     def generate_target(self, joints, joints_vis):
         '''
         :param joints:  [num_joints, 3]
@@ -239,51 +699,78 @@ class JointsDataset(Dataset):
         target_weight = np.ones((self.num_joints, 1), dtype=np.float32)
         target_weight[:, 0] = joints_vis[:, 0]
 
-        assert self.target_type == 'gaussian', \
-            'Only support gaussian map now!'
-
-        if self.target_type == 'gaussian':
-            target = np.zeros((self.num_joints,
-                               self.heatmap_size[1],
-                               self.heatmap_size[0]),
-                              dtype=np.float32)
-
-            tmp_size = self.sigma * 3
-
-            for joint_id in range(self.num_joints):
-                feat_stride = self.image_size / self.heatmap_size
-                mu_x = int(joints[joint_id][0] / feat_stride[0] + 0.5)
-                mu_y = int(joints[joint_id][1] / feat_stride[1] + 0.5)
-                # Check that any part of the gaussian is in-bounds
-                ul = [int(mu_x - tmp_size), int(mu_y - tmp_size)]
-                br = [int(mu_x + tmp_size + 1), int(mu_y + tmp_size + 1)]
-                if ul[0] >= self.heatmap_size[0] or ul[1] >= self.heatmap_size[1] \
-                        or br[0] < 0 or br[1] < 0:
-                    # If not, just return the image as is
-                    target_weight[joint_id] = 0
-                    continue
-
-                # # Generate gaussian
-                size = 2 * tmp_size + 1
-                x = np.arange(0, size, 1, np.float32)
-                y = x[:, np.newaxis]
-                x0 = y0 = size // 2
-                # The gaussian is not normalized, we want the center value to equal 1
-                g = np.exp(- ((x - x0) ** 2 + (y - y0) ** 2) / (2 * self.sigma ** 2))
-
-                # Usable gaussian range
-                g_x = max(0, -ul[0]), min(br[0], self.heatmap_size[0]) - ul[0]
-                g_y = max(0, -ul[1]), min(br[1], self.heatmap_size[1]) - ul[1]
-                # Image range
-                img_x = max(0, ul[0]), min(br[0], self.heatmap_size[0])
-                img_y = max(0, ul[1]), min(br[1], self.heatmap_size[1])
-
-                v = target_weight[joint_id]
-                if v > 0.5:
-                    target[joint_id][img_y[0]:img_y[1], img_x[0]:img_x[1]] = \
-                        g[g_y[0]:g_y[1], g_x[0]:g_x[1]]
+        encoders = self.device_target_encoders if self.target_on_device \
+            else self.target_encoders
+        assert self.target_type in encoders, \
+            'Unknown target type {}'.format(self.target_type)
+        target = getattr(self, encoders[self.target_type])(
+            joints, target_weight)
 
         if self.use_different_joints_weight:
             target_weight = np.multiply(target_weight, self.joints_weight)
 
         return target, target_weight
+
+    def _gaussian_centers(self, joints, target_weight):
+        '''
+        :return: [num_joints, 3] heatmap pixel (x, y) of every gaussian
+                 peak and 1 if it is drawn, the sparse form of
+                 _gaussian_target rendered by core.target
+        '''
+        heatmap_w, heatmap_h = int(self.heatmap_size[0]), int(self.heatmap_size[1])
+        tmp_size = self.sigma * 3
+
+        # int() truncates towards zero, so does astype(np.int64)
+        mu = (joints[:, 0:2] / self.feat_stride + 0.5).astype(np.int64)
+        ul = (mu - tmp_size).astype(np.int64)
+        br = (mu + tmp_size + 1).astype(np.int64)
+        # Check that any part of the gaussian is in-bounds
+        out = (ul[:, 0] >= heatmap_w) | (ul[:, 1] >= heatmap_h) \
+            | (br[:, 0] < 0) | (br[:, 1] < 0)
+        target_weight[out] = 0
+
+        centers = np.zeros((self.num_joints, 3), dtype=np.float32)
+        centers[:, 0:2] = mu
+        centers[:, 2] = target_weight[:, 0] > 0.5
+        return centers
+
+    def _gaussian_target(self, joints, target_weight):
+        '''
+        :return: [num_joints, heatmap_h, heatmap_w] heatmaps, a gaussian
+                 of sigma MODEL.SIGMA at every joint
+        '''
+        heatmap_w, heatmap_h = int(self.heatmap_size[0]), int(self.heatmap_size[1])
+        tmp_size = self.sigma * 3
+        size = self.gaussian.shape[0]
+        centers = self._gaussian_centers(joints, target_weight)
+
+        # Paste every kept gaussian into a canvas padded by one kernel
+        # on each side, so that no index needs clipping, then crop.
+        target = np.zeros((self.num_joints,
+                           heatmap_h + 2 * size,
+                           heatmap_w + 2 * size),
+                          dtype=np.float32)
+        keep = np.where(centers[:, 2] > 0)[0]
+        if len(keep) > 0:
+            ul = centers[keep, 0:2].astype(np.int64) - tmp_size
+            rng = np.arange(size)
+            rows = (ul[:, 1] + size)[:, None, None] + rng[None, :, None]
+            cols = (ul[:, 0] + size)[:, None, None] + rng[None, None, :]
+            target[keep[:, None, None], rows, cols] = self.gaussian
+        target = target[:, size:size + heatmap_h, size:size + heatmap_w]
+        return np.ascontiguousarray(target)
+
+    def _integral_target(self, joints, target_weight):
+        '''
+        :return: [num_joints, 3] joint (x, y) in heatmap pixels and
+                 visibility, regressed from the heatmaps by soft-argmax
+        '''
+        heatmap_w, heatmap_h = self.heatmap_size
+        target = np.zeros((self.num_joints, 3), dtype=np.float32)
+        target[:, 0:2] = joints[:, 0:2] / self.feat_stride
+        # the expectation over the heatmap cannot leave it
+        out = (target[:, 0] < 0) | (target[:, 0] > heatmap_w - 1) \
+            | (target[:, 1] < 0) | (target[:, 1] > heatmap_h - 1)
+        target_weight[out] = 0
+        target[:, 2] = target_weight[:, 0]
+        return target
@@ -8,24 +8,33 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from collections import defaultdict
 from collections import OrderedDict
+import json
 import logging
+import multiprocessing
 import os
+import threading
 
 from pycocotools.coco import COCO
 from pycocotools.cocoeval import COCOeval
-import json_tricks as json
 import numpy as np
 
 from dataset.JointsDataset import JointsDataset
-from nms.nms import oks_nms
-from nms.nms import soft_oks_nms
+from dataset.keypoint_eval import KeypointEvaluator
+from nms.nms import oks_nms_array
+from nms.nms import soft_oks_nms_array
 
 
 logger = logging.getLogger(__name__)
 
 
+def _oks_nms_images(task):
+    ''' keep indexes of every image in a chunk, runs in the nms workers '''
+    nms_fn, thresh, images = task
+    return [nms_fn(kpts, scores, areas, thresh)
+            for kpts, scores, areas in images]
+
+
 class COCODataset(JointsDataset):
     '''
     "keypoints": {
@@ -58,6 +67,13 @@ class COCODataset(JointsDataset):
         self.soft_nms = cfg.TEST.SOFT_NMS
         self.oks_thre = cfg.TEST.OKS_THRE
         self.in_vis_thre = cfg.TEST.IN_VIS_THRE
+        self.nms_workers = cfg.TEST.NMS_WORKERS
+        self.results_npz = cfg.TEST.RESULTS_NPZ
+        self.save_results = cfg.TEST.SAVE_RESULTS
+        self.async_save = cfg.TEST.ASYNC_SAVE
+        self._save_thread = None
+        self.keypoint_eval = cfg.TEST.KEYPOINT_EVAL
+        self.keypoint_evaluator = None
         self.bbox_file = cfg.TEST.COCO_BBOX_FILE
         self.use_gt_bbox = cfg.TEST.USE_GT_BBOX
         self.image_width = cfg.MODEL.IMAGE_SIZE[0]
@@ -65,6 +81,35 @@ class COCODataset(JointsDataset):
         self.aspect_ratio = self.image_width * 1.0 / self.image_height
         self.pixel_std = 200
 
+        # annotations are parsed on first use, not needed on a db cache hit
+        self.coco = None
+
+        self.num_joints = 17
+        self.flip_pairs = [[1, 2], [3, 4], [5, 6], [7, 8],
+                           [9, 10], [11, 12], [13, 14], [15, 16]]
+        self.parent_ids = None
+        self.upper_body_ids = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+        self.lower_body_ids = (11, 12, 13, 14, 15, 16)
+
+        self.joints_weight = np.array(
+            [
+                1., 1., 1., 1., 1., 1., 1., 1.2, 1.2,
+                1.5, 1.5, 1., 1., 1.2, 1.2, 1.5, 1.5
+            ],
+            dtype=np.float32
+        ).reshape((self.num_joints, 1))
+
+        sources = [self._get_ann_file_keypoint()]
+        if not (is_train or self.use_gt_bbox):
+            sources.append(self.bbox_file)
+        self.db = self.load_db(sources)
+
+        logger.info('=> load {} samples'.format(len(self.db)))
+
+    def _load_coco(self):
+        if self.coco is not None:
+            return
+
         self.coco = COCO(self._get_ann_file_keypoint())
 
         # deal with class names
@@ -87,28 +132,6 @@ class COCODataset(JointsDataset):
         self.num_images = len(self.image_set_index)
         logger.info('=> num_images: {}'.format(self.num_images))
 
-        self.num_joints = 17
-        self.flip_pairs = [[1, 2], [3, 4], [5, 6], [7, 8],
-                           [9, 10], [11, 12], [13, 14], [15, 16]]
-        self.parent_ids = None
-        self.upper_body_ids = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
-        self.lower_body_ids = (11, 12, 13, 14, 15, 16)
-
-        self.joints_weight = np.array(
-            [
-                1., 1., 1., 1., 1., 1., 1., 1.2, 1.2,
-                1.5, 1.5, 1., 1., 1.2, 1.2, 1.5, 1.5
-            ],
-            dtype=np.float32
-        ).reshape((self.num_joints, 1))
-
-        self.db = self._get_db()
-
-        if is_train and cfg.DATASET.SELECT_DATA:
-            self.db = self.select_data(self.db)
-
-        logger.info('=> load {} samples'.format(len(self.db)))
-
     def _get_ann_file_keypoint(self):
         """ self.root / annotations / person_keypoints_train2017.json """
         prefix = 'person_keypoints' \
@@ -125,6 +148,7 @@ class COCODataset(JointsDataset):
         return image_ids
 
     def _get_db(self):
+        self._load_coco()
         if self.is_train or self.use_gt_bbox:
             # use ground truth bbox
             gt_db = self._load_coco_keypoint_annotations()
@@ -288,6 +312,7 @@ class COCODataset(JointsDataset):
 
     def evaluate(self, cfg, preds, output_dir, all_boxes, img_path,
                  *args, **kwargs):
+        self._load_coco()
         rank = cfg.RANK
 
         res_folder = os.path.join(output_dir, 'results')
@@ -302,134 +327,166 @@ class COCODataset(JointsDataset):
                 self.image_set, rank)
         )
 
-        # person x (keypoints)
-        _kpts = []
-        for idx, kpt in enumerate(preds):
-            _kpts.append({
-                'keypoints': kpt,
-                'center': all_boxes[idx][0:2],
-                'scale': all_boxes[idx][2:4],
-                'area': all_boxes[idx][4],
-                'score': all_boxes[idx][5],
-                'image': int(img_path[idx][-16:-4])
-            })
-        # image x person x (keypoints)
-        kpts = defaultdict(list)
-        for kpt in _kpts:
-            kpts[kpt['image']].append(kpt)
-
-        # rescoring and oks nms
-        num_joints = self.num_joints
-        in_vis_thre = self.in_vis_thre
-        oks_thre = self.oks_thre
-        oks_nmsed_kpts = []
-        for img in kpts.keys():
-            img_kpts = kpts[img]
-            for n_p in img_kpts:
-                box_score = n_p['score']
-                kpt_score = 0
-                valid_num = 0
-                for n_jt in range(0, num_joints):
-                    t_s = n_p['keypoints'][n_jt][2]
-                    if t_s > in_vis_thre:
-                        kpt_score = kpt_score + t_s
-                        valid_num = valid_num + 1
-                if valid_num != 0:
-                    kpt_score = kpt_score / valid_num
-                # rescoring
-                n_p['score'] = kpt_score * box_score
-
-            if self.soft_nms:
-                keep = soft_oks_nms(
-                    [img_kpts[i] for i in range(len(img_kpts))],
-                    oks_thre
-                )
-            else:
-                keep = oks_nms(
-                    [img_kpts[i] for i in range(len(img_kpts))],
-                    oks_thre
-                )
-
-            if len(keep) == 0:
-                oks_nmsed_kpts.append(img_kpts)
+        preds = np.asarray(preds)
+        all_boxes = np.asarray(all_boxes)
+        images = np.array([int(path[-16:-4]) for path in img_path[:len(preds)]])
+
+        # rescoring: box score times the mean of the visible joint scores,
+        # accumulated joint by joint as the scalar loop did
+        vis = preds[:, :, 2]
+        mask = vis > self.in_vis_thre
+        kpt_score = np.zeros(len(preds))
+        for n_jt in range(self.num_joints):
+            kpt_score += np.where(mask[:, n_jt], vis[:, n_jt], 0)
+        valid_num = mask.sum(axis=1)
+        kpt_score = np.where(
+            valid_num > 0, kpt_score / np.maximum(valid_num, 1), kpt_score)
+        scores = kpt_score * all_boxes[:, 5]
+
+        # instances of each image, images in order of first appearance
+        _, first, inverse = np.unique(
+            images, return_index=True, return_inverse=True)
+        group = np.argsort(np.argsort(first))[inverse]
+        order = np.argsort(group, kind='stable')
+        groups = np.split(order, np.cumsum(np.bincount(group))[:-1]) \
+            if len(order) > 0 else []
+
+        # oks nms
+        keeps = self._oks_nms_groups(preds, scores, all_boxes[:, 4], groups)
+
+        inds = [
+            inds[keep] if len(keep) > 0 else inds
+            for inds, keep in zip(groups, keeps)
+        ]
+        inds = np.concatenate(inds) if inds else np.zeros(0, dtype=np.intp)
+
+        results = (preds[inds], scores[inds], images[inds], all_boxes[inds])
+        is_test = 'test' in self.image_set
+        if is_test or self.save_results:
+            self._save_coco_keypoint_results(results, res_file)
+        if not is_test:
+            if self.keypoint_eval == 'native':
+                info_str = self._do_native_keypoint_eval(*results)
             else:
-                oks_nmsed_kpts.append([img_kpts[_keep] for _keep in keep])
-
-        self._write_coco_keypoint_results(
-            oks_nmsed_kpts, res_file)
-        if 'test' not in self.image_set:
-            info_str = self._do_python_keypoint_eval(
-                res_file, res_folder)
+                info_str = self._do_python_keypoint_eval(
+                    self._coco_keypoint_results(*results), res_folder)
             name_value = OrderedDict(info_str)
             return name_value, name_value['AP']
         else:
             return {'Null': 0}, 0
 
-    def _write_coco_keypoint_results(self, keypoints, res_file):
-        data_pack = [
+    def _oks_nms_groups(self, preds, scores, areas, groups):
+        '''
+        Run oks nms on every group of instance indexes, over a pool of
+        TEST.NMS_WORKERS processes. Images are handed out in contiguous
+        chunks and the keep lists come back in the order of groups.
+        '''
+        nms_fn = soft_oks_nms_array if self.soft_nms else oks_nms_array
+        images = [(preds[inds], scores[inds], areas[inds]) for inds in groups]
+
+        num_workers = min(self.nms_workers, len(images))
+        if num_workers <= 1:
+            return _oks_nms_images((nms_fn, self.oks_thre, images))
+
+        chunk_size = -(-len(images) // (num_workers * 4))
+        tasks = [
+            (nms_fn, self.oks_thre, images[i:i + chunk_size])
+            for i in range(0, len(images), chunk_size)
+        ]
+        with multiprocessing.Pool(num_workers) as pool:
+            chunks = pool.map(_oks_nms_images, tasks)
+        return [keep for chunk in chunks for keep in chunk]
+
+    def _save_coco_keypoint_results(self, results, res_file):
+        '''
+        Write the results, in a background thread with TEST.ASYNC_SAVE.
+        The previous write is always finished before the next one starts.
+        '''
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+
+        if not self.async_save:
+            self._write_coco_keypoint_results(*results, res_file)
+            return
+
+        self._save_thread = threading.Thread(
+            target=self._write_coco_keypoint_results,
+            args=results + (res_file,)
+        )
+        self._save_thread.start()
+
+    def _coco_keypoint_results(self, keypoints, scores, images, boxes):
+        '''
+        Results in the coco format, as a list of dicts of python scalars.
+        :param keypoints: [N, num_joints, 3]
+        :param scores: [N]
+        :param images: [N] coco image ids
+        :param boxes: [N, >=4] center and scale of each instance
+        '''
+        cat_id = self._class_to_coco_ind[self.classes[1]]
+        return [
             {
-                'cat_id': self._class_to_coco_ind[cls],
-                'cls_ind': cls_ind,
-                'cls': cls,
-                'ann_type': 'keypoints',
-                'keypoints': keypoints
+                'category_id': cat_id,
+                'center': box[0:2],
+                'image_id': image_id,
+                'keypoints': kpts,
+                'scale': box[2:4],
+                'score': score
             }
-            for cls_ind, cls in enumerate(self.classes) if not cls == '__background__'
+            for image_id, kpts, score, box in zip(
+                images.tolist(),
+                keypoints.reshape((len(keypoints), -1)).tolist(),
+                scores.tolist(),
+                boxes.tolist()
+            )
         ]
 
-        results = self._coco_keypoint_results_one_category_kernel(data_pack[0])
+    def _write_coco_keypoint_results(self, keypoints, scores, images, boxes,
+                                     res_file):
+        '''
+        Stream the results to res_file straight from the arrays, a chunk
+        of instances at a time, as compact json.
+        '''
         logger.info('=> writing results json to %s' % res_file)
+        chunk_size = 4096
         with open(res_file, 'w') as f:
-            json.dump(results, f, sort_keys=True, indent=4)
-        try:
-            json.load(open(res_file))
-        except Exception:
-            content = []
-            with open(res_file, 'r') as f:
-                for line in f:
-                    content.append(line)
-            content[-1] = ']'
-            with open(res_file, 'w') as f:
-                for c in content:
-                    f.write(c)
-
-    def _coco_keypoint_results_one_category_kernel(self, data_pack):
-        cat_id = data_pack['cat_id']
-        keypoints = data_pack['keypoints']
-        cat_results = []
-
-        for img_kpts in keypoints:
-            if len(img_kpts) == 0:
-                continue
-
-            _key_points = np.array([img_kpts[k]['keypoints']
-                                    for k in range(len(img_kpts))])
-            key_points = np.zeros(
-                (_key_points.shape[0], self.num_joints * 3), dtype=np.float
+            f.write('[')
+            for start in range(0, len(keypoints), chunk_size):
+                end = start + chunk_size
+                results = self._coco_keypoint_results(
+                    keypoints[start:end], scores[start:end],
+                    images[start:end], boxes[start:end])
+                if start > 0:
+                    f.write(',')
+                f.write(json.dumps(results, separators=(',', ':'))[1:-1])
+            f.write(']')
+
+        if self.results_npz:
+            npz_file = os.path.splitext(res_file)[0] + '.npz'
+            logger.info('=> writing results npz to %s' % npz_file)
+            np.savez(
+                npz_file,
+                image_id=np.asarray(images, dtype=np.int64),
+                category_id=np.full(
+                    len(keypoints), self._class_to_coco_ind[self.classes[1]],
+                    dtype=np.int64),
+                keypoints=keypoints,
+                score=scores,
+                center=boxes[:, 0:2],
+                scale=boxes[:, 2:4]
             )
 
-            for ipt in range(self.num_joints):
-                key_points[:, ipt * 3 + 0] = _key_points[:, ipt, 0]
-                key_points[:, ipt * 3 + 1] = _key_points[:, ipt, 1]
-                key_points[:, ipt * 3 + 2] = _key_points[:, ipt, 2]  # keypoints score.
-
-            result = [
-                {
-                    'image_id': img_kpts[k]['image'],
-                    'category_id': cat_id,
-                    'keypoints': list(key_points[k]),
-                    'score': img_kpts[k]['score'],
-                    'center': list(img_kpts[k]['center']),
-                    'scale': list(img_kpts[k]['scale'])
-                }
-                for k in range(len(img_kpts))
-            ]
-            cat_results.extend(result)
-
-        return cat_results
+    def _do_native_keypoint_eval(self, keypoints, scores, images, boxes):
+        if self.keypoint_evaluator is None:
+            self.keypoint_evaluator = KeypointEvaluator(
+                self.coco, self._class_to_coco_ind[self.classes[1]])
+        stats = self.keypoint_evaluator.evaluate(images, keypoints, scores)
+        return list(zip(KeypointEvaluator.stats_names, stats))
 
-    def _do_python_keypoint_eval(self, res_file, res_folder):
-        coco_dt = self.coco.loadRes(res_file)
+    def _do_python_keypoint_eval(self, results, res_folder):
+        ''' results is a results json file or the list of results '''
+        coco_dt = self.coco.loadRes(results)
         coco_eval = COCOeval(self.coco, coco_dt, 'keypoints')
         coco_eval.params.useSegm = None
         coco_eval.evaluate()
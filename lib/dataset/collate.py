@@ -0,0 +1,32 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+
+def collate_padded_images(batch):
+    '''
+    default_collate for samples whose input is a uint8 HWC image, the
+    crops of DATASET.UINT8_INPUT or the full images of DATASET.CROP_BACKEND
+    torch: the images are stacked into one uint8 batch, zero padded on the
+    bottom and right to the largest one
+    '''
+    images = [sample[0] for sample in batch]
+    height = max(image.shape[0] for image in images)
+    width = max(image.shape[1] for image in images)
+
+    padded = np.zeros(
+        (len(images), height, width, images[0].shape[2]), dtype=np.uint8)
+    for i, image in enumerate(images):
+        padded[i, :image.shape[0], :image.shape[1]] = image
+
+    return [torch.from_numpy(padded)] + \
+        default_collate([sample[1:] for sample in batch])
@@ -0,0 +1,102 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+
+class ColumnarDB(object):
+    '''
+    Array-backed replacement of the list of db records.
+
+    Every field is one contiguous array over all records: numeric fields
+    are stacked in the dtype of the records, so detection scores, centers
+    and scales keep their precision, and string fields such as 'image'
+    are interned into a table of unique values plus an int32 index. Forked
+    DataLoader workers therefore never touch per-record Python objects,
+    so reading the db does not copy it page by page through refcounts.
+
+    Indexing returns a dict shaped like the original record whose arrays
+    are fresh copies, so callers may modify it in place.
+    '''
+    def __init__(self, db=()):
+        self._len = len(db)
+        self._arrays = {}
+        self._tables = {}
+        if self._len == 0:
+            return
+
+        for key in db[0].keys():
+            values = [rec[key] for rec in db]
+            if isinstance(values[0], str):
+                table, index = np.unique(values, return_inverse=True)
+                self._tables[key] = table
+                self._arrays[key] = index.astype(np.int32)
+            else:
+                self._arrays[key] = np.ascontiguousarray(values)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError('db index {} out of range'.format(idx))
+
+        rec = {}
+        for key, array in self._arrays.items():
+            if key in self._tables:
+                rec[key] = str(self._tables[key][array[idx]])
+            elif array.ndim > 1:
+                rec[key] = array[idx].copy()
+            else:
+                rec[key] = array[idx]
+        return rec
+
+    def __iter__(self):
+        for idx in range(self._len):
+            yield self[idx]
+
+    def keys(self):
+        return list(self._arrays.keys())
+
+    def column(self, key):
+        ''' all values of one field, strings as an array of str '''
+        if key in self._tables:
+            return self._tables[key][self._arrays[key]]
+        return self._arrays[key]
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self._arrays.values()) + \
+            sum(t.nbytes for t in self._tables.values())
+
+    def save(self, path):
+        arrays = dict(self._arrays)
+        for key, table in self._tables.items():
+            arrays['table:' + key] = table
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        db = cls()
+        with np.load(path) as f:
+            for key in f.files:
+                if key.startswith('table:'):
+                    db._tables[key[len('table:'):]] = f[key]
+                else:
+                    db._arrays[key] = f[key]
+        if db._arrays:
+            db._len = len(next(iter(db._arrays.values())))
+        return db
@@ -0,0 +1,252 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+class KeypointEvaluator(object):
+    '''
+    OKS based keypoint AP/AR, a vectorized port of pycocotools' COCOeval
+    with iouType 'keypoints' for a single category.
+
+    The ground truth is converted to arrays once. evaluate() then takes
+    the results as arrays and reproduces COCOeval's ignore flags, area
+    ranges, per-image top maxDets detections, greedy matching and
+    precision/recall accumulation, batched over images, OKS thresholds
+    and area ranges. It returns the same 10 stats as summarize().
+    '''
+    stats_names = ['AP', 'Ap .5', 'AP .75', 'AP (M)', 'AP (L)',
+                   'AR', 'AR .5', 'AR .75', 'AR (M)', 'AR (L)']
+
+    def __init__(self, coco, cat_id, sigmas=None):
+        if sigmas is None:
+            sigmas = np.array([
+                .26, .25, .25, .35, .35, .79, .79, .72, .72,
+                .62, .62, 1.07, 1.07, .87, .87, .89, .89
+            ]) / 10.0
+        self.vars = (sigmas * 2) ** 2
+        self.iou_thrs = np.linspace(
+            .5, 0.95, int(np.round((0.95 - .5) / .05)) + 1, endpoint=True)
+        self.rec_thrs = np.linspace(
+            .0, 1.00, int(np.round((1.00 - .0) / .01)) + 1, endpoint=True)
+        self.max_dets = 20
+        self.area_rngs = np.array(
+            [[0 ** 2, 1e5 ** 2], [32 ** 2, 96 ** 2], [96 ** 2, 1e5 ** 2]])
+
+        self.image_ids = np.array(sorted(coco.getImgIds()))
+        anns = coco.loadAnns(
+            coco.getAnnIds(imgIds=self.image_ids.tolist(), catIds=[cat_id]))
+
+        # gt grouped by image in the order of image_ids, file order within
+        gt_images = np.searchsorted(
+            self.image_ids, [ann['image_id'] for ann in anns])
+        order = np.argsort(gt_images, kind='mergesort')
+        anns = [anns[i] for i in order]
+        self.gt_images = gt_images[order]
+        self.gt_keypoints = np.array(
+            [ann['keypoints'] for ann in anns], dtype=np.float64
+        ).reshape((len(anns), -1, 3))
+        self.gt_boxes = np.array(
+            [ann['bbox'] for ann in anns], dtype=np.float64
+        ).reshape((-1, 4))
+        self.gt_areas = np.array([ann['area'] for ann in anns], np.float64)
+        self.gt_crowd = np.array(
+            [bool(ann.get('iscrowd', 0)) for ann in anns], dtype=bool)
+        self.gt_ignore = self.gt_crowd | np.array(
+            [ann['num_keypoints'] == 0 for ann in anns], dtype=bool)
+
+        num_images = len(self.image_ids)
+        counts = np.bincount(self.gt_images, minlength=num_images)
+        self.gt_starts = np.cumsum(counts) - counts
+        self.gt_counts = counts
+
+    def _oks(self, dt_kpts, gt_inds):
+        '''
+        oks between pairs of detections and gt, as computeOks does it
+        :param dt_kpts: [P, num_joints, 3]
+        :param gt_inds: [P]
+        '''
+        g = self.gt_keypoints[gt_inds]
+        vg = g[:, :, 2] > 0
+        no_vis = ~vg.any(axis=1, keepdims=True)
+
+        dx = dt_kpts[:, :, 0] - g[:, :, 0]
+        dy = dt_kpts[:, :, 1] - g[:, :, 1]
+
+        # gt without labelled joints: distance to twice its bbox
+        bb = self.gt_boxes[gt_inds]
+        x0 = (bb[:, 0] - bb[:, 2])[:, None]
+        x1 = (bb[:, 0] + bb[:, 2] * 2)[:, None]
+        y0 = (bb[:, 1] - bb[:, 3])[:, None]
+        y1 = (bb[:, 1] + bb[:, 3] * 2)[:, None]
+        xd = dt_kpts[:, :, 0]
+        yd = dt_kpts[:, :, 1]
+        dx = np.where(
+            no_vis, np.maximum(0, x0 - xd) + np.maximum(0, xd - x1), dx)
+        dy = np.where(
+            no_vis, np.maximum(0, y0 - yd) + np.maximum(0, yd - y1), dy)
+
+        e = (dx ** 2 + dy ** 2) / self.vars \
+            / (self.gt_areas[gt_inds, None] + np.spacing(1)) / 2
+        mask = vg | no_vis
+        return np.sum(np.exp(-e) * mask, axis=1) / mask.sum(axis=1)
+
+    def _match(self, dt_rank, pair_dt, pair_gt, ious, gt_ig):
+        '''
+        Greedy matching of evaluateImg, one detection rank at a time for
+        all images, thresholds and area ranges at once.
+        :return: dt matched and dt ignored, both [A, T, D]
+        '''
+        num_areas = len(self.area_rngs)
+        num_thrs = len(self.iou_thrs)
+        num_dets = len(dt_rank)
+        thrs = np.minimum(self.iou_thrs, 1 - 1e-10)[None, :, None]
+
+        gt_matched = np.zeros(
+            (num_areas, num_thrs, len(self.gt_images)), dtype=bool)
+        dt_matched = np.zeros((num_areas, num_thrs, num_dets), dtype=bool)
+        dt_ig = np.zeros((num_areas, num_thrs, num_dets), dtype=bool)
+
+        pair_rank = dt_rank[pair_dt]
+        for rank in range(self.max_dets):
+            sel = np.where(pair_rank == rank)[0]
+            if len(sel) == 0:
+                break
+            p_dt = pair_dt[sel]
+            p_gt = pair_gt[sel]
+            iou = ious[sel]
+
+            # pairs of one detection are contiguous
+            starts = np.flatnonzero(np.r_[True, p_dt[1:] != p_dt[:-1]])
+            group = np.cumsum(np.r_[False, p_dt[1:] != p_dt[:-1]])
+
+            ig = gt_ig[:, None, p_gt]
+            valid = (iou >= thrs) \
+                & ~(gt_matched[:, :, p_gt] & ~self.gt_crowd[p_gt])
+            # a regular gt is preferred, ignored gt only match otherwise
+            has_regular = np.logical_or.reduceat(
+                valid & ~ig, starts, axis=2)
+            cand = valid & (ig != has_regular[:, :, group])
+            # the best oks, the last gt among ties
+            best_iou = np.maximum.reduceat(
+                np.where(cand, iou, -1), starts, axis=2)
+            cand &= iou == best_iou[:, :, group]
+            best_gt = np.maximum.reduceat(
+                np.where(cand, p_gt, -1), starts, axis=2)
+
+            a, t, k = np.nonzero(best_gt >= 0)
+            m = best_gt[a, t, k]
+            d = p_dt[starts[k]]
+            gt_matched[a, t, m] = True
+            dt_matched[a, t, d] = True
+            dt_ig[a, t, d] = gt_ig[a, m]
+
+        return dt_matched, dt_ig
+
+    def evaluate(self, image_ids, keypoints, scores):
+        '''
+        :param image_ids: [N] coco image id of each result
+        :param keypoints: [N, num_joints, 3]
+        :param scores: [N]
+        :return: the 10 stats of COCOeval.summarize()
+        '''
+        image_ids = np.asarray(image_ids)
+        keypoints = np.asarray(keypoints, dtype=np.float64).reshape(
+            (len(image_ids), -1, 3))
+        scores = np.asarray(scores, dtype=np.float64)
+
+        dt_images = np.searchsorted(self.image_ids, image_ids)
+        dt_images = np.minimum(dt_images, len(self.image_ids) - 1)
+        if len(image_ids) > 0 and \
+                np.any(self.image_ids[dt_images] != image_ids):
+            raise ValueError(
+                'Results do not correspond to current coco set')
+
+        # per image: highest score first, stable, top max_dets
+        order = np.lexsort((-scores, dt_images))
+        dt_images = dt_images[order]
+        counts = np.bincount(dt_images, minlength=len(self.image_ids))
+        dt_rank = np.arange(len(order)) - (np.cumsum(counts) - counts)[dt_images]
+        keep = dt_rank < self.max_dets
+        order = order[keep]
+        dt_images = dt_images[keep]
+        dt_rank = dt_rank[keep]
+        keypoints = keypoints[order]
+        scores = scores[order]
+
+        # detection area as loadRes sets it, extent of the keypoints
+        extent = keypoints[:, :, :2].max(axis=1) - keypoints[:, :, :2].min(axis=1)
+        dt_areas = extent[:, 0] * extent[:, 1]
+
+        # every (detection, gt) pair of the same image
+        num_pairs = self.gt_counts[dt_images]
+        pair_dt = np.repeat(np.arange(len(dt_images)), num_pairs)
+        pair_gt = np.arange(num_pairs.sum()) \
+            - np.repeat(np.cumsum(num_pairs) - num_pairs, num_pairs) \
+            + np.repeat(self.gt_starts[dt_images], num_pairs)
+        ious = self._oks(keypoints[pair_dt], pair_gt)
+
+        lo = self.area_rngs[:, 0:1]
+        hi = self.area_rngs[:, 1:2]
+        gt_ig = self.gt_ignore[None] \
+            | (self.gt_areas[None] < lo) | (self.gt_areas[None] > hi)
+        dt_out = (dt_areas[None] < lo) | (dt_areas[None] > hi)
+
+        dt_matched, dt_ig = self._match(
+            dt_rank, pair_dt, pair_gt, ious, gt_ig)
+        dt_ig |= ~dt_matched & dt_out[:, None, :]
+
+        return self._accumulate(scores, dt_matched, dt_ig, gt_ig)
+
+    def _accumulate(self, scores, dt_matched, dt_ig, gt_ig):
+        num_areas, num_thrs, num_dets = dt_matched.shape
+        num_recs = len(self.rec_thrs)
+        precision = -np.ones((num_thrs, num_recs, num_areas))
+        recall = -np.ones((num_thrs, num_areas))
+
+        inds = np.argsort(-scores, kind='mergesort')
+        dt_matched = dt_matched[:, :, inds]
+        dt_ig = dt_ig[:, :, inds]
+
+        for a in range(num_areas):
+            npig = np.count_nonzero(~gt_ig[a])
+            if npig == 0:
+                continue
+            tp_sum = np.cumsum(dt_matched[a] & ~dt_ig[a], axis=1)
+            fp_sum = np.cumsum(~dt_matched[a] & ~dt_ig[a], axis=1)
+            rc = tp_sum / npig
+            pr = tp_sum / (fp_sum + tp_sum + np.spacing(1))
+            # precision envelope, non increasing in recall
+            pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+
+            recall[:, a] = rc[:, -1] if num_dets else 0
+            for t in range(num_thrs):
+                r_inds = np.searchsorted(rc[t], self.rec_thrs, side='left')
+                valid = r_inds < num_dets
+                precision[t, valid, a] = pr[t, r_inds[valid]]
+                precision[t, ~valid, a] = 0
+
+        def _summarize(s):
+            s = s[s > -1]
+            return np.mean(s) if len(s) else -1
+
+        t50 = np.where(self.iou_thrs == .5)[0]
+        t75 = np.where(self.iou_thrs == .75)[0]
+        return np.array([
+            _summarize(precision[:, :, 0]),
+            _summarize(precision[t50, :, 0]),
+            _summarize(precision[t75, :, 0]),
+            _summarize(precision[:, :, 1]),
+            _summarize(precision[:, :, 2]),
+            _summarize(recall[:, 0]),
+            _summarize(recall[t50, 0]),
+            _summarize(recall[t75, 0]),
+            _summarize(recall[:, 1]),
+            _summarize(recall[:, 2]),
+        ])
@@ -0,0 +1,75 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+import random
+
+import numpy as np
+from torch.utils.data import Sampler
+
+from dataset.columnar import ColumnarDB
+
+
+class ImageGroupedSampler(Sampler):
+    '''
+    Yield the records of one image back to back so that a worker's
+    image cache serves all but the first of them.
+    Without shuffle, images come in order of first appearance in the db,
+    which keeps the db order whenever records of an image are adjacent.
+    With shuffle, the order of images and of records within an image
+    are shuffled every epoch.
+    Results collected in sampler order go back to db order with
+    to_db_order, as evaluate() matches them to the db by position.
+    '''
+    def __init__(self, data_source, shuffle=False):
+        self.data_source = data_source
+        self.shuffle = shuffle
+
+        if isinstance(data_source.db, ColumnarDB):
+            images = data_source.db.column('image')
+        else:
+            images = [rec['image'] for rec in data_source.db]
+
+        groups = OrderedDict()
+        for idx, image in enumerate(images):
+            groups.setdefault(image, []).append(idx)
+        self.groups = list(groups.values())
+
+    def __iter__(self):
+        groups = self.groups
+        if self.shuffle:
+            groups = random.sample(groups, len(groups))
+        for group in groups:
+            if self.shuffle:
+                group = random.sample(group, len(group))
+            for idx in group:
+                yield idx
+
+    def order(self):
+        ''' db indices in the order they are yielded, without shuffle '''
+        assert not self.shuffle, 'the order of a shuffled sampler changes'
+        return [idx for group in self.groups for idx in group]
+
+    def to_db_order(self, values):
+        '''
+        values collected in sampler order, a numpy array or a list, in db
+        order
+        '''
+        order = self.order()
+        if isinstance(values, np.ndarray):
+            result = np.empty_like(values)
+            result[order] = values
+            return result
+        result = [None] * len(values)
+        for idx, value in zip(order, values):
+            result[idx] = value
+        return result
+
+    def __len__(self):
+        return len(self.data_source)
@@ -0,0 +1,264 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+import io
+import json
+import logging
+import os
+import random
+import tarfile
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset
+
+
+logger = logging.getLogger(__name__)
+
+
+def shard_key(image_file, root):
+    '''
+    key of an image in the shards: its path relative to the dataset root,
+    the same for the jpg and the zip layout
+    '''
+    return os.path.relpath(image_file.replace('.zip@', ''), root)
+
+
+def _encode_record(rec, root):
+    rec = dict(rec)
+    rec['image'] = shard_key(rec['image'], root)
+    # numpy fields go back to their dtype when read
+    dtypes = {}
+    for k, v in rec.items():
+        if isinstance(v, (np.ndarray, np.generic)):
+            dtypes[k] = v.dtype.str
+            rec[k] = v.tolist()
+    rec['_dtypes'] = dtypes
+    return rec
+
+
+def _decode_record(rec, root):
+    rec['image'] = os.path.join(root, rec['image'])
+    for k, dtype in rec.pop('_dtypes').items():
+        v = np.asarray(rec[k], dtype=dtype)
+        rec[k] = v if v.ndim else v[()]
+    return rec
+
+
+def write_shards(prefix, db, root, read_bytes, shard_bytes=256 * 1024 ** 2):
+    '''
+    Write the records of db and the encoded bytes of their images to tar
+    shards <prefix>-00000.tar, ... of about shard_bytes each. An image and
+    all its records are one sample, members <n>.<ext> and <n>.json,
+    samples in order of first appearance in db.
+    <prefix>.index.npz maps every image key to its shard and the offset
+    and size of its bytes, for random access.
+    '''
+    groups = OrderedDict()
+    for rec in db:
+        groups.setdefault(rec['image'], []).append(rec)
+
+    directory = os.path.dirname(prefix)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    shards = []
+    num_records = []
+    keys, key_shards, offsets, sizes = [], [], [], []
+    tar = None
+    for n, (image_file, recs) in enumerate(groups.items()):
+        if tar is None or tar.offset >= shard_bytes:
+            if tar is not None:
+                tar.close()
+            shards.append(os.path.basename(
+                '{}-{:05d}.tar'.format(prefix, len(shards))))
+            num_records.append(0)
+            tar = tarfile.open(os.path.join(directory, shards[-1]), 'w')
+
+        data = read_bytes(image_file)
+        ext = os.path.splitext(image_file)[1] or '.jpg'
+        meta = json.dumps([_encode_record(rec, root) for rec in recs])
+        for name, payload in (('{:09d}{}'.format(n, ext), data),
+                              ('{:09d}.json'.format(n), meta.encode())):
+            info = tarfile.TarInfo(name)
+            info.size = len(payload)
+            header = info.tobuf(tar.format, tar.encoding, tar.errors)
+            if name.endswith(ext):
+                keys.append(shard_key(image_file, root))
+                key_shards.append(len(shards) - 1)
+                offsets.append(tar.offset + len(header))
+                sizes.append(len(payload))
+            tar.addfile(info, io.BytesIO(payload))
+        num_records[-1] += len(recs)
+
+        if n % 1000 == 0:
+            logger.info('=> [{}/{}] images written to {} shards'.format(
+                n, len(groups), len(shards)))
+    if tar is not None:
+        tar.close()
+
+    np.savez(
+        prefix + '.index.npz',
+        shards=np.array(shards),
+        num_records=np.array(num_records, dtype=np.int64),
+        keys=np.array(keys),
+        key_shards=np.array(key_shards, dtype=np.int32),
+        offsets=np.array(offsets, dtype=np.int64),
+        sizes=np.array(sizes, dtype=np.int64)
+    )
+    logger.info('=> {}: {} images, {} records in {} shards'.format(
+        prefix, len(keys), sum(num_records), len(shards)))
+
+
+class ShardReader(object):
+    '''
+    Random access to the image bytes of the shards of one image set,
+    read with os.pread so threads and forked workers share the files
+    '''
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._rows = None
+        self._fds = {}
+
+    @staticmethod
+    def exists(prefix):
+        return os.path.isfile(prefix + '.index.npz')
+
+    def _open(self):
+        index = np.load(self.prefix + '.index.npz')
+        directory = os.path.dirname(self.prefix)
+        self.shards = [os.path.join(directory, shard)
+                       for shard in index['shards'].tolist()]
+        self.num_records = index['num_records']
+        self._key_shards = index['key_shards']
+        self._offsets = index['offsets']
+        self._sizes = index['sizes']
+        self._rows = {k: i for i, k in enumerate(index['keys'].tolist())}
+
+    def __len__(self):
+        ''' number of records '''
+        if self._rows is None:
+            self._open()
+        return int(self.num_records.sum())
+
+    def num_shards(self):
+        if self._rows is None:
+            self._open()
+        return len(self.shards)
+
+    def read(self, key):
+        if self._rows is None:
+            self._open()
+        i = self._rows[key]
+        shard = int(self._key_shards[i])
+        fd = self._fds.get(shard)
+        if fd is None:
+            # threads racing here keep the first descriptor
+            fd = os.open(self.shards[shard], os.O_RDONLY)
+            if self._fds.setdefault(shard, fd) != fd:
+                os.close(fd)
+                fd = self._fds[shard]
+        data = os.pread(fd, int(self._sizes[i]), int(self._offsets[i]))
+        return np.frombuffer(data, np.uint8)
+
+    def iter_shard(self, shard, root):
+        '''
+        the samples of one shard in order, read sequentially
+        :return: iterator of (image bytes, records of the image)
+        '''
+        if self._rows is None:
+            self._open()
+        with open(self.shards[shard], 'rb', buffering=1 << 20) as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(
+                    f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            with tarfile.open(fileobj=f, mode='r|') as tar:
+                data = None
+                for member in tar:
+                    payload = tar.extractfile(member).read()
+                    if member.name.endswith('.json'):
+                        recs = [_decode_record(rec, root)
+                                for rec in json.loads(payload.decode())]
+                        yield data, recs
+                    else:
+                        data = np.frombuffer(payload, np.uint8)
+
+
+class ShardedJointsDataset(IterableDataset):
+    '''
+    Streams the shards of a JointsDataset's image set (DATA_FORMAT
+    shards) sequentially, with the dataset's augmentation and targets.
+
+    Every worker reads its own shards, shards[worker_id::num_workers], in
+    an order shuffled per epoch with the seed the workers share. Samples
+    then go through a shuffle buffer of buffer_size records that holds
+    the encoded images; an image is decoded when one of its records
+    leaves the buffer.
+    '''
+    def __init__(self, dataset, shuffle=True, buffer_size=2048):
+        self.dataset = dataset
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.reader = ShardReader(dataset.shard_prefix())
+
+    def __getattr__(self, name):
+        # everything else, e.g. gaussian or flip_pairs, is the dataset's
+        if name == 'dataset':
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def __len__(self):
+        return len(self.reader)
+
+    def _records(self, shards):
+        for shard in shards:
+            for data, recs in self.reader.iter_shard(
+                    shard, self.dataset.root):
+                for rec in recs:
+                    yield data, rec
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is None:
+            worker_id, num_workers = 0, 1
+            seed = random.getrandbits(32)
+        else:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+            seed = worker_info.seed - worker_info.id
+
+        shards = list(range(self.reader.num_shards()))
+        if self.shuffle:
+            random.Random(seed).shuffle(shards)
+        shards = shards[worker_id::num_workers]
+
+        samples = self._records(shards)
+        if not self.shuffle or self.buffer_size <= 1:
+            for data, rec in samples:
+                yield self._process(data, rec)
+            return
+
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.buffer_size:
+                buffer.append(sample)
+                continue
+            i = random.randrange(len(buffer))
+            sample, buffer[i] = buffer[i], sample
+            yield self._process(*sample)
+        random.shuffle(buffer)
+        for sample in buffer:
+            yield self._process(*sample)
+
+    def _process(self, data, rec):
+        augmentation = self.dataset.sample_augmentation(rec)
+        image = self.dataset.decode_reduced(
+            data, rec['image'],
+            self.dataset.decode_reduction(augmentation[1]))
+        return self.dataset.process(rec, *image, augmentation=augmentation)
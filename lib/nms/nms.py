@@ -72,26 +72,53 @@ def nms(dets, thresh):
     return keep
 
 
-def oks_iou(g, d, a_g, a_d, sigmas=None, in_vis_thre=None):
+def _oks_vars(sigmas):
     if not isinstance(sigmas, np.ndarray):
         sigmas = np.array([.26, .25, .25, .35, .35, .79, .79, .72, .72, .62, .62, 1.07, 1.07, .87, .87, .89, .89]) / 10.0
-    vars = (sigmas * 2) ** 2
+    return (sigmas * 2) ** 2
+
+
+def _oks(e, vg, vd, in_vis_thre):
+    """ mean of exp(-e) over the last axis, over joints visible in both """
+    if in_vis_thre is None:
+        return np.sum(np.exp(-e), axis=-1) / e.shape[-1] \
+            if e.shape[-1] != 0 else np.zeros(e.shape[:-1])
+    ind = (vg > in_vis_thre) & (vd > in_vis_thre)
+    num = ind.sum(axis=-1)
+    oks = np.sum(np.exp(-e) * ind, axis=-1)
+    return np.where(num > 0, oks / np.maximum(num, 1), 0.0)
+
+
+def oks_iou(g, d, a_g, a_d, sigmas=None, in_vis_thre=None):
+    vars = _oks_vars(sigmas)
     xg = g[0::3]
     yg = g[1::3]
     vg = g[2::3]
-    ious = np.zeros((d.shape[0]))
-    for n_d in range(0, d.shape[0]):
-        xd = d[n_d, 0::3]
-        yd = d[n_d, 1::3]
-        vd = d[n_d, 2::3]
-        dx = xd - xg
-        dy = yd - yg
-        e = (dx ** 2 + dy ** 2) / vars / ((a_g + a_d[n_d]) / 2 + np.spacing(1)) / 2
-        if in_vis_thre is not None:
-            ind = list(vg > in_vis_thre) and list(vd > in_vis_thre)
-            e = e[ind]
-        ious[n_d] = np.sum(np.exp(-e)) / e.shape[0] if e.shape[0] != 0 else 0.0
-    return ious
+    xd = d[:, 0::3]
+    yd = d[:, 1::3]
+    vd = d[:, 2::3]
+    dx = xd - xg
+    dy = yd - yg
+    e = (dx ** 2 + dy ** 2) / vars / ((a_g + a_d[:, None]) / 2 + np.spacing(1)) / 2
+    return _oks(e, vg, vd, in_vis_thre)
+
+
+def oks_iou_matrix(kpts, areas, sigmas=None, in_vis_thre=None):
+    """
+    oks between all pairs of instances in one broadcast
+    :param kpts: [N, num_joints * 3]
+    :param areas: [N]
+    :return: [N, N], row i is oks_iou(kpts[i], kpts, areas[i], areas)
+    """
+    vars = _oks_vars(sigmas)
+    x = kpts[:, 0::3]
+    y = kpts[:, 1::3]
+    v = kpts[:, 2::3]
+    dx = x[None, :, :] - x[:, None, :]
+    dy = y[None, :, :] - y[:, None, :]
+    e = (dx ** 2 + dy ** 2) / vars \
+        / ((areas[:, None, None] + areas[None, :, None]) / 2 + np.spacing(1)) / 2
+    return _oks(e, v[:, None, :], v[None, :, :], in_vis_thre)
 
 
 def oks_nms(kpts_db, thresh, sigmas=None, in_vis_thre=None):
@@ -109,14 +136,27 @@ def oks_nms(kpts_db, thresh, sigmas=None, in_vis_thre=None):
     kpts = np.array([kpts_db[i]['keypoints'].flatten() for i in range(len(kpts_db))])
     areas = np.array([kpts_db[i]['area'] for i in range(len(kpts_db))])
 
+    return oks_nms_array(kpts, scores, areas, thresh, sigmas, in_vis_thre)
+
+
+def oks_nms_array(kpts, scores, areas, thresh, sigmas=None, in_vis_thre=None):
+    """
+    oks_nms on the stacked instances of one image
+    :param kpts: [N, num_joints * 3] or [N, num_joints, 3]
+    :param scores: [N]
+    :param areas: [N]
+    :return: indexes to keep
+    """
+    kpts = kpts.reshape((kpts.shape[0], -1))
     order = scores.argsort()[::-1]
+    oks = oks_iou_matrix(kpts, areas, sigmas, in_vis_thre)
 
     keep = []
     while order.size > 0:
         i = order[0]
         keep.append(i)
 
-        oks_ovr = oks_iou(kpts[i], kpts[order[1:]], areas[i], areas[order[1:]], sigmas, in_vis_thre)
+        oks_ovr = oks[i, order[1:]]
 
         inds = np.where(oks_ovr <= thresh)[0]
         order = order[inds + 1]
@@ -150,8 +190,21 @@ def soft_oks_nms(kpts_db, thresh, sigmas=None, in_vis_thre=None):
     kpts = np.array([kpts_db[i]['keypoints'].flatten() for i in range(len(kpts_db))])
     areas = np.array([kpts_db[i]['area'] for i in range(len(kpts_db))])
 
+    return soft_oks_nms_array(kpts, scores, areas, thresh, sigmas, in_vis_thre)
+
+
+def soft_oks_nms_array(kpts, scores, areas, thresh, sigmas=None, in_vis_thre=None):
+    """
+    soft_oks_nms on the stacked instances of one image
+    :param kpts: [N, num_joints * 3] or [N, num_joints, 3]
+    :param scores: [N]
+    :param areas: [N]
+    :return: indexes to keep
+    """
+    kpts = kpts.reshape((kpts.shape[0], -1))
     order = scores.argsort()[::-1]
     scores = scores[order]
+    oks = oks_iou_matrix(kpts, areas, sigmas, in_vis_thre)
 
     # max_dets = order.size
     max_dets = 20
@@ -160,7 +213,7 @@ def soft_oks_nms(kpts_db, thresh, sigmas=None, in_vis_thre=None):
     while order.size > 0 and keep_cnt < max_dets:
         i = order[0]
 
-        oks_ovr = oks_iou(kpts[i], kpts[order[1:]], areas[i], areas[order[1:]], sigmas, in_vis_thre)
+        oks_ovr = oks[i, order[1:]]
 
         order = order[1:]
         scores = rescore(oks_ovr, scores[1:], thresh)
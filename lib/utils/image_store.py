@@ -0,0 +1,218 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from utils.transforms import get_scale_transform
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImageStore(object):
+    '''
+    Read-only store of pre-decoded uint8 images.
+
+    All pixels live in one flat file ``<path>.bin`` which is memory-mapped,
+    so forked DataLoader workers share the same page cache. The index
+    ``<path>.index.npz`` holds, per key, the byte offset, the array shape,
+    the size (width, height) of the original image and the region
+    (x0, y0, width, height) of it that was stored. The stored array is
+    smaller than its region when the store was built with ``max_side``.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._rows = None
+        self._offsets = None
+        self._shapes = None
+        self._sizes = None
+        self._regions = None
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(path + '.bin') \
+            and os.path.isfile(path + '.index.npz')
+
+    def _open(self):
+        index = np.load(self.path + '.index.npz')
+        self._offsets = index['offsets']
+        self._shapes = index['shapes']
+        self._sizes = index['sizes']
+        self._regions = index['regions']
+        self._data = np.memmap(self.path + '.bin', dtype=np.uint8, mode='r')
+        # last, other threads take _rows as the store being open
+        self._rows = {k: i for i, k in enumerate(index['keys'].tolist())}
+        logger.info('=> opened image store {} ({} images)'.format(
+            self.path, len(self._rows)))
+
+    def __len__(self):
+        if self._rows is None:
+            self._open()
+        return len(self._rows)
+
+    def __contains__(self, key):
+        if self._rows is None:
+            self._open()
+        return key in self._rows
+
+    def get(self, key):
+        '''
+        :return: image (read-only view), original size (width, height) and
+                 the 2x3 affine mapping original pixel coords to the stored
+                 array, None if the image is stored at full resolution
+        '''
+        if self._rows is None:
+            self._open()
+        i = self._rows[key]
+        shape = tuple(self._shapes[i])
+        start = self._offsets[i]
+        end = start + int(np.prod(shape))
+        image = self._data[start:end].reshape(shape)
+
+        width, height = int(self._sizes[i][0]), int(self._sizes[i][1])
+        x0, y0, region_w, region_h = self._regions[i]
+        if x0 == 0 and y0 == 0 \
+                and shape[1] == width == region_w \
+                and shape[0] == height == region_h:
+            return image, (width, height), None
+
+        trans = get_scale_transform(
+            (region_w, region_h), (shape[1], shape[0]))
+        trans[:, 2] -= np.dot(trans[:, :2], [x0, y0])
+        return image, (width, height), trans
+
+    @staticmethod
+    def build(path, keys, read_fn, max_side=0):
+        '''
+        Decode every key once with read_fn and write the store.
+        read_fn returns either a full image or a tuple (patch, size of the
+        image, (x0, y0) of the patch in it).
+        Arrays whose longer side exceeds max_side are downscaled to it.
+        '''
+        offsets = []
+        shapes = []
+        sizes = []
+        regions = []
+        offset = 0
+        tmp_path = path + '.bin.tmp'
+        with open(tmp_path, 'wb') as f:
+            for i, key in enumerate(keys):
+                image = read_fn(key)
+                if isinstance(image, tuple):
+                    image, size, origin = image
+                else:
+                    size, origin = None, (0, 0)
+                if image is None:
+                    raise ValueError('Fail to read {}'.format(key))
+                if image.ndim == 2:
+                    image = image[:, :, None]
+                region_h, region_w = image.shape[:2]
+                if size is None:
+                    size = (region_w, region_h)
+                if max_side > 0 and max(region_h, region_w) > max_side:
+                    ratio = max_side / max(region_h, region_w)
+                    image = cv2.resize(
+                        image,
+                        (max(1, int(round(region_w * ratio))),
+                         max(1, int(round(region_h * ratio)))),
+                        interpolation=cv2.INTER_AREA
+                    )
+                    if image.ndim == 2:
+                        image = image[:, :, None]
+                image = np.ascontiguousarray(image, dtype=np.uint8)
+                f.write(image.tobytes())
+
+                offsets.append(offset)
+                shapes.append(image.shape)
+                sizes.append(size)
+                regions.append((origin[0], origin[1], region_w, region_h))
+                offset += image.nbytes
+
+                if i % 1000 == 0:
+                    logger.info('=> [{}/{}] {:.2f} GB written'.format(
+                        i, len(keys), offset / 1024 ** 3))
+
+        np.savez(
+            path + '.index.npz',
+            keys=np.array(keys),
+            offsets=np.array(offsets, dtype=np.int64),
+            shapes=np.array(shapes, dtype=np.int32).reshape((-1, 3)),
+            sizes=np.array(sizes, dtype=np.int32).reshape((-1, 2)),
+            regions=np.array(regions, dtype=np.int32).reshape((-1, 4))
+        )
+        os.rename(tmp_path, path + '.bin')
+        logger.info('=> image store {} done: {} images, {:.2f} GB'.format(
+            path, len(keys), offset / 1024 ** 3))
+
+
+
+class LRUImageCache(object):
+    '''
+    Bounded cache of decoded images, least recently used evicted first.
+    Cached arrays are made read-only since several samples share them.
+    get and put may be called from the threads of DATASET.PREFETCH_THREADS.
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, image, *extra):
+        with self._lock:
+            if image.nbytes > self.max_bytes or key in self._items:
+                return
+            while self._items \
+                    and self.nbytes + image.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= evicted[0].nbytes
+                self.evictions += 1
+            image.flags.writeable = False
+            self._items[key] = (image,) + extra
+            self.nbytes += image.nbytes
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return 'hits {} ({:.1%}) misses {} evictions {} ' \
+            'size {} images {:.1f} MB'.format(
+                self.hits, self.hits / lookups if lookups else 0,
+                self.misses, self.evictions, len(self._items),
+                self.nbytes / 1024 ** 2)
@@ -10,12 +10,20 @@ from __future__ import print_function
 
 import numpy as np
 import cv2
+import torch
 
 
 def flip_back(output_flipped, matched_parts):
     '''
     ouput_flipped: numpy.ndarray(batch_size, num_joints, height, width)
+                   or a torch.Tensor, flipped on its own device
     '''
+    if isinstance(output_flipped, torch.Tensor):
+        perm = list(range(output_flipped.size(1)))
+        for pair in matched_parts:
+            perm[pair[0]], perm[pair[1]] = pair[1], pair[0]
+        return output_flipped.flip(3)[:, perm]
+
     assert output_flipped.ndim == 4,\
         'output_flipped should be [batch_size, num_joints, height, width]'
 
@@ -48,66 +56,189 @@ def fliplr_joints(joints, joints_vis, width, matched_parts):
 
 def transform_preds(coords, center, scale, output_size):
     target_coords = np.zeros(coords.shape)
-    trans = get_affine_transform(center, scale, 0, output_size, inv=1)
-    for p in range(coords.shape[0]):
-        target_coords[p, 0:2] = affine_transform(coords[p, 0:2], trans)
+    trans = get_affine_transforms(center, scale, 0, output_size, inv=1)
+    target_coords[:, 0:2] = affine_transforms(coords[None, :, 0:2], trans)[0]
     return target_coords
 
 
-def get_affine_transform(
-        center, scale, rot, output_size,
-        shift=np.array([0, 0], dtype=np.float32), inv=0
-):
-    if not isinstance(scale, np.ndarray) and not isinstance(scale, list):
-        print(scale)
-        scale = np.array([scale, scale])
+def get_affine_transforms(center, scale, rot, output_size, shift=None,
+                          inv=0):
+    '''
+    closed form of get_affine_transform for a batch of crops
+    center: [N, 2], scale: [N, 2] or [N], rot: [N] or scalar, in degrees
+    shift: [N, 2] or [2], moves the source center by shift * scale * 200
+    return: [N, 2, 3], inverse transforms if inv
+    '''
+    center = np.asarray(center, dtype=np.float64).reshape((-1, 2))
+    scale = np.asarray(scale, dtype=np.float64)
+    if scale.ndim == 2 or scale.size == 2 * center.shape[0]:
+        scale = scale.reshape((-1, 2))
+    else:
+        scale = np.broadcast_to(
+            scale.reshape((-1, 1)), center.shape[:1] + (2,))
+    if shift is not None:
+        center = center + scale * 200.0 * np.asarray(shift, np.float64)
+    scale = scale[:, 0]
+    rot_rad = np.pi * np.broadcast_to(
+        np.asarray(rot, dtype=np.float64), center.shape[:1]) / 180
+
+    # crops are similarities: scale by dst_w / src_w and rotate by -rot
+    # around center, then move center to the middle of the output
+    dst_center = np.array(
+        [output_size[0] * 0.5, output_size[1] * 0.5], dtype=np.float64)
+    sn, cs = np.sin(rot_rad), np.cos(rot_rad)
+    trans = np.zeros((center.shape[0], 2, 3), dtype=np.float64)
+    if inv:
+        ratio = (scale * 200.0) / output_size[0]
+        trans[:, 0, 0] = ratio * cs
+        trans[:, 0, 1] = -ratio * sn
+        trans[:, 1, 0] = ratio * sn
+        trans[:, 1, 1] = ratio * cs
+        trans[:, :, 2] = center - np.dot(trans[:, :, :2], dst_center)
+    else:
+        ratio = output_size[0] / (scale * 200.0)
+        trans[:, 0, 0] = ratio * cs
+        trans[:, 0, 1] = ratio * sn
+        trans[:, 1, 0] = -ratio * sn
+        trans[:, 1, 1] = ratio * cs
+        trans[:, :, 2] = dst_center - np.einsum(
+            'nij,nj->ni', trans[:, :, :2], center)
 
-    scale_tmp = scale * 200.0
-    src_w = scale_tmp[0]
-    dst_w = output_size[0]
-    dst_h = output_size[1]
+    return trans
 
-    rot_rad = np.pi * rot / 180
-    src_dir = get_dir([0, src_w * -0.5], rot_rad)
-    dst_dir = np.array([0, dst_w * -0.5], np.float32)
 
-    src = np.zeros((3, 2), dtype=np.float32)
-    dst = np.zeros((3, 2), dtype=np.float32)
-    src[0, :] = center + scale_tmp * shift
-    src[1, :] = center + src_dir + scale_tmp * shift
-    dst[0, :] = [dst_w * 0.5, dst_h * 0.5]
-    dst[1, :] = np.array([dst_w * 0.5, dst_h * 0.5]) + dst_dir
+def affine_transforms(pts, trans):
+    '''
+    pts: [N, K, 2], trans: [N, 2, 3]
+    return: [N, K, 2], pts[n] transformed by trans[n]
+    '''
+    return np.einsum('nij,nkj->nki', trans[:, :, :2], pts) \
+        + trans[:, None, :, 2]
 
-    src[2:, :] = get_3rd_point(src[0, :], src[1, :])
-    dst[2:, :] = get_3rd_point(dst[0, :], dst[1, :])
 
-    if inv:
-        trans = cv2.getAffineTransform(np.float32(dst), np.float32(src))
-    else:
-        trans = cv2.getAffineTransform(np.float32(src), np.float32(dst))
+def get_source_windows(trans, output_size, image_size):
+    '''
+    [N, 4] windows [x0, y0, x1, y1) of an image of image_size (width,
+    height) that cv2.warpAffine with trans [N, 2, 3] samples for an
+    output_size crop, one pixel wider for the bilinear interpolation and
+    clipped to the image, never empty
+    '''
+    trans = np.asarray(trans, dtype=np.float64).reshape((-1, 2, 3))
+    w, h = float(output_size[0]), float(output_size[1])
+    corners = np.array([[0, 0], [w - 1, 0], [0, h - 1], [w - 1, h - 1]])
+
+    # invert the 2x2 part in closed form
+    a, b = trans[:, 0, 0], trans[:, 0, 1]
+    c, d = trans[:, 1, 0], trans[:, 1, 1]
+    det = a * d - b * c
+    inv = np.empty_like(trans)
+    inv[:, 0, 0], inv[:, 0, 1] = d / det, -b / det
+    inv[:, 1, 0], inv[:, 1, 1] = -c / det, a / det
+    inv[:, :, 2] = -np.einsum('nij,nj->ni', inv[:, :, :2], trans[:, :, 2])
+    src = affine_transforms(
+        np.broadcast_to(corners, (len(trans), 4, 2)), inv)
+
+    size = np.array(image_size[:2], dtype=np.float64)
+    lo = np.clip(np.floor(src.min(axis=1)) - 1, 0, size - 1)
+    hi = np.clip(np.ceil(src.max(axis=1)) + 2, lo + 1, size)
+    return np.concatenate([lo, hi], axis=1).astype(np.int64)
+
+
+def crop_source_window(image, trans, output_size):
+    '''
+    copy of the part of image that cv2.warpAffine(image, trans,
+    output_size) samples, so the rest of a large image can be released
+    :return: window, trans shifted onto it and the (x0, y0) of the window
+    '''
+    x0, y0, x1, y1 = get_source_windows(
+        trans, output_size, (image.shape[1], image.shape[0]))[0]
+    window = np.ascontiguousarray(image[y0:y1, x0:x1])
+    trans = np.array(trans, dtype=np.float64)
+    trans[:, 2] += np.dot(trans[:, :2], [x0, y0])
+    return window, trans, (int(x0), int(y0))
 
-    return trans
 
+def get_affine_transform(
+        center, scale, rot, output_size,
+        shift=np.array([0, 0], dtype=np.float32), inv=0
+):
+    if not isinstance(scale, np.ndarray) and not isinstance(scale, list):
+        scale = np.array([scale, scale])
 
-def affine_transform(pt, t):
-    new_pt = np.array([pt[0], pt[1], 1.]).T
-    new_pt = np.dot(t, new_pt)
-    return new_pt[:2]
+    return get_affine_transforms(
+        center, scale, rot, output_size, shift=shift, inv=inv)[0]
 
 
-def get_3rd_point(a, b):
-    direct = a - b
-    return b + np.array([-direct[1], direct[0]], dtype=np.float32)
+def get_scale_transform(src_size, dst_size):
+    '''
+    affine mapping pixel coords of an image of src_size (width, height)
+    to the same image resized to dst_size, pixel centers aligned
+    '''
+    sx = dst_size[0] / src_size[0]
+    sy = dst_size[1] / src_size[1]
+    return np.array(
+        [[sx, 0., 0.5 * sx - 0.5],
+         [0., sy, 0.5 * sy - 0.5]],
+        dtype=np.float64
+    )
 
 
-def get_dir(src_point, rot_rad):
-    sn, cs = np.sin(rot_rad), np.cos(rot_rad)
+def affine_transform(pt, t):
+    return affine_transforms(np.asarray(pt)[None, None, 0:2], t[None])[0, 0]
 
-    src_result = [0, 0]
-    src_result[0] = src_point[0] * cs - src_point[1] * sn
-    src_result[1] = src_point[0] * sn + src_point[1] * cs
 
-    return src_result
+def warp_affine_torch(images, trans, output_size, mean=None, std=None,
+                      bgr_to_rgb=False):
+    '''
+    cv2.warpAffine of a whole batch with one affine_grid / grid_sample,
+    bilinear with a zero border, followed by ToTensor and Normalize
+    images: torch.Tensor([batch_size, height, width, 3]) uint8, on the
+            device to warp on, may be zero padded on the bottom and right
+    trans: [batch_size, 2, 3] cv2 matrices mapping images to the output
+    output_size: (width, height)
+    return: torch.Tensor([batch_size, 3, out_height, out_width]) float
+    '''
+    batch_size, height, width = images.shape[0:3]
+    out_w, out_h = int(output_size[0]), int(output_size[1])
+
+    # pixel -> [-1, 1] with align_corners=True, pixel centers on the ends
+    def normalize(w, h):
+        return np.array([[2. / (w - 1), 0, -1],
+                         [0, 2. / (h - 1), -1],
+                         [0, 0, 1]])
+
+    trans = np.asarray(trans, dtype=np.float64).reshape((-1, 2, 3))
+    trans = np.concatenate(
+        [trans, np.tile([[[0, 0, 1]]], (len(trans), 1, 1))], axis=1)
+    # grid_sample samples the input at theta @ output
+    theta = np.matmul(
+        np.matmul(normalize(width, height), np.linalg.inv(trans)),
+        np.linalg.inv(normalize(out_w, out_h)))[:, 0:2]
+    theta = torch.from_numpy(theta).to(device=images.device,
+                                       dtype=torch.float32)
+
+    images = images.permute(0, 3, 1, 2).float()
+    if bgr_to_rgb:
+        images = images.flip(1)
+    grid = torch.nn.functional.affine_grid(
+        theta, (batch_size, 3, out_h, out_w), align_corners=True)
+    output = torch.nn.functional.grid_sample(
+        images, grid, mode='bilinear', padding_mode='zeros',
+        align_corners=True)
+
+    return normalize_torch(output, mean, std)
+
+
+def normalize_torch(images, mean=None, std=None):
+    '''
+    ToTensor and Normalize of a batch as one fused multiply-add
+    images: torch.Tensor([batch_size, 3, height, width]) float in [0, 255]
+    '''
+    mean = np.zeros(3) if mean is None else np.asarray(mean, np.float64)
+    std = np.ones(3) if std is None else np.asarray(std, np.float64)
+    scale = images.new_tensor(1. / (255. * std)).view(1, -1, 1, 1)
+    bias = images.new_tensor(-mean / std).view(1, -1, 1, 1)
+    return torch.addcmul(bias, images, scale)
 
 
 def crop(img, center, scale, output_size, rot=0):
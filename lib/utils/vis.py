@@ -131,7 +131,7 @@ def save_debug_images(config, input, meta, target, joints_pred, output,
             input, joints_pred, meta['joints_vis'],
             '{}_pred.jpg'.format(prefix)
         )
-    if config.DEBUG.SAVE_HEATMAPS_GT:
+    if config.DEBUG.SAVE_HEATMAPS_GT and target.dim() == 4:
         save_batch_heatmaps(
             input, target, '{}_hm_gt.jpg'.format(prefix)
         )
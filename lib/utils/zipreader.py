@@ -8,63 +8,112 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import mmap
 import os
+import struct
+import threading
 import zipfile
 import xml.etree.ElementTree as ET
 
 import cv2
 import numpy as np
 
-_im_zfile = []
-_xml_path_zip = []
-_xml_zfile = []
+# archives indexed by this process, by zip path
+_archives = {}
+_archives_lock = threading.Lock()
+# ZipFile handles of this thread, by zip path, for compressed members
+_local = threading.local()
 
 
-def imread(filename, flags=cv2.IMREAD_COLOR):
-    global _im_zfile
-    path = filename
-    pos_at = path.index('@')
+def _after_fork():
+    # forked workers must not share handles, file offsets or a held lock
+    global _archives, _archives_lock, _local
+    _archives = {}
+    _archives_lock = threading.Lock()
+    _local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class _Archive(object):
+    '''
+    the central directory of one zip as an offset table, read once, and
+    the zip mapped in memory to slice stored members out of it
+    '''
+    def __init__(self, path):
+        with zipfile.ZipFile(path, 'r') as zf:
+            self.members = {
+                info.filename: (info.header_offset, info.compress_size,
+                                info.compress_type == zipfile.ZIP_STORED
+                                and not info.flag_bits & 0x1)
+                for info in zf.infolist()
+            }
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+
+    def read(self, name):
+        if name not in self.members:
+            raise KeyError(
+                'There is no item named %r in the archive' % name)
+        header_offset, size, stored = self.members[name]
+        if not stored:
+            return np.frombuffer(_zipfile(self.path).read(name), np.uint8)
+
+        # the data follows the local header, whose name and extra field
+        # lengths may differ from the central directory's
+        name_len, extra_len = struct.unpack_from(
+            '<HH', self.mm, header_offset + 26)
+        offset = header_offset + zipfile.sizeFileHeader + name_len + extra_len
+        return np.frombuffer(self.mm, np.uint8, count=size, offset=offset)
+
+
+def _archive(path_zip):
+    archive = _archives.get(path_zip)
+    if archive is None:
+        with _archives_lock:
+            archive = _archives.get(path_zip)
+            if archive is None:
+                archive = _archives[path_zip] = _Archive(path_zip)
+    return archive
+
+
+def _zipfile(path_zip):
+    handles = getattr(_local, 'zipfiles', None)
+    if handles is None:
+        handles = _local.zipfiles = {}
+    if path_zip not in handles:
+        handles[path_zip] = zipfile.ZipFile(path_zip, 'r')
+    return handles[path_zip]
+
+
+def _split_path(path):
+    pos_at = path.find('@')
     if pos_at == -1:
         print("character '@' is not found from the given path '%s'"%(path))
         assert 0
     path_zip = path[0: pos_at]
-    path_img = path[pos_at + 2:]
+    path_member = path[pos_at + 2:]
     if not os.path.isfile(path_zip):
         print("zip file '%s' is not found"%(path_zip))
         assert 0
-    for i in range(len(_im_zfile)):
-        if _im_zfile[i]['path'] == path_zip:
-            data = _im_zfile[i]['zipfile'].read(path_img)
-            return cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    return path_zip, path_member
+
+
+def read(filename):
+    '''
+    bytes of 'archive.zip@/member' as a uint8 array, a view into the
+    mapped zip for stored members
+    '''
+    path_zip, path_member = _split_path(filename)
+    return _archive(path_zip).read(path_member)
 
-    _im_zfile.append({
-        'path': path_zip,
-        'zipfile': zipfile.ZipFile(path_zip, 'r')
-    })
-    data = _im_zfile[-1]['zipfile'].read(path_img)
 
-    return cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+def imread(filename, flags=cv2.IMREAD_COLOR):
+    return cv2.imdecode(read(filename), flags)
 
 
 def xmlread(filename):
-    global _xml_path_zip
-    global _xml_zfile
-    path = filename
-    pos_at = path.index('@')
-    if pos_at == -1:
-        print("character '@' is not found from the given path '%s'"%(path))
-        assert 0
-    path_zip = path[0: pos_at]
-    path_xml = path[pos_at + 2:]
-    if not os.path.isfile(path_zip):
-        print("zip file '%s' is not found"%(path_zip))
-        assert 0
-    for i in xrange(len(_xml_path_zip)):
-        if _xml_path_zip[i] == path_zip:
-            data = _xml_zfile[i].open(path_xml)
-            return ET.fromstring(data.read())
-    _xml_path_zip.append(path_zip)
-    print("read new xml file '%s'"%(path_zip))
-    _xml_zfile.append(zipfile.ZipFile(path_zip, 'r'))
-    data = _xml_zfile[-1].open(path_xml)
-    return ET.fromstring(data.read())
+    return ET.fromstring(read(filename).tobytes())
@@ -0,0 +1,222 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# Parity of DATASET.CROP_BACKEND torch, the batch warped by
+# warp_affine_torch and normalized by normalize_torch, with the cv2
+# crops through ToTensor and Normalize. Run with pytest, or as a script
+# to print the measured differences.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+import torch
+
+import _init_paths
+from config import cfg
+from dataset.JointsDataset import JointsDataset
+from dataset.collate import collate_padded_images
+from utils.transforms import get_affine_transform
+from utils.transforms import normalize_torch
+from utils.transforms import warp_affine_torch
+
+
+NUM_JOINTS = 17
+IMAGE_SIZE = [192, 256]
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+# (width, height), images of different sizes are zero padded in a batch
+JPEG_SIZES = ((640, 480), (480, 640), (333, 517), (800, 600))
+BATCH_SIZE = 8
+
+
+class CropDataset(JointsDataset):
+    '''
+    records on images of different sizes, some boxes reaching over the
+    image border
+    '''
+    def __init__(self, config, directory, is_train, transform):
+        super(CropDataset, self).__init__(
+            config, directory, 'crop_parity', is_train, transform)
+        self.num_joints = NUM_JOINTS
+        self.aspect_ratio = IMAGE_SIZE[0] / IMAGE_SIZE[1]
+        self.flip_pairs = [[1, 2], [3, 4], [5, 6], [7, 8], [9, 10],
+                           [11, 12], [13, 14], [15, 16]]
+        self.upper_body_ids = tuple(range(11))
+
+        rng = np.random.RandomState(1)
+        for i, (width, height) in enumerate(JPEG_SIZES):
+            for k in range(BATCH_SIZE):
+                joints = np.zeros((NUM_JOINTS, 3))
+                joints[:, 0] = rng.uniform(0, width, NUM_JOINTS)
+                joints[:, 1] = rng.uniform(0, height, NUM_JOINTS)
+                joints_vis = np.zeros((NUM_JOINTS, 3))
+                joints_vis[:, 0:2] = (rng.rand(NUM_JOINTS) > 0.2)[:, None]
+                # every other box centered near a border
+                center = rng.uniform([0, 0], [width, height]) if k % 2 \
+                    else rng.uniform([-40, -40], [40, 40]) \
+                    + [width, height] * rng.randint(0, 2, 2)
+                scale = rng.uniform(0.5, 3.0)
+                self.db.append({
+                    'image': os.path.join(directory, '{}.jpg'.format(i)),
+                    'center': np.array(center, dtype=np.float32),
+                    'scale': np.array([scale, scale / self.aspect_ratio],
+                                      dtype=np.float32),
+                    'joints_3d': joints,
+                    'joints_3d_vis': joints_vis,
+                    'filename': '',
+                    'imgnum': 0,
+                })
+
+
+def write_jpegs(directory):
+    rng = np.random.RandomState(0)
+    for i, (width, height) in enumerate(JPEG_SIZES):
+        image = cv2.GaussianBlur(rng.randint(
+            0, 256, (height, width, 3)).astype(np.uint8), (0, 0), 1.5)
+        cv2.imwrite(os.path.join(directory, '{}.jpg'.format(i)), image,
+                    [cv2.IMWRITE_JPEG_QUALITY, 95])
+
+
+def to_tensor_normalize(image):
+    '''
+    transforms.Compose([transforms.ToTensor(), transforms.Normalize(MEAN,
+    STD)]) of the tools on a uint8 HWC image, spelled out
+    '''
+    image = torch.from_numpy(
+        np.ascontiguousarray(image.transpose(2, 0, 1))).float().div(255.)
+    mean = torch.tensor(MEAN).view(3, 1, 1)
+    std = torch.tensor(STD).view(3, 1, 1)
+    return (image - mean) / std
+
+
+def make_dataset(directory, is_train, backend, color_rgb):
+    config = cfg.clone()
+    config.defrost()
+    config.MODEL.IMAGE_SIZE = IMAGE_SIZE
+    config.MODEL.HEATMAP_SIZE = [IMAGE_SIZE[0] // 4, IMAGE_SIZE[1] // 4]
+    config.DATASET.CROP_BACKEND = backend
+    config.DATASET.COLOR_RGB = color_rgb
+    config.DATASET.ROT_FACTOR = 40
+    config.DATASET.PROB_HALF_BODY = 0.3
+    config.freeze()
+    return CropDataset(config, directory, is_train, to_tensor_normalize)
+
+
+def samples(dataset, indices, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    return [dataset[idx] for idx in indices]
+
+
+def compare(directory, is_train, color_rgb, seed):
+    '''
+    one batch of each image size, through both backends with the same
+    augmentation
+    :return: largest difference in grey levels, mean absolute difference
+             in grey levels and whether the batches had flipped and
+             rotated samples
+    '''
+    cv2_dataset = make_dataset(directory, is_train, 'cv2', color_rgb)
+    torch_dataset = make_dataset(directory, is_train, 'torch', color_rgb)
+    # grey levels of the normalized input
+    levels = torch.tensor(STD).view(1, 3, 1, 1) * 255.
+
+    worst, total, count = 0., 0., 0
+    flipped = rotated = False
+    for start in range(0, len(cv2_dataset), BATCH_SIZE):
+        # a batch across all image sizes
+        indices = [(start + k * BATCH_SIZE + k) % len(cv2_dataset)
+                   for k in range(BATCH_SIZE)]
+        expected = torch.utils.data.dataloader.default_collate(
+            samples(cv2_dataset, indices, seed + start))
+        input, target, target_weight, meta = collate_padded_images(
+            samples(torch_dataset, indices, seed + start))
+
+        np.testing.assert_array_equal(target.numpy(), expected[1].numpy())
+        output = warp_affine_torch(
+            input, meta['trans'], IMAGE_SIZE, mean=MEAN, std=STD,
+            bgr_to_rgb=color_rgb)
+        assert output.shape == expected[0].shape
+        diff = ((output - expected[0]).abs() * levels)
+        worst = max(worst, diff.max().item())
+        total += diff.sum().item()
+        count += diff.numel()
+        # the torch backend folds the flip into the warp
+        flipped |= bool((np.linalg.det(
+            meta['trans'][:, :, 0:2].numpy()) < 0).any())
+        rotated |= bool((meta['rotation'] != 0).any())
+    return worst, total / count, flipped, rotated
+
+
+def test_normalize_torch():
+    rng = np.random.RandomState(2)
+    images = rng.randint(0, 256, (4, 32, 24, 3)).astype(np.uint8)
+    expected = torch.stack([to_tensor_normalize(image) for image in images])
+    output = normalize_torch(
+        torch.from_numpy(images).permute(0, 3, 1, 2).float(), MEAN, STD)
+    np.testing.assert_allclose(output.numpy(), expected.numpy(), atol=1e-5)
+
+
+def test_warp_outside_image():
+    # crops over the border and into the padding of a smaller image
+    rng = np.random.RandomState(3)
+    image = rng.randint(1, 256, (60, 80, 3)).astype(np.uint8)
+    padded = np.zeros((1, 100, 120, 3), dtype=np.uint8)
+    padded[0, :60, :80] = image
+    for center in ([0, 0], [79, 59], [100, 90], [40, 30]):
+        trans = get_affine_transform(
+            np.array(center, dtype=np.float32),
+            np.array([0.6, 0.8]), 25, [48, 64])
+        expected = cv2.warpAffine(image, trans, (48, 64),
+                                  flags=cv2.INTER_LINEAR)
+        output = warp_affine_torch(
+            torch.from_numpy(padded), trans[None], [48, 64])
+        output = output[0].permute(1, 2, 0).numpy() * 255.
+        # bilinear weights in 1/32 steps in cv2, exact in torch
+        assert np.abs(output - expected).max() <= 8
+        assert np.abs(output - expected).mean() < 0.5
+
+
+def check_samples(directory):
+    results = []
+    for is_train in (False, True):
+        for color_rgb in (False, True):
+            worst, mean, flipped, rotated = compare(
+                directory, is_train, color_rgb, 0)
+            if is_train:
+                assert flipped and rotated
+            # bilinear weights in 1/32 steps in cv2, exact in torch
+            assert worst <= 8
+            assert mean < 0.5
+            results.append((is_train, color_rgb, worst, mean))
+    return results
+
+
+def test_samples(tmp_path):
+    write_jpegs(str(tmp_path))
+    check_samples(str(tmp_path))
+
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    try:
+        write_jpegs(directory)
+        test_normalize_torch()
+        test_warp_outside_image()
+        for is_train, color_rgb, worst, mean in check_samples(directory):
+            print('{} {}: worst {:.2f}, mean {:.3f} grey levels from the '
+                  'cv2 crops'.format('train' if is_train else 'test',
+                                     'RGB' if color_rgb else 'BGR',
+                                     worst, mean))
+    finally:
+        shutil.rmtree(directory)
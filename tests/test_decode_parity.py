@@ -0,0 +1,153 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# Parity of TEST.DECODE_ON_DEVICE, the heatmaps decoded by
+# get_final_preds_torch, flip_back and accuracy on tensors, with the
+# numpy decoding. Run with pytest, or as a script to time both.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as np
+import torch
+
+import _init_paths
+from config import cfg
+from core.evaluate import accuracy
+from core.inference import get_final_preds
+from core.inference import get_final_preds_torch
+from core.inference import get_max_preds
+from core.inference import get_max_preds_torch
+from utils.transforms import flip_back
+
+
+NUM_JOINTS = 17
+HEATMAP_SIZE = [48, 64]
+FLIP_PAIRS = [[1, 2], [3, 4], [5, 6], [7, 8], [9, 10],
+              [11, 12], [13, 14], [15, 16]]
+
+
+def make_config(post_process, target_type='gaussian'):
+    config = cfg.clone()
+    config.defrost()
+    config.MODEL.HEATMAP_SIZE = HEATMAP_SIZE
+    config.MODEL.TARGET_TYPE = target_type
+    config.TEST.POST_PROCESS = post_process
+    config.freeze()
+    return config
+
+
+def random_heatmaps(rng, batch_size):
+    '''
+    noisy gaussians anywhere in the heatmap, on the border too, and some
+    heatmaps without a positive value
+    '''
+    w, h = HEATMAP_SIZE
+    yy, xx = np.mgrid[0:h, 0:w]
+    mu = rng.uniform(-2, [w + 1, h + 1], (batch_size, NUM_JOINTS, 2))
+    heatmaps = np.exp(
+        -((xx - mu[:, :, 0, None, None]) ** 2
+          + (yy - mu[:, :, 1, None, None]) ** 2) / 8.)
+    heatmaps += rng.normal(0, 0.02, heatmaps.shape)
+    heatmaps[rng.rand(batch_size, NUM_JOINTS) < 0.05] -= 2
+    return heatmaps.astype(np.float32)
+
+
+def random_boxes(rng, batch_size):
+    center = rng.uniform(0, 1000, (batch_size, 2)).astype(np.float32)
+    scale = rng.uniform(0.3, 5, (batch_size, 1)) * [1, 4 / 3.]
+    return center, scale.astype(np.float32)
+
+
+def test_get_max_preds():
+    rng = np.random.RandomState(0)
+    heatmaps = random_heatmaps(rng, 64)
+    preds, maxvals = get_max_preds_torch(torch.from_numpy(heatmaps))
+    expected, expected_maxvals = get_max_preds(heatmaps)
+    np.testing.assert_array_equal(preds.numpy(), expected)
+    np.testing.assert_array_equal(maxvals.numpy(), expected_maxvals)
+
+
+def test_get_final_preds():
+    rng = np.random.RandomState(1)
+    for target_type, post_process in (('gaussian', True),
+                                      ('gaussian', False),
+                                      ('integral', False)):
+        config = make_config(post_process, target_type)
+        for batch_size in (1, 32):
+            heatmaps = random_heatmaps(rng, batch_size)
+            center, scale = random_boxes(rng, batch_size)
+            expected, expected_maxvals = get_final_preds(
+                config, heatmaps, center, scale)
+            # boxes as numpy arrays and as tensors
+            for boxes in ((center, scale), (torch.from_numpy(center),
+                                            torch.from_numpy(scale))):
+                preds, maxvals = get_final_preds_torch(
+                    config, torch.from_numpy(heatmaps), *boxes)
+                np.testing.assert_array_equal(
+                    maxvals.numpy(), expected_maxvals)
+                # float32 on coordinates up to about 1600 px
+                np.testing.assert_allclose(
+                    preds.numpy(), expected, rtol=0, atol=1e-3)
+
+
+def test_flip_back():
+    rng = np.random.RandomState(2)
+    heatmaps = random_heatmaps(rng, 8)
+    expected = flip_back(heatmaps.copy(), FLIP_PAIRS)
+    output = flip_back(torch.from_numpy(heatmaps), FLIP_PAIRS)
+    np.testing.assert_array_equal(output.numpy(), expected)
+
+
+def test_accuracy():
+    rng = np.random.RandomState(3)
+    output = random_heatmaps(rng, 32)
+    # targets near the outputs, some joints without a target
+    target = np.roll(output, rng.randint(-3, 4), axis=3)
+    target[rng.rand(32, NUM_JOINTS) < 0.2] = 0
+    expected = accuracy(output, target)
+    result = accuracy(torch.from_numpy(output), torch.from_numpy(target))
+    np.testing.assert_array_equal(result[0], expected[0])
+    assert result[1] == expected[1]
+    assert result[2] == expected[2]
+    np.testing.assert_array_equal(result[3], expected[3])
+
+    # joint locations as targets, as for the 'integral' target type
+    joints = np.concatenate(
+        [get_max_preds(target)[0], rng.randint(0, 2, (32, NUM_JOINTS, 1))],
+        axis=2).astype(np.float32)
+    expected = accuracy(output, joints)
+    result = accuracy(torch.from_numpy(output), torch.from_numpy(joints))
+    np.testing.assert_array_equal(result[0], expected[0])
+
+
+def benchmark(batch_size=128, num=20):
+    rng = np.random.RandomState(0)
+    heatmaps = random_heatmaps(rng, batch_size)
+    center, scale = random_boxes(rng, batch_size)
+    heatmaps_torch = torch.from_numpy(heatmaps)
+    for post_process in (True, False):
+        config = make_config(post_process)
+        times = []
+        for decode, batch in ((get_final_preds, heatmaps),
+                              (get_final_preds_torch, heatmaps_torch)):
+            tic = time.time()
+            for _ in range(num):
+                decode(config, batch, center, scale)
+            times.append((time.time() - tic) / num * 1e3)
+        print('batch of {}, POST_PROCESS {}: numpy {:.2f} ms, torch on cpu '
+              '{:.2f} ms'.format(batch_size, post_process, *times))
+
+
+if __name__ == '__main__':
+    test_get_max_preds()
+    test_get_final_preds()
+    test_flip_back()
+    test_accuracy()
+    print('torch decoding matches numpy')
+    benchmark()
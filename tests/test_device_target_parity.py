@@ -0,0 +1,163 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# Parity of TRAIN.TARGET_ON_DEVICE, the gaussian targets rendered for the
+# batch by render_gaussian_targets, with the heatmaps JointsDataset builds
+# per sample. Run with pytest, or as a script to time both and print the
+# bytes a worker sends per sample.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as np
+import pytest
+import torch
+
+import _init_paths
+from config import cfg
+from core.target import render_gaussian_targets
+from dataset.JointsDataset import JointsDataset
+from test_target_parity import NUM_JOINTS
+from test_target_parity import SETTINGS
+from test_target_parity import random_joints
+
+
+BATCH_SIZE = 32
+
+
+def make_dataset(image_size, heatmap_size, sigma, on_device,
+                 joints_weight=False):
+    config = cfg.clone()
+    config.defrost()
+    config.MODEL.IMAGE_SIZE = image_size
+    config.MODEL.HEATMAP_SIZE = heatmap_size
+    config.MODEL.SIGMA = sigma
+    config.MODEL.TARGET_TYPE = 'gaussian'
+    config.TRAIN.TARGET_ON_DEVICE = on_device
+    config.LOSS.USE_DIFFERENT_JOINTS_WEIGHT = joints_weight
+    config.freeze()
+
+    dataset = JointsDataset(config, '', 'parity', True)
+    dataset.num_joints = NUM_JOINTS
+    if joints_weight:
+        dataset.joints_weight = np.linspace(
+            0.5, 1.5, NUM_JOINTS, dtype=np.float32).reshape((-1, 1))
+    return dataset
+
+
+def batches(dense, sparse, num, seed):
+    '''
+    batches of the dense targets and of those rendered from the centers,
+    collated as the loader does
+    '''
+    rng = np.random.RandomState(seed)
+    for _ in range(num):
+        samples = [random_joints(rng, dense.image_size)
+                   for _ in range(BATCH_SIZE)]
+        targets = [dense.generate_target(*sample) for sample in samples]
+        centers = [sparse.generate_target(*sample) for sample in samples]
+        expected = torch.from_numpy(np.stack([t[0] for t in targets]))
+        rendered = render_gaussian_targets(
+            torch.from_numpy(np.stack([c[0] for c in centers])),
+            sparse.gaussian, sparse.heatmap_size)
+        yield expected, rendered, \
+            np.stack([t[1] for t in targets]), \
+            np.stack([c[1] for c in centers])
+
+
+def check_parity(setting, num, seed, joints_weight=False):
+    dense = make_dataset(*setting, on_device=False,
+                         joints_weight=joints_weight)
+    sparse = make_dataset(*setting, on_device=True,
+                          joints_weight=joints_weight)
+    for expected, rendered, expected_weight, weight in batches(
+            dense, sparse, num, seed):
+        assert rendered.dtype == expected.dtype
+        assert torch.equal(rendered, expected)
+        np.testing.assert_array_equal(weight, expected_weight)
+
+
+def test_parity():
+    for seed, setting in enumerate(SETTINGS):
+        check_parity(setting, 10, seed)
+
+
+def test_parity_joints_weight():
+    check_parity(SETTINGS[0], 5, 10, joints_weight=True)
+
+
+def test_validation_targets_stay_dense():
+    config = cfg.clone()
+    config.defrost()
+    config.TRAIN.TARGET_ON_DEVICE = True
+    config.freeze()
+    dataset = JointsDataset(config, '', 'parity', False)
+    dataset.num_joints = NUM_JOINTS
+    rng = np.random.RandomState(20)
+    target, _ = dataset.generate_target(
+        *random_joints(rng, dataset.image_size))
+    assert target.shape == (NUM_JOINTS, dataset.heatmap_size[1],
+                            dataset.heatmap_size[0])
+
+
+def test_unsupported_target_type():
+    config = cfg.clone()
+    config.defrost()
+    config.MODEL.TARGET_TYPE = 'integral'
+    config.TRAIN.TARGET_ON_DEVICE = True
+    config.freeze()
+    with pytest.raises(ValueError, match='TARGET_ON_DEVICE'):
+        JointsDataset(config, '', 'parity', True)
+    # only the training set renders on the device
+    JointsDataset(config, '', 'parity', False)
+
+
+def benchmark(num=2000):
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for setting in SETTINGS[:2]:
+        dense = make_dataset(*setting, on_device=False)
+        sparse = make_dataset(*setting, on_device=True)
+        rng = np.random.RandomState(0)
+        samples = [random_joints(rng, dense.image_size) for _ in range(num)]
+        rates, sizes = [], []
+        for dataset in (dense, sparse):
+            tic = time.time()
+            for joints, joints_vis in samples:
+                target = dataset.generate_target(joints, joints_vis)[0]
+            rates.append((time.time() - tic) / num * 1e6)
+            sizes.append(target.nbytes)
+        print('heatmap {}x{}, sigma {}: generate_target {:.0f} -> {:.0f} us, '
+              'target {} -> {} bytes per sample'.format(
+                  setting[1][0], setting[1][1], setting[2],
+                  rates[0], rates[1], sizes[0], sizes[1]))
+
+        centers = torch.from_numpy(np.stack([
+            sparse.generate_target(*sample)[0]
+            for sample in samples[:BATCH_SIZE]]))
+        for device in devices:
+            batch = centers.to(device)
+            render_gaussian_targets(batch, sparse.gaussian,
+                                    sparse.heatmap_size)
+            if device == 'cuda':
+                torch.cuda.synchronize()
+            tic = time.time()
+            for _ in range(20):
+                render_gaussian_targets(batch, sparse.gaussian,
+                                        sparse.heatmap_size)
+            if device == 'cuda':
+                torch.cuda.synchronize()
+            print('  render a batch of {} on {}: {:.2f} ms'.format(
+                BATCH_SIZE, device, (time.time() - tic) / 20 * 1e3))
+
+
+if __name__ == '__main__':
+    test_parity()
+    test_parity_joints_weight()
+    test_validation_targets_stay_dense()
+    print('rendered targets identical to the dataset heatmaps')
+    benchmark()
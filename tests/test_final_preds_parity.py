@@ -0,0 +1,133 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# Parity of the vectorized get_final_preds with the per-joint refinement
+# and per-sample back-projection it replaced. Run with pytest, or as a
+# script to time both on a validation sized batch.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import time
+
+import numpy as np
+
+import _init_paths
+from config import cfg
+from core.inference import get_final_preds
+from core.inference import get_max_preds
+from test_transforms_parity import cv2_affine_transform
+
+
+NUM_JOINTS = 17
+HEATMAP_SIZE = [48, 64]
+
+
+def loop_final_preds(config, batch_heatmaps, center, scale):
+    ''' get_final_preds as it was, one joint and one sample at a time '''
+    coords, maxvals = get_max_preds(batch_heatmaps)
+
+    heatmap_height = batch_heatmaps.shape[2]
+    heatmap_width = batch_heatmaps.shape[3]
+
+    if config.TEST.POST_PROCESS:
+        for n in range(coords.shape[0]):
+            for p in range(coords.shape[1]):
+                hm = batch_heatmaps[n][p]
+                px = int(math.floor(coords[n][p][0] + 0.5))
+                py = int(math.floor(coords[n][p][1] + 0.5))
+                if 1 < px < heatmap_width-1 and 1 < py < heatmap_height-1:
+                    diff = np.array(
+                        [
+                            hm[py][px+1] - hm[py][px-1],
+                            hm[py+1][px]-hm[py-1][px]
+                        ]
+                    )
+                    coords[n][p] += np.sign(diff) * .25
+
+    preds = coords.copy()
+
+    for i in range(coords.shape[0]):
+        trans = cv2_affine_transform(
+            center[i], scale[i], 0, [heatmap_width, heatmap_height], inv=1)
+        for p in range(coords.shape[1]):
+            pt = np.array([coords[i, p, 0], coords[i, p, 1], 1.]).T
+            preds[i, p] = np.dot(trans, pt)[:2]
+
+    return preds, maxvals
+
+
+def make_config(post_process):
+    config = cfg.clone()
+    config.defrost()
+    config.MODEL.HEATMAP_SIZE = HEATMAP_SIZE
+    config.TEST.POST_PROCESS = post_process
+    config.freeze()
+    return config
+
+
+def random_batch(rng, batch_size):
+    '''
+    heatmaps with maxima anywhere, on and next to the border too, flat
+    neighbourhoods and heatmaps without a positive value, and boxes of
+    the db's float32 centers and scales
+    '''
+    w, h = HEATMAP_SIZE
+    heatmaps = rng.rand(batch_size, NUM_JOINTS, h, w).astype(np.float32)
+    heatmaps[:, :, 1:-1, 1:-1] *= 0.5
+    peaks = rng.randint(0, [w, h], (batch_size, NUM_JOINTS, 2))
+    n, j = np.meshgrid(np.arange(batch_size), np.arange(NUM_JOINTS),
+                       indexing='ij')
+    heatmaps[n, j, peaks[:, :, 1], peaks[:, :, 0]] = 2
+    heatmaps[0:2] = -1
+    heatmaps[2] = 0.5
+    heatmaps[2, :, 10, 10] = 1
+
+    center = rng.uniform(0, 1000, (batch_size, 2)).astype(np.float32)
+    scale = (rng.uniform(0.3, 5, (batch_size, 1))
+             * [1, 4 / 3.]).astype(np.float32)
+    return heatmaps, center, scale
+
+
+def test_parity():
+    rng = np.random.RandomState(0)
+    for post_process in (True, False):
+        config = make_config(post_process)
+        for batch_size in (3, 64):
+            heatmaps, center, scale = random_batch(rng, batch_size)
+            expected, expected_maxvals = loop_final_preds(
+                config, heatmaps, center, scale)
+            preds, maxvals = get_final_preds(config, heatmaps, center, scale)
+            assert preds.dtype == expected.dtype
+            np.testing.assert_array_equal(maxvals, expected_maxvals)
+            # float32 rounding on coordinates up to about 1600 px
+            np.testing.assert_allclose(preds, expected, rtol=0, atol=1e-3)
+
+
+def benchmark(batch_size=512, num=3):
+    rng = np.random.RandomState(1)
+    heatmaps, center, scale = random_batch(rng, batch_size)
+    for post_process in (True, False):
+        config = make_config(post_process)
+        times, preds = [], []
+        for decode in (loop_final_preds, get_final_preds):
+            tic = time.time()
+            for _ in range(num):
+                result = decode(config, heatmaps, center, scale)[0]
+            times.append((time.time() - tic) / num)
+            preds.append(result)
+        worst = np.abs(preds[0] - preds[1]).max()
+        print('{}x{}x{}x{}, POST_PROCESS {}: loop {:.3f} s, vectorized '
+              '{:.3f} s, largest difference {:.1e} px'.format(
+                  batch_size, NUM_JOINTS, HEATMAP_SIZE[1], HEATMAP_SIZE[0],
+                  post_process, times[0], times[1], worst))
+
+
+if __name__ == '__main__':
+    test_parity()
+    print('predictions match the per-joint loop')
+    benchmark()
@@ -0,0 +1,86 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# DATASET.GROUP_BY_IMAGE: ImageGroupedSampler yields every record once,
+# the records of an image back to back, and validation results collected
+# in its order go back to the db order evaluate() expects.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+
+import numpy as np
+import torch
+
+import _init_paths
+from dataset.columnar import ColumnarDB
+from dataset.sampler import ImageGroupedSampler
+
+
+class RecordDataset(torch.utils.data.Dataset):
+    ''' records of images in interleaved db order, yielding their index '''
+    def __init__(self, num_records, num_images, seed, columnar=False):
+        rng = np.random.RandomState(seed)
+        self.db = [{'image': '{}.jpg'.format(rng.randint(num_images)),
+                    'center': rng.rand(2).astype(np.float32)}
+                   for _ in range(num_records)]
+        if columnar:
+            self.db = ColumnarDB(self.db)
+
+    def __len__(self):
+        return len(self.db)
+
+    def __getitem__(self, idx):
+        return idx
+
+
+def images_of(dataset, indices):
+    return [dataset.db[idx]['image'] for idx in indices]
+
+
+def check_grouped(dataset, indices):
+    assert sorted(indices) == list(range(len(dataset)))
+    # every image in one run
+    images = images_of(dataset, indices)
+    runs = [image for k, image in enumerate(images)
+            if k == 0 or image != images[k - 1]]
+    assert len(runs) == len(set(images))
+
+
+def test_order():
+    for columnar in (False, True):
+        dataset = RecordDataset(200, 30, 0, columnar)
+        sampler = ImageGroupedSampler(dataset)
+        assert list(sampler) == sampler.order()
+        check_grouped(dataset, sampler.order())
+
+        random.seed(0)
+        shuffled = ImageGroupedSampler(dataset, shuffle=True)
+        check_grouped(dataset, list(shuffled))
+        assert list(shuffled) != list(shuffled)
+
+
+def test_to_db_order():
+    # the validation loop: results in loader order, back to db order
+    dataset = RecordDataset(203, 30, 1)
+    sampler = ImageGroupedSampler(dataset)
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=16, shuffle=False, sampler=sampler)
+    indices = torch.cat(list(loader)).numpy()
+    assert (indices != np.arange(len(dataset))).any()
+
+    preds = np.stack([indices, -indices], axis=1).astype(np.float32)
+    np.testing.assert_array_equal(
+        sampler.to_db_order(preds)[:, 0], np.arange(len(dataset)))
+    assert sampler.to_db_order(images_of(dataset, indices)) == \
+        images_of(dataset, range(len(dataset)))
+
+
+if __name__ == '__main__':
+    test_order()
+    test_to_db_order()
+    print('grouped sampler results back in db order')
@@ -0,0 +1,201 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# Parity of TEST.KEYPOINT_EVAL native, dataset.keypoint_eval, with
+# pycocotools' COCOeval on synthetic ground truth and detections. Run
+# with pytest, skipped without pycocotools, or as a script to time both.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import io
+import sys
+import time
+
+import numpy as np
+import pytest
+
+import _init_paths
+from dataset.keypoint_eval import KeypointEvaluator
+
+
+NUM_JOINTS = 17
+
+
+def make_gt(num_images, rng):
+    '''
+    coco keypoint annotations: people of every area range, crowds, people
+    without labelled joints and images without people
+    '''
+    images, anns = [], []
+    for image_id in range(1, num_images + 1):
+        images.append({'id': image_id, 'width': 640, 'height': 480,
+                       'file_name': '{:012d}.jpg'.format(image_id)})
+        for _ in range(rng.randint(0, 6)):
+            x, y = rng.uniform(0, 500), rng.uniform(0, 300)
+            w, h = rng.uniform(10, 140), rng.uniform(20, 180)
+            vis = rng.choice([0, 1, 2], NUM_JOINTS, p=[.3, .2, .5])
+            if rng.rand() < 0.05:
+                vis[:] = 0
+            keypoints = np.zeros((NUM_JOINTS, 3))
+            keypoints[:, 0] = x + rng.uniform(0, w, NUM_JOINTS)
+            keypoints[:, 1] = y + rng.uniform(0, h, NUM_JOINTS)
+            keypoints[:, 2] = vis
+            keypoints[vis == 0] = 0
+            area = w * h * 0.7 if rng.rand() > 0.2 \
+                else float(rng.choice([500, 2000, 5000, 12000]))
+            anns.append({
+                'id': len(anns) + 1,
+                'image_id': image_id,
+                'category_id': 1,
+                'bbox': [x, y, w, h],
+                'area': area,
+                'iscrowd': int(rng.rand() < 0.03),
+                'keypoints': keypoints.reshape(-1).tolist(),
+                'num_keypoints': int((vis > 0).sum()),
+                'segmentation': [],
+            })
+    return {
+        'images': images,
+        'annotations': anns,
+        'categories': [{
+            'id': 1, 'name': 'person', 'supercategory': 'person',
+            'keypoints': [str(k) for k in range(NUM_JOINTS)],
+            'skeleton': []
+        }]
+    }
+
+
+def make_results(gt, rng):
+    '''
+    detections near the people at several noise levels, duplicates,
+    false positives, more than 20 detections on some images and rounded
+    scores, so scores tie
+    '''
+    image_ids, keypoints, scores = [], [], []
+    for ann in gt['annotations']:
+        kpts = np.array(ann['keypoints'], dtype=np.float64).reshape((-1, 3))
+        if ann['num_keypoints'] == 0:
+            x, y, w, h = ann['bbox']
+            kpts[:, 0] = x + rng.rand(NUM_JOINTS) * w * 3 - w
+            kpts[:, 1] = y + rng.rand(NUM_JOINTS) * h * 3 - h
+        for _ in range(rng.randint(0, 4)):
+            kpts_dt = kpts.copy()
+            kpts_dt[:, 0:2] += rng.randn(NUM_JOINTS, 2) \
+                * rng.choice([1, 4, 10, 30])
+            kpts_dt[:, 2] = rng.rand(NUM_JOINTS)
+            image_ids.append(ann['image_id'])
+            keypoints.append(kpts_dt)
+            scores.append(np.round(rng.rand(), 2))
+    all_ids = [image['id'] for image in gt['images']]
+    for image_id in rng.choice(all_ids, len(all_ids) // 3):
+        for _ in range(rng.randint(1, 12)):
+            kpts_dt = np.zeros((NUM_JOINTS, 3))
+            kpts_dt[:, 0] = rng.rand() * 600 + rng.randn(NUM_JOINTS) * 20
+            kpts_dt[:, 1] = rng.rand() * 450 + rng.randn(NUM_JOINTS) * 20
+            kpts_dt[:, 2] = rng.rand(NUM_JOINTS)
+            image_ids.append(int(image_id))
+            keypoints.append(kpts_dt)
+            scores.append(np.round(rng.rand(), 2))
+    # float32 keypoints, as get_final_preds returns them
+    return np.array(image_ids), np.array(keypoints, dtype=np.float32), \
+        np.array(scores)
+
+
+def load_coco(gt):
+    from pycocotools.coco import COCO
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco = COCO()
+        coco.dataset = gt
+        coco.createIndex()
+    return coco
+
+
+def cocoeval_stats(coco, image_ids, keypoints, scores):
+    ''' the stats of COCOeval, as COCODataset._do_python_keypoint_eval '''
+    from pycocotools.cocoeval import COCOeval
+    results = [{
+        'image_id': int(image_id),
+        'category_id': 1,
+        'keypoints': kpts.reshape(-1).tolist(),
+        'score': float(score)
+    } for image_id, kpts, score in zip(image_ids, keypoints, scores)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco_dt = coco.loadRes(results)
+        coco_eval = COCOeval(coco, coco_dt, 'keypoints')
+        coco_eval.params.useSegm = None
+        coco_eval.evaluate()
+        coco_eval.accumulate()
+        coco_eval.summarize()
+    return coco_eval.stats
+
+
+def compare(num_images, seed):
+    rng = np.random.RandomState(seed)
+    gt = make_gt(num_images, rng)
+    coco = load_coco(gt)
+    results = make_results(gt, rng)
+
+    tic = time.time()
+    expected = cocoeval_stats(coco, *results)
+    cocoeval_time = time.time() - tic
+
+    tic = time.time()
+    evaluator = KeypointEvaluator(coco, 1)
+    setup_time = time.time() - tic
+    tic = time.time()
+    stats = evaluator.evaluate(*results)
+    native_time = time.time() - tic
+
+    return np.asarray(stats), np.asarray(expected), \
+        (cocoeval_time, setup_time, native_time), len(results[0])
+
+
+def test_parity():
+    pytest.importorskip('pycocotools')
+    for seed in range(4):
+        stats, expected, _, _ = compare(150, seed)
+        np.testing.assert_allclose(stats, expected, rtol=0, atol=1e-4)
+
+
+def test_subset_of_images():
+    # results on some of the images only, the others count as missed
+    pytest.importorskip('pycocotools')
+    rng = np.random.RandomState(10)
+    gt = make_gt(100, rng)
+    coco = load_coco(gt)
+    image_ids, keypoints, scores = make_results(gt, rng)
+    keep = image_ids % 3 != 0
+    results = image_ids[keep], keypoints[keep], scores[keep]
+    np.testing.assert_allclose(
+        KeypointEvaluator(coco, 1).evaluate(*results),
+        cocoeval_stats(coco, *results), rtol=0, atol=1e-4)
+
+
+def test_unknown_image():
+    pytest.importorskip('pycocotools')
+    rng = np.random.RandomState(11)
+    gt = make_gt(10, rng)
+    image_ids, keypoints, scores = make_results(gt, rng)
+    image_ids[0] = 10 ** 6
+    with pytest.raises(ValueError):
+        KeypointEvaluator(load_coco(gt), 1).evaluate(
+            image_ids, keypoints, scores)
+
+
+if __name__ == '__main__':
+    try:
+        import pycocotools
+    except ImportError:
+        print('pycocotools is not installed')
+        sys.exit(1)
+    for num_images in (150, 1000, 5000):
+        stats, expected, times, num_results = compare(num_images, 0)
+        print('{} images, {} results: COCOeval {:.2f} s, native {:.3f} s '
+              '(+{:.2f} s gt setup), largest stat difference {:.1e}'.format(
+                  num_images, num_results, times[0], times[2], times[1],
+                  np.abs(stats - expected).max()))
@@ -0,0 +1,165 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# Parity of oks_nms and soft_oks_nms on the pairwise OKS matrix with the
+# per-instance loop they replaced. Run with pytest, or as a script to
+# time both on crowded images.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as np
+
+import _init_paths
+from nms.nms import oks_iou
+from nms.nms import oks_iou_matrix
+from nms.nms import oks_nms
+from nms.nms import rescore
+from nms.nms import soft_oks_nms
+
+
+NUM_JOINTS = 17
+SIGMAS = np.array([.26, .25, .25, .35, .35, .79, .79, .72, .72, .62, .62,
+                   1.07, 1.07, .87, .87, .89, .89]) / 10.0
+
+
+def loop_oks_iou(g, d, a_g, a_d, in_vis_thre=None):
+    '''
+    oks_iou as it was, one detection at a time, with joints counted when
+    visible in both instances
+    '''
+    vars = (SIGMAS * 2) ** 2
+    xg = g[0::3]
+    yg = g[1::3]
+    vg = g[2::3]
+    ious = np.zeros((d.shape[0]))
+    for n_d in range(0, d.shape[0]):
+        xd = d[n_d, 0::3]
+        yd = d[n_d, 1::3]
+        vd = d[n_d, 2::3]
+        dx = xd - xg
+        dy = yd - yg
+        e = (dx ** 2 + dy ** 2) / vars \
+            / ((a_g + a_d[n_d]) / 2 + np.spacing(1)) / 2
+        if in_vis_thre is not None:
+            ind = (vg > in_vis_thre) & (vd > in_vis_thre)
+            e = e[ind]
+        ious[n_d] = np.sum(np.exp(-e)) / e.shape[0] \
+            if e.shape[0] != 0 else 0.0
+    return ious
+
+
+def stack(kpts_db):
+    scores = np.array([rec['score'] for rec in kpts_db])
+    kpts = np.array([rec['keypoints'].flatten() for rec in kpts_db])
+    areas = np.array([rec['area'] for rec in kpts_db])
+    return scores, kpts, areas
+
+
+def loop_oks_nms(kpts_db, thresh, in_vis_thre=None):
+    ''' oks_nms as it was, the OKS of every kept instance in a loop '''
+    scores, kpts, areas = stack(kpts_db)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        oks_ovr = loop_oks_iou(kpts[i], kpts[order[1:]], areas[i],
+                               areas[order[1:]], in_vis_thre)
+        inds = np.where(oks_ovr <= thresh)[0]
+        order = order[inds + 1]
+    return keep
+
+
+def loop_soft_oks_nms(kpts_db, thresh, in_vis_thre=None):
+    ''' soft_oks_nms as it was '''
+    scores, kpts, areas = stack(kpts_db)
+    order = scores.argsort()[::-1]
+    scores = scores[order]
+
+    keep = []
+    while order.size > 0 and len(keep) < 20:
+        i = order[0]
+        oks_ovr = loop_oks_iou(kpts[i], kpts[order[1:]], areas[i],
+                               areas[order[1:]], in_vis_thre)
+        order = order[1:]
+        scores = rescore(oks_ovr, scores[1:], thresh)
+        tmp = scores.argsort()[::-1]
+        order = order[tmp]
+        scores = scores[tmp]
+        keep.append(i)
+    return keep
+
+
+def crowd(rng, num):
+    ''' one image of num people in clusters of about 4 '''
+    centers = rng.rand(num // 4 + 1, 2) * 400
+    kpts_db = []
+    for i in range(num):
+        kpts = np.zeros((NUM_JOINTS, 3))
+        kpts[:, 0:2] = centers[i % len(centers)] \
+            + rng.randn(NUM_JOINTS, 2) * 30
+        kpts[:, 2] = rng.rand(NUM_JOINTS)
+        kpts_db.append({'keypoints': kpts, 'score': rng.rand(),
+                        'area': rng.rand() * 2e4 + 1e3})
+    return kpts_db
+
+
+def test_oks_iou_matrix():
+    rng = np.random.RandomState(0)
+    scores, kpts, areas = stack(crowd(rng, 40))
+    for in_vis_thre in (None, 0.2, 0.9):
+        oks = oks_iou_matrix(kpts, areas, SIGMAS, in_vis_thre)
+        for i in range(len(kpts)):
+            expected = loop_oks_iou(kpts[i], kpts, areas[i], areas,
+                                    in_vis_thre)
+            np.testing.assert_allclose(oks[i], expected, rtol=0, atol=1e-12)
+            np.testing.assert_allclose(
+                oks_iou(kpts[i], kpts, areas[i], areas, None, in_vis_thre),
+                expected, rtol=0, atol=1e-12)
+
+
+def test_keep():
+    rng = np.random.RandomState(1)
+    for num in (1, 2, 7, 30, 80):
+        kpts_db = crowd(rng, num)
+        for in_vis_thre in (None, 0.2):
+            for thresh in (0.3, 0.9):
+                assert list(oks_nms(kpts_db, thresh, None, in_vis_thre)) == \
+                    loop_oks_nms(kpts_db, thresh, in_vis_thre)
+                assert list(soft_oks_nms(kpts_db, thresh, None,
+                                         in_vis_thre)) == \
+                    loop_soft_oks_nms(kpts_db, thresh, in_vis_thre)
+    assert oks_nms([], 0.9) == []
+    assert soft_oks_nms([], 0.9) == []
+
+
+def benchmark(num_images=5):
+    rng = np.random.RandomState(0)
+    for num in (20, 60, 150):
+        images = [crowd(rng, num) for _ in range(num_images)]
+        times = []
+        for nms in (loop_oks_nms, oks_nms, loop_soft_oks_nms, soft_oks_nms):
+            tic = time.time()
+            for kpts_db in images:
+                if nms in (oks_nms, soft_oks_nms):
+                    nms(kpts_db, 0.9, None, 0.2)
+                else:
+                    nms(kpts_db, 0.9, 0.2)
+            times.append((time.time() - tic) / num_images * 1e3)
+        print('{} people per image: oks_nms loop {:.2f} ms, matrix {:.2f} '
+              'ms; soft_oks_nms loop {:.2f} ms, matrix {:.2f} ms'.format(
+                  num, *times))
+
+
+if __name__ == '__main__':
+    test_oks_iou_matrix()
+    test_keep()
+    print('keep lists identical to the per-instance loop')
+    benchmark()
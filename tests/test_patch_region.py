@@ -0,0 +1,226 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# The patches of DATASET.CACHE_MODE patch cover every crop the training
+# augmentation can draw: the box and the half body boxes at the largest
+# scale and every rotation. Run with pytest, or as a script to print how
+# far the crops stay inside their patches.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+import _init_paths
+from config import cfg
+from dataset.JointsDataset import JointsDataset
+from utils.image_store import ImageStore
+from utils.transforms import get_affine_transform
+from utils.transforms import get_source_windows
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+from build_image_cache import build_patch_store
+
+
+NUM_JOINTS = 17
+IMAGE_SIZE = [192, 256]
+IMAGE_WIDTH, IMAGE_HEIGHT = 960, 720
+NUM_IMAGES = 6
+RECORDS_PER_IMAGE = 8
+
+
+class PatchDataset(JointsDataset):
+    '''
+    COCO-like records of people of random size and pose, some truncated
+    by the image border and some sharing a box
+    '''
+    def __init__(self, config, directory, is_train):
+        super(PatchDataset, self).__init__(
+            config, directory, 'patch_parity', is_train)
+        self.num_joints = NUM_JOINTS
+        self.aspect_ratio = IMAGE_SIZE[0] / IMAGE_SIZE[1]
+        self.flip_pairs = [[1, 2], [3, 4], [5, 6], [7, 8], [9, 10],
+                           [11, 12], [13, 14], [15, 16]]
+        self.upper_body_ids = tuple(range(11))
+
+        rng = np.random.RandomState(0)
+        for i in range(NUM_IMAGES):
+            image_file = os.path.join(directory, '{}.jpg'.format(i))
+            for k in range(RECORDS_PER_IMAGE):
+                height = rng.uniform(60, 600)
+                center = rng.uniform(
+                    [-50, -50], [IMAGE_WIDTH + 50, IMAGE_HEIGHT + 50])
+                joints = np.zeros((NUM_JOINTS, 3))
+                # upper body above the lower body, spread sideways
+                joints[:, 1] = center[1] + height * np.where(
+                    np.arange(NUM_JOINTS) < 11,
+                    rng.uniform(-0.5, 0, NUM_JOINTS),
+                    rng.uniform(0, 0.5, NUM_JOINTS))
+                joints[:, 0] = center[0] + height * rng.uniform(
+                    -0.4, 0.4, NUM_JOINTS)
+                joints_vis = np.zeros((NUM_JOINTS, 3))
+                joints_vis[:, 0:2] = (rng.rand(NUM_JOINTS) > 0.2)[:, None]
+                joints *= joints_vis
+
+                scale = np.array([height * self.aspect_ratio, height],
+                                 dtype=np.float32) / self.pixel_std * 1.25
+                if k % 4 == 3:
+                    # an instance sharing the box of the previous one
+                    center, scale = self.db[-1]['center'], \
+                        self.db[-1]['scale']
+                self.db.append({
+                    'image': image_file,
+                    'center': np.array(center, dtype=np.float32),
+                    'scale': scale,
+                    'joints_3d': joints,
+                    'joints_3d_vis': joints_vis,
+                    'filename': '',
+                    'imgnum': 0,
+                })
+
+
+def make_dataset(directory, is_train=True, cache_mode='', flip=True):
+    config = cfg.clone()
+    config.defrost()
+    config.MODEL.IMAGE_SIZE = IMAGE_SIZE
+    config.MODEL.HEATMAP_SIZE = [IMAGE_SIZE[0] // 4, IMAGE_SIZE[1] // 4]
+    config.DATASET.PROB_HALF_BODY = 1.0
+    config.DATASET.NUM_JOINTS_HALF_BODY = 8
+    config.DATASET.FLIP = flip
+    config.DATASET.CACHE_MODE = cache_mode
+    config.DATASET.CACHE_DIR = os.path.join(directory, 'cache')
+    config.freeze()
+    return PatchDataset(config, directory, is_train)
+
+
+def write_images(directory):
+    rng = np.random.RandomState(1)
+    for i in range(NUM_IMAGES):
+        image = cv2.GaussianBlur(rng.randint(
+            0, 256, (IMAGE_HEIGHT, IMAGE_WIDTH, 3)).astype(np.uint8),
+            (0, 0), 2)
+        # no black pixels, so zero padding shows in the crops
+        cv2.imwrite(os.path.join(directory, '{}.jpg'.format(i)),
+                    np.maximum(image, 16))
+
+
+def augmentation_windows(dataset, db_rec):
+    '''
+    source windows of the crops at the largest scale and at rotations
+    over the whole range, for the box and every half body box
+    '''
+    boxes = [(db_rec['center'], db_rec['scale'])] + \
+        dataset.half_body_boxes(db_rec['joints_3d'], db_rec['joints_3d_vis'])
+    rf = dataset.rotation_factor
+    windows = []
+    for center, scale in boxes:
+        for rot in np.linspace(-2 * rf, 2 * rf, 17):
+            trans = get_affine_transform(
+                center, scale * (1 + dataset.scale_factor), rot,
+                dataset.image_size)
+            windows.append(get_source_windows(
+                trans, dataset.image_size, (IMAGE_WIDTH, IMAGE_HEIGHT))[0])
+    return np.array(windows)
+
+
+def margins(dataset):
+    ''' per record, the smallest distance of a crop to its patch border '''
+    result = []
+    for db_rec in dataset.db:
+        x0, y0, x1, y1 = dataset.patch_region(
+            db_rec, (IMAGE_WIDTH, IMAGE_HEIGHT))
+        windows = augmentation_windows(dataset, db_rec)
+        result.append(min((windows[:, 0] - x0).min(),
+                          (windows[:, 1] - y0).min(),
+                          (x1 - windows[:, 2]).min(),
+                          (y1 - windows[:, 3]).min()))
+    return np.array(result)
+
+
+def test_half_body_boxes():
+    # half_body_transform only ever returns one of half_body_boxes
+    dataset = make_dataset(tempfile.gettempdir())
+    np.random.seed(0)
+    for db_rec in dataset.db:
+        boxes = dataset.half_body_boxes(
+            db_rec['joints_3d'], db_rec['joints_3d_vis'])
+        for _ in range(10):
+            center, scale = dataset.half_body_transform(
+                db_rec['joints_3d'], db_rec['joints_3d_vis'])
+            if center is None:
+                continue
+            assert any(np.array_equal(center, c) and np.array_equal(scale, s)
+                       for c, s in boxes)
+
+
+def test_crops_in_patch():
+    dataset = make_dataset(tempfile.gettempdir())
+    assert (margins(dataset) >= 0).all()
+
+
+def test_image_store_key():
+    dataset = make_dataset(tempfile.gettempdir(), cache_mode='patch')
+    db_rec = dict(dataset.db[0])
+    key = dataset.image_store_key(db_rec)
+    db_rec['center'] = db_rec['center'] + np.float32(1e-3)
+    assert dataset.image_store_key(db_rec) != key
+
+
+def check_samples(directory):
+    '''
+    training samples from the patch store match those decoded from the
+    jpgs, with no zero padding where the jpg crop has image
+    '''
+    write_images(directory)
+    dataset = make_dataset(directory, cache_mode='patch')
+    store_path = dataset.image_store_path()
+    os.makedirs(dataset.cache_dir)
+    build_patch_store(dataset, store_path)
+    assert ImageStore.exists(store_path)
+
+    jpg = make_dataset(directory, flip=False)
+    patch = make_dataset(directory, cache_mode='patch', flip=False)
+    worst = 0
+    for idx in range(len(jpg)):
+        for seed in range(8):
+            random.seed(seed)
+            np.random.seed(seed)
+            a = jpg[idx]
+            random.seed(seed)
+            np.random.seed(seed)
+            b = patch[idx]
+            np.testing.assert_array_equal(a[1].numpy(), b[1].numpy())
+            # the patch offset moves warp coordinates by float rounding
+            diff = np.abs(a[0].astype(np.int64) - b[0])
+            worst = max(worst, diff.max())
+            assert diff.max() <= 16
+            assert np.count_nonzero(diff) < 1e-3 * diff.size
+    return worst
+
+
+def test_samples(tmp_path):
+    check_samples(str(tmp_path))
+
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    try:
+        test_half_body_boxes()
+        result = margins(make_dataset(directory))
+        print('{} records: crops stay at least {:.0f} px inside their '
+              'patches'.format(len(result), result.min()))
+        test_image_store_key()
+        print('samples from patches: worst {} grey levels from the '
+              'jpgs'.format(check_samples(directory)))
+    finally:
+        shutil.rmtree(directory)
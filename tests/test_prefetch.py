@@ -0,0 +1,74 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# DATASET.PREFETCH_THREADS: batches loaded by the thread pool of a worker
+# equal the samples of __getitem__, and the dataset still pickles for
+# spawned workers once its pool is running.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pickle
+import random
+
+import numpy as np
+
+import _init_paths
+from config import cfg
+from test_crop_backend_parity import CropDataset
+from test_crop_backend_parity import IMAGE_SIZE
+from test_crop_backend_parity import write_jpegs
+
+
+def make_dataset(directory, prefetch_threads):
+    config = cfg.clone()
+    config.defrost()
+    config.MODEL.IMAGE_SIZE = IMAGE_SIZE
+    config.MODEL.HEATMAP_SIZE = [IMAGE_SIZE[0] // 4, IMAGE_SIZE[1] // 4]
+    config.DATASET.PREFETCH_THREADS = prefetch_threads
+    config.DATASET.PROB_HALF_BODY = 0.3
+    config.freeze()
+    return CropDataset(config, directory, True, None)
+
+
+def samples(dataset, indices, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    if dataset.prefetch_threads > 0:
+        return dataset.__getitems__(indices)
+    return [dataset[idx] for idx in indices]
+
+
+def check_equal(a, b):
+    assert len(a) == len(b)
+    for x, y in zip(a, b):
+        np.testing.assert_array_equal(x[0], y[0])
+        np.testing.assert_array_equal(x[1].numpy(), y[1].numpy())
+        np.testing.assert_array_equal(x[3]['joints'], y[3]['joints'])
+
+
+def test_prefetch(tmp_path):
+    write_jpegs(str(tmp_path))
+    dataset = make_dataset(str(tmp_path), 0)
+    prefetch = make_dataset(str(tmp_path), 3)
+    indices = list(range(0, len(dataset), 3))
+    for seed in range(3):
+        check_equal(samples(prefetch, indices, seed),
+                    samples(dataset, indices, seed))
+
+
+def test_pickle(tmp_path):
+    write_jpegs(str(tmp_path))
+    dataset = make_dataset(str(tmp_path), 2)
+    indices = [0, 5, 9]
+    expected = samples(dataset, indices, 0)
+    assert dataset._prefetch is not None
+
+    restored = pickle.loads(pickle.dumps(dataset))
+    assert restored._prefetch is None
+    check_equal(samples(restored, indices, 0), expected)
+    # the pickled dataset keeps its own pool
+    assert dataset._prefetch is not None
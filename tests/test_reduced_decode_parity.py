@@ -0,0 +1,229 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# Parity of DATASET.REDUCED_DECODE with full-resolution decoding: the
+# same joints and targets, and crops at least as close to an anti-aliased
+# reference. Run with pytest, or as a script to print the crop quality
+# and decode times.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import _init_paths
+from config import cfg
+from dataset.JointsDataset import JointsDataset
+from dataset.JointsDataset import _REDUCED_DECODE_FLAGS
+from dataset.JointsDataset import _jpeg_size
+from utils.transforms import get_affine_transform
+
+
+NUM_JOINTS = 17
+IMAGE_SIZE = [192, 256]
+# (width, height) of the jpegs
+JPEG_SIZES = ((2400, 1600), (1600, 2400), (2000, 2000))
+# box scales reduced by 1, 2, 4 and 8 at IMAGE_SIZE
+SCALES = (0.8, 2.2, 4.5, 8.5)
+
+
+def write_jpegs(directory):
+    '''
+    large jpegs of smooth noise under a fine grating, which aliases when
+    sampled down without filtering
+    '''
+    rng = np.random.RandomState(0)
+    images = []
+    for i, (width, height) in enumerate(JPEG_SIZES):
+        image = cv2.resize(
+            rng.randint(0, 256, (height // 16, width // 16, 3)).astype(
+                np.uint8),
+            (width, height), interpolation=cv2.INTER_CUBIC)
+        yy, xx = np.mgrid[0:height, 0:width]
+        grating = 60 * np.sin(xx / (5.0 + i) + yy / 9.0)
+        image = np.clip(image * 0.5 + grating[..., None] + 64, 0, 255)
+        image_file = os.path.join(directory, '{}.jpg'.format(i))
+        cv2.imwrite(image_file, image.astype(np.uint8),
+                    [cv2.IMWRITE_JPEG_QUALITY, 92])
+        images.append((image_file, width, height))
+    return images
+
+
+class JpegDataset(JointsDataset):
+    ''' one record per box scale on every jpeg, random joints '''
+    def __init__(self, config, images, is_train):
+        super(JpegDataset, self).__init__(
+            config, os.path.dirname(images[0][0]), 'parity', is_train)
+        self.num_joints = NUM_JOINTS
+        self.aspect_ratio = IMAGE_SIZE[0] / IMAGE_SIZE[1]
+        self.flip_pairs = [[1, 2], [3, 4], [5, 6], [7, 8], [9, 10],
+                           [11, 12], [13, 14], [15, 16]]
+        self.upper_body_ids = tuple(range(11))
+
+        rng = np.random.RandomState(1)
+        for image_file, width, height in images:
+            for scale in SCALES:
+                joints = np.zeros((NUM_JOINTS, 3), dtype=np.float32)
+                joints[:, 0] = rng.uniform(0, width, NUM_JOINTS)
+                joints[:, 1] = rng.uniform(0, height, NUM_JOINTS)
+                joints_vis = np.zeros((NUM_JOINTS, 3), dtype=np.float32)
+                joints_vis[:, 0:2] = (rng.rand(NUM_JOINTS) > 0.2)[:, None]
+                center = np.array([width, height], dtype=np.float32) * 0.5 \
+                    + rng.uniform(-100, 100, 2).astype(np.float32)
+                self.db.append({
+                    'image': image_file,
+                    'center': center,
+                    'scale': np.array([scale, scale / self.aspect_ratio],
+                                      dtype=np.float32),
+                    'joints_3d': joints,
+                    'joints_3d_vis': joints_vis,
+                    'filename': '',
+                    'imgnum': 0,
+                })
+
+
+def make_dataset(images, is_train, reduced_decode):
+    config = cfg.clone()
+    config.defrost()
+    config.MODEL.IMAGE_SIZE = IMAGE_SIZE
+    config.MODEL.HEATMAP_SIZE = [IMAGE_SIZE[0] // 4, IMAGE_SIZE[1] // 4]
+    config.DATASET.REDUCED_DECODE = reduced_decode
+    config.DATASET.PROB_HALF_BODY = 0.3
+    config.freeze()
+    return JpegDataset(config, images, is_train)
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return 10 * np.log10(255. ** 2 / max(mse, 1e-10))
+
+
+def sample(dataset, idx, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    return dataset[idx]
+
+
+def compare(images, is_train):
+    '''
+    samples of every record with and without REDUCED_DECODE, drawn with
+    the same seeds
+    :return: per record its reduction, the crop PSNR of the reduced to
+             the full decode and, for test samples, the PSNR of both to
+             the crop of an anti-aliased full-resolution image
+    '''
+    full = make_dataset(images, is_train, False)
+    reduced = make_dataset(images, is_train, True)
+    decoded = {}
+    results = []
+    for idx in range(len(full)):
+        a = sample(full, idx, idx)
+        b = sample(reduced, idx, idx)
+
+        for key in ('joints', 'joints_vis', 'center', 'scale', 'rotation'):
+            np.testing.assert_array_equal(a[3][key], b[3][key])
+        np.testing.assert_array_equal(a[1].numpy(), b[1].numpy())
+        np.testing.assert_array_equal(a[2].numpy(), b[2].numpy())
+
+        reduce = reduced.decode_reduction(b[3]['scale'])
+        if reduce == 1:
+            np.testing.assert_array_equal(a[0], b[0])
+        result = [reduce, psnr(a[0], b[0])]
+        if not is_train:
+            image_file = full.db[idx]['image']
+            if image_file not in decoded:
+                decoded[image_file] = cv2.imread(image_file)
+            # a gaussian of about the reduction as the anti-aliasing filter
+            ratio = b[3]['scale'][0] * full.pixel_std / IMAGE_SIZE[0]
+            smoothed = cv2.GaussianBlur(
+                decoded[image_file], (0, 0), max(ratio / 2.5, 0.1))
+            trans = get_affine_transform(
+                b[3]['center'], b[3]['scale'], 0, IMAGE_SIZE)
+            reference = cv2.warpAffine(
+                smoothed, trans, tuple(IMAGE_SIZE), flags=cv2.INTER_LINEAR)
+            result += [psnr(a[0], reference), psnr(b[0], reference)]
+        results.append(result)
+    return results
+
+
+def test_jpeg_size():
+    image = np.random.RandomState(0).randint(
+        0, 256, (333, 517, 3)).astype(np.uint8)
+    for params in ([], [cv2.IMWRITE_JPEG_PROGRESSIVE, 1],
+                   [cv2.IMWRITE_JPEG_OPTIMIZE, 1]):
+        data = cv2.imencode('.jpg', image, params)[1]
+        assert _jpeg_size(data) == (517, 333)
+        for reduce, flags in _REDUCED_DECODE_FLAGS.items():
+            assert cv2.imdecode(data, flags).shape[:2] == \
+                (-(-333 // reduce), -(-517 // reduce))
+    assert _jpeg_size(cv2.imencode('.png', image)[1]) is None
+    assert _jpeg_size(np.zeros(0, np.uint8)) is None
+
+
+def test_decode_reduction():
+    dataset = make_dataset([('x.jpg', 0, 0)], False, True)
+    assert [dataset.decode_reduction([scale, scale]) for scale in SCALES] \
+        == [1, 2, 4, 8]
+    dataset = make_dataset([('x.jpg', 0, 0)], False, False)
+    assert [dataset.decode_reduction([scale, scale]) for scale in SCALES] \
+        == [1, 1, 1, 1]
+
+
+def check_samples(images):
+    for is_train in (False, True):
+        for result in compare(images, is_train):
+            reduce, reduced_to_full = result[0:2]
+            # they differ by the aliasing of the full decode
+            assert reduce == 1 or reduced_to_full > 20
+            if not is_train and reduce > 1:
+                full_to_reference, reduced_to_reference = result[2:4]
+                assert reduced_to_reference > 30
+                assert reduced_to_reference > full_to_reference
+
+
+def test_samples(tmp_path):
+    check_samples(write_jpegs(str(tmp_path)))
+
+
+def benchmark(images, num=10):
+    data = np.fromfile(images[0][0], dtype=np.uint8)
+    times = []
+    for flags in [cv2.IMREAD_COLOR] + [_REDUCED_DECODE_FLAGS[reduce]
+                                       for reduce in (2, 4, 8)]:
+        tic = time.time()
+        for _ in range(num):
+            cv2.imdecode(data, flags)
+        times.append((time.time() - tic) / num * 1e3)
+    print('decode {}x{}: full {:.1f} ms, 1/2 {:.1f} ms, 1/4 {:.1f} ms, '
+          '1/8 {:.1f} ms'.format(images[0][1], images[0][2], *times))
+
+    # lowest PSNR over the records of every reduction
+    results = np.array(compare(images, False))
+    for reduce in (2, 4, 8):
+        worst = results[results[:, 0] == reduce, 1:].min(axis=0)
+        print('k={}: reduced crops {:.1f} dB from the full decode; to the '
+              'anti-aliased reference full decode {:.1f} dB, reduced '
+              '{:.1f} dB'.format(reduce, *worst))
+
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    try:
+        images = write_jpegs(directory)
+        test_jpeg_size()
+        test_decode_reduction()
+        check_samples(images)
+        print('joints and targets identical to the full decode')
+        benchmark(images)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,182 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# Parity of the vectorized gaussian targets of JointsDataset with the
+# per-joint loop they replaced. Run with pytest, or as a script for a
+# micro-benchmark of the targets one worker builds per second.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as np
+
+import _init_paths
+from config import cfg
+from dataset.JointsDataset import JointsDataset
+
+
+NUM_JOINTS = 17
+# (image size, heatmap size, sigma)
+SETTINGS = (
+    ([192, 256], [48, 64], 2),
+    ([288, 384], [72, 96], 3),
+    ([256, 256], [64, 64], 2),
+)
+
+
+def loop_target(dataset, joints, joints_vis):
+    ''' JointsDataset.generate_target as it was, one joint at a time '''
+    target_weight = np.ones((dataset.num_joints, 1), dtype=np.float32)
+    target_weight[:, 0] = joints_vis[:, 0]
+
+    target = np.zeros((dataset.num_joints,
+                       dataset.heatmap_size[1],
+                       dataset.heatmap_size[0]),
+                      dtype=np.float32)
+
+    tmp_size = dataset.sigma * 3
+
+    for joint_id in range(dataset.num_joints):
+        feat_stride = dataset.image_size / dataset.heatmap_size
+        mu_x = int(joints[joint_id][0] / feat_stride[0] + 0.5)
+        mu_y = int(joints[joint_id][1] / feat_stride[1] + 0.5)
+        # Check that any part of the gaussian is in-bounds
+        ul = [int(mu_x - tmp_size), int(mu_y - tmp_size)]
+        br = [int(mu_x + tmp_size + 1), int(mu_y + tmp_size + 1)]
+        if ul[0] >= dataset.heatmap_size[0] \
+                or ul[1] >= dataset.heatmap_size[1] \
+                or br[0] < 0 or br[1] < 0:
+            target_weight[joint_id] = 0
+            continue
+
+        size = 2 * tmp_size + 1
+        x = np.arange(0, size, 1, np.float32)
+        y = x[:, np.newaxis]
+        x0 = y0 = size // 2
+        g = np.exp(- ((x - x0) ** 2 + (y - y0) ** 2)
+                   / (2 * dataset.sigma ** 2))
+
+        # Usable gaussian range
+        g_x = max(0, -ul[0]), min(br[0], dataset.heatmap_size[0]) - ul[0]
+        g_y = max(0, -ul[1]), min(br[1], dataset.heatmap_size[1]) - ul[1]
+        # Image range
+        img_x = max(0, ul[0]), min(br[0], dataset.heatmap_size[0])
+        img_y = max(0, ul[1]), min(br[1], dataset.heatmap_size[1])
+
+        v = target_weight[joint_id]
+        if v > 0.5:
+            target[joint_id][img_y[0]:img_y[1], img_x[0]:img_x[1]] = \
+                g[g_y[0]:g_y[1], g_x[0]:g_x[1]]
+
+    if dataset.use_different_joints_weight:
+        target_weight = np.multiply(target_weight, dataset.joints_weight)
+
+    return target, target_weight
+
+
+def make_dataset(image_size, heatmap_size, sigma, joints_weight=False):
+    config = cfg.clone()
+    config.defrost()
+    config.MODEL.IMAGE_SIZE = image_size
+    config.MODEL.HEATMAP_SIZE = heatmap_size
+    config.MODEL.SIGMA = sigma
+    config.MODEL.TARGET_TYPE = 'gaussian'
+    config.TRAIN.TARGET_ON_DEVICE = False
+    config.LOSS.USE_DIFFERENT_JOINTS_WEIGHT = joints_weight
+    config.freeze()
+
+    dataset = JointsDataset(config, '', 'parity', True)
+    dataset.num_joints = NUM_JOINTS
+    if joints_weight:
+        dataset.joints_weight = np.linspace(
+            0.5, 1.5, NUM_JOINTS, dtype=np.float32).reshape((-1, 1))
+    return dataset
+
+
+def random_joints(rng, image_size):
+    '''
+    joints in and around the input, many of them with their gaussian
+    partly or fully out of the heatmap, and random visibility
+    '''
+    margin = 0.25 * np.array(image_size)
+    joints = np.zeros((NUM_JOINTS, 3), dtype=np.float32)
+    joints[:, 0:2] = rng.uniform(-margin, np.array(image_size) + margin,
+                                 (NUM_JOINTS, 2))
+    joints_vis = np.zeros((NUM_JOINTS, 3), dtype=np.float32)
+    joints_vis[:, 0:2] = (rng.rand(NUM_JOINTS) > 0.3)[:, None]
+    return joints, joints_vis
+
+
+def check_parity(dataset, num, seed):
+    rng = np.random.RandomState(seed)
+    for _ in range(num):
+        joints, joints_vis = random_joints(rng, dataset.image_size)
+        expected, expected_weight = loop_target(dataset, joints, joints_vis)
+        target, target_weight = dataset.generate_target(joints, joints_vis)
+        assert target.dtype == expected.dtype
+        assert target.flags['C_CONTIGUOUS']
+        np.testing.assert_array_equal(target, expected)
+        np.testing.assert_array_equal(target_weight, expected_weight)
+
+
+def test_parity():
+    for seed, setting in enumerate(SETTINGS):
+        check_parity(make_dataset(*setting), 1000, seed)
+
+
+def test_parity_joints_weight():
+    check_parity(make_dataset(*SETTINGS[0], joints_weight=True), 200, 10)
+
+
+def test_joints_on_the_border():
+    # gaussians just in and just out of the heatmap on every side
+    dataset = make_dataset(*SETTINGS[0])
+    tmp_size = dataset.sigma * 3
+    stride = dataset.feat_stride
+    w, h = dataset.heatmap_size
+
+    def edges(size):
+        return [-tmp_size - 1.5, -tmp_size - 0.5, -tmp_size, 0, size - 1,
+                size + tmp_size - 1, size + tmp_size]
+
+    joints_vis = np.ones((NUM_JOINTS, 3), dtype=np.float32)
+    for x in edges(w):
+        for y in edges(h):
+            joints = np.zeros((NUM_JOINTS, 3), dtype=np.float32)
+            joints[:, 0] = x * stride[0]
+            joints[:, 1] = y * stride[1]
+            expected = loop_target(dataset, joints, joints_vis)
+            target = dataset.generate_target(joints, joints_vis)
+            np.testing.assert_array_equal(target[0], expected[0])
+            np.testing.assert_array_equal(target[1], expected[1])
+
+
+def benchmark(num=5000):
+    for setting in SETTINGS[:2]:
+        dataset = make_dataset(*setting)
+        rng = np.random.RandomState(0)
+        samples = [random_joints(rng, dataset.image_size)
+                   for _ in range(num)]
+        rates = []
+        for generate in (lambda j, v: loop_target(dataset, j, v),
+                         dataset.generate_target):
+            tic = time.time()
+            for joints, joints_vis in samples:
+                generate(joints, joints_vis)
+            rates.append(num / (time.time() - tic))
+        print('heatmap {}x{}, sigma {}: loop {:.0f}, vectorized {:.0f} '
+              'targets/s per worker'.format(
+                  setting[1][0], setting[1][1], setting[2], *rates))
+
+
+if __name__ == '__main__':
+    test_parity()
+    test_parity_joints_weight()
+    test_joints_on_the_border()
+    print('targets identical to the per-joint loop')
+    benchmark()
@@ -0,0 +1,261 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+# Parity of the closed-form affines of utils.transforms with the
+# cv2.getAffineTransform construction they replaced. Run with pytest, or
+# as a script to print the measured differences and timings.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import cv2
+import numpy as np
+
+import _init_paths
+from utils.transforms import affine_transform
+from utils.transforms import affine_transforms
+from utils.transforms import get_affine_transform
+from utils.transforms import get_affine_transforms
+from utils.transforms import transform_preds
+
+
+NUM_CROPS = 2000
+NUM_WARPS = 200
+OUTPUT_SIZES = ([192, 256], [288, 384], [48, 64])
+
+
+def _get_dir(src_point, rot_rad):
+    sn, cs = np.sin(rot_rad), np.cos(rot_rad)
+
+    src_result = [0, 0]
+    src_result[0] = src_point[0] * cs - src_point[1] * sn
+    src_result[1] = src_point[0] * sn + src_point[1] * cs
+
+    return src_result
+
+
+def _get_3rd_point(a, b):
+    direct = a - b
+    return b + np.array([-direct[1], direct[0]], dtype=np.float32)
+
+
+def cv2_affine_transform(
+        center, scale, rot, output_size,
+        shift=np.array([0, 0], dtype=np.float32), inv=0
+):
+    ''' get_affine_transform as it was before the closed form '''
+    if not isinstance(scale, np.ndarray) and not isinstance(scale, list):
+        scale = np.array([scale, scale])
+
+    scale_tmp = scale * 200.0
+    src_w = scale_tmp[0]
+    dst_w = output_size[0]
+    dst_h = output_size[1]
+
+    rot_rad = np.pi * rot / 180
+    src_dir = _get_dir([0, src_w * -0.5], rot_rad)
+    dst_dir = np.array([0, dst_w * -0.5], np.float32)
+
+    src = np.zeros((3, 2), dtype=np.float32)
+    dst = np.zeros((3, 2), dtype=np.float32)
+    src[0, :] = center + scale_tmp * shift
+    src[1, :] = center + src_dir + scale_tmp * shift
+    dst[0, :] = [dst_w * 0.5, dst_h * 0.5]
+    dst[1, :] = np.array([dst_w * 0.5, dst_h * 0.5]) + dst_dir
+
+    src[2:, :] = _get_3rd_point(src[0, :], src[1, :])
+    dst[2:, :] = _get_3rd_point(dst[0, :], dst[1, :])
+
+    if inv:
+        trans = cv2.getAffineTransform(np.float32(dst), np.float32(src))
+    else:
+        trans = cv2.getAffineTransform(np.float32(src), np.float32(dst))
+
+    return trans
+
+
+def random_crops(rng, num):
+    ''' float32 centers and scales like the db, a third unrotated '''
+    center = rng.uniform(0, 1000, (num, 2)).astype(np.float32)
+    scale = rng.uniform(0.2, 5, (num, 2)).astype(np.float32)
+    rot = rng.uniform(-45, 45, num)
+    rot[::3] = 0
+    shift = rng.uniform(-0.2, 0.2, (num, 2)).astype(np.float32)
+    shift[::2] = 0
+    return center, scale, rot, shift
+
+
+def matrix_differences():
+    ''' worst difference to the cv2 matrices, relative to their largest entry '''
+    rng = np.random.RandomState(0)
+    center, scale, rot, shift = random_crops(rng, NUM_CROPS)
+    worst = 0
+    for i in range(NUM_CROPS):
+        output_size = OUTPUT_SIZES[i % len(OUTPUT_SIZES)]
+        for inv in (0, 1):
+            expected = cv2_affine_transform(
+                center[i], scale[i], rot[i], output_size, shift[i], inv)
+            trans = get_affine_transform(
+                center[i], scale[i], rot[i], output_size, shift[i], inv)
+            worst = max(worst, np.abs(trans - expected).max()
+                        / np.abs(expected).max())
+    return worst
+
+
+def warp_differences(smooth):
+    '''
+    crops of random images through the closed-form and the cv2 matrices
+    :return: largest displacement in source pixels of an output pixel,
+             largest grey level difference and the fraction of differing
+             pixel values
+    '''
+    rng = np.random.RandomState(1)
+    displacement = 0
+    worst = 0
+    num_diff = num_values = 0
+    for i in range(NUM_WARPS):
+        image = rng.randint(0, 256, (480, 640, 3)).astype(np.uint8)
+        if smooth:
+            image = cv2.GaussianBlur(image, (0, 0), 3)
+        center = rng.uniform(0, 640, 2).astype(np.float32)
+        scale = rng.uniform(0.3, 3, 2).astype(np.float32)
+        rot = rng.uniform(-45, 45) if i % 3 else 0
+        output_size = OUTPUT_SIZES[i % 2]
+        w, h = output_size
+
+        expected = cv2_affine_transform(center, scale, rot, output_size)
+        trans = get_affine_transform(center, scale, rot, output_size)
+        corners = np.array([[[0, 0], [w - 1, 0], [0, h - 1], [w - 1, h - 1]]],
+                           dtype=np.float64)
+        displacement = max(displacement, np.abs(
+            affine_transforms(corners, cv2.invertAffineTransform(
+                np.float64(expected))[None])
+            - affine_transforms(corners, cv2.invertAffineTransform(
+                trans)[None])).max())
+
+        a = cv2.warpAffine(image, expected, (w, h), flags=cv2.INTER_LINEAR)
+        b = cv2.warpAffine(image, trans, (w, h), flags=cv2.INTER_LINEAR)
+        diff = np.abs(a.astype(np.int64) - b)
+        worst = max(worst, diff.max())
+        num_diff += np.count_nonzero(diff)
+        num_values += diff.size
+    return displacement, worst, num_diff / num_values
+
+
+def test_matrices():
+    # the cv2 version solves from float32 points
+    assert matrix_differences() < 1e-5
+
+
+def test_batched_matches_single():
+    rng = np.random.RandomState(2)
+    center, scale, rot, shift = random_crops(rng, 500)
+    for inv in (0, 1):
+        trans = get_affine_transforms(
+            center, scale, rot, [192, 256], shift, inv)
+        for i in range(len(center)):
+            expected = cv2_affine_transform(
+                center[i], scale[i], rot[i], [192, 256], shift[i], inv)
+            np.testing.assert_allclose(
+                trans[i], expected, rtol=1e-5,
+                atol=1e-5 * np.abs(expected).max())
+
+
+def test_scalar_scale():
+    expected = cv2_affine_transform(
+        np.array([320., 240.]), 1.5, 30, [192, 256])
+    trans = get_affine_transform(np.array([320., 240.]), 1.5, 30, [192, 256])
+    np.testing.assert_allclose(trans, expected, rtol=1e-5, atol=1e-4)
+
+
+def test_points():
+    rng = np.random.RandomState(3)
+    center, scale, rot, _ = random_crops(rng, 200)
+    trans = get_affine_transforms(center, scale, rot, [192, 256])
+    trans_inv = get_affine_transforms(center, scale, rot, [192, 256], inv=1)
+    pts = rng.uniform(0, 1000, (200, 17, 2))
+
+    out = affine_transforms(pts, trans)
+    for i in range(len(pts)):
+        for k in range(pts.shape[1]):
+            expected = np.dot(trans[i], np.array([pts[i, k, 0],
+                                                  pts[i, k, 1], 1.]))
+            np.testing.assert_allclose(out[i, k], expected, rtol=1e-12)
+            np.testing.assert_allclose(
+                affine_transform(pts[i, k], trans[i]), expected,
+                rtol=1e-12)
+    np.testing.assert_allclose(
+        affine_transforms(out, trans_inv), pts, atol=1e-9)
+
+
+def test_transform_preds():
+    rng = np.random.RandomState(4)
+    coords = rng.uniform(0, 64, (17, 3))
+    center = np.array([300., 200.], dtype=np.float32)
+    scale = np.array([1.2, 1.6], dtype=np.float32)
+    trans = cv2_affine_transform(center, scale, 0, [48, 64], inv=1)
+    expected = np.dot(coords[:, 0:2], trans[:, 0:2].T) + trans[:, 2]
+    np.testing.assert_allclose(
+        transform_preds(coords, center, scale, [48, 64])[:, 0:2],
+        expected, rtol=1e-5, atol=1e-3)
+
+
+def test_warps():
+    # cv2.warpAffine rounds source coordinates to 1/32 pixel. Matrices
+    # differing by float32 noise move a few of them to the next step,
+    # which changes a bilinear weight by 1/32 per axis, so a pixel moves
+    # by at most 2 * 255 / 32 grey levels and only where the image is
+    # sharp. The coordinates themselves stay far below a step apart.
+    displacement, worst, fraction = warp_differences(smooth=False)
+    assert displacement < 1e-3
+    assert worst <= 16
+    assert fraction < 1e-3
+
+    displacement, worst, fraction = warp_differences(smooth=True)
+    assert displacement < 1e-3
+    assert worst <= 8
+    assert fraction < 1e-4
+
+
+def benchmark(num=500):
+    rng = np.random.RandomState(5)
+    center, scale, rot, _ = random_crops(rng, num)
+    pts = rng.uniform(0, 1000, (num, 17, 2))
+
+    tic = time.time()
+    trans = [cv2_affine_transform(center[i], scale[i], rot[i], [192, 256])
+             for i in range(num)]
+    cv2_matrices = time.time() - tic
+    tic = time.time()
+    get_affine_transforms(center, scale, rot, [192, 256])
+    matrices = time.time() - tic
+
+    tic = time.time()
+    for i in range(num):
+        for k in range(pts.shape[1]):
+            np.dot(trans[i], np.array([pts[i, k, 0], pts[i, k, 1], 1.]).T)
+    loop_points = time.time() - tic
+    tic = time.time()
+    affine_transforms(pts, np.array(trans))
+    points = time.time() - tic
+
+    print('{} matrices: cv2 {:.2f} ms, closed form {:.3f} ms'.format(
+        num, cv2_matrices * 1e3, matrices * 1e3))
+    print('{}x17 points: loop {:.2f} ms, batched {:.3f} ms'.format(
+        num, loop_points * 1e3, points * 1e3))
+
+
+if __name__ == '__main__':
+    print('matrices: worst relative difference {:.2e}'.format(
+        matrix_differences()))
+    for smooth in (False, True):
+        print('{} images: source displacement {:.2e} px, worst {} grey '
+              'levels, {:.2e} of the values differ'.format(
+                  'smoothed' if smooth else 'noise',
+                  *warp_differences(smooth)))
+    benchmark()
@@ -0,0 +1,150 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import random
+import time
+
+import numpy as np
+
+import _init_paths
+from config import cfg
+from config import update_config
+from utils.image_store import ImageStore
+
+import dataset
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Pre-decode dataset images (DATASET.CACHE_MODE memmap) '
+                    'or instance patches (patch) into a memory-mapped store')
+    # general
+    parser.add_argument('--cfg',
+                        help='experiment configure file name',
+                        required=True,
+                        type=str)
+
+    parser.add_argument('opts',
+                        help="Modify config options using the command-line",
+                        default=None,
+                        nargs=argparse.REMAINDER)
+
+    parser.add_argument('--modelDir',
+                        help='model directory',
+                        type=str,
+                        default='')
+    parser.add_argument('--logDir',
+                        help='log directory',
+                        type=str,
+                        default='')
+    parser.add_argument('--dataDir',
+                        help='data directory',
+                        type=str,
+                        default='')
+    parser.add_argument('--sets',
+                        help='image sets to cache, default train and test set',
+                        nargs='+',
+                        default=None)
+    parser.add_argument('--benchmark',
+                        help='number of samples to time against DATA_FORMAT',
+                        type=int,
+                        default=0)
+
+    args = parser.parse_args()
+    return args
+
+
+def benchmark(db, store, num_samples):
+    db_recs = random.sample(list(db.db), min(num_samples, len(db.db)))
+
+    tic = time.time()
+    for rec in db_recs:
+        db.read_image(rec['image'])
+    decode_speed = len(db_recs) / (time.time() - tic)
+
+    tic = time.time()
+    for rec in db_recs:
+        image, _, _ = store.get(db.image_store_key(rec))
+        np.ascontiguousarray(image)
+    store_speed = len(db_recs) / (time.time() - tic)
+
+    logger.info(
+        '=> {} samples: {} {:.1f} samples/s, {} {:.1f} samples/s'.format(
+            len(db_recs), db.data_format, decode_speed,
+            db.cache_mode, store_speed))
+
+
+def build_patch_store(db, store_path):
+    # records with the same box share a patch, it covers all their crops
+    db_recs = {}
+    for rec in db.db:
+        db_recs.setdefault(db.image_store_key(rec), []).append(rec)
+
+    # records of one image are adjacent, decode each image only once
+    last = {'image': None, 'data': None}
+
+    def read_patch(key):
+        recs = db_recs[key]
+        if last['image'] != recs[0]['image']:
+            last['image'] = recs[0]['image']
+            last['data'] = db.read_image(recs[0]['image'])
+        height, width = last['data'].shape[:2]
+        regions = np.array(
+            [db.patch_region(rec, (width, height)) for rec in recs])
+        x0, y0 = regions[:, 0:2].min(axis=0)
+        x1, y1 = regions[:, 2:4].max(axis=0)
+        return last['data'][y0:y1, x0:x1], (width, height), (x0, y0)
+
+    ImageStore.build(store_path, list(db_recs.keys()), read_patch,
+                     max_side=db.cache_max_side)
+
+
+def main():
+    args = parse_args()
+    update_config(cfg, args)
+    logging.basicConfig(format='%(asctime)-15s %(message)s',
+                        level=logging.INFO)
+
+    if cfg.DATASET.CACHE_MODE not in ('memmap', 'patch'):
+        raise ValueError('set DATASET.CACHE_MODE to memmap or patch')
+
+    image_sets = args.sets or [cfg.DATASET.TRAIN_SET, cfg.DATASET.TEST_SET]
+    for image_set in image_sets:
+        db = eval('dataset.' + cfg.DATASET.DATASET)(
+            cfg, cfg.DATASET.ROOT, image_set,
+            image_set == cfg.DATASET.TRAIN_SET
+        )
+        store_path = db.image_store_path()
+        if ImageStore.exists(store_path):
+            logger.info('=> {} exists, skip'.format(store_path))
+        else:
+            if not os.path.exists(db.cache_dir):
+                os.makedirs(db.cache_dir)
+            logger.info('=> building {}'.format(store_path))
+            if db.cache_mode == 'patch':
+                build_patch_store(db, store_path)
+            else:
+                # keep the order of first use so reads are mostly forward
+                image_files = list(
+                    dict.fromkeys(rec['image'] for rec in db.db))
+                ImageStore.build(store_path, image_files, db.read_image,
+                                 max_side=db.cache_max_side)
+
+        if args.benchmark > 0:
+            benchmark(db, ImageStore(store_path), args.benchmark)
+
+
+if __name__ == '__main__':
+    main()
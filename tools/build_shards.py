@@ -0,0 +1,112 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import logging
+import time
+
+import _init_paths
+from config import cfg
+from config import update_config
+from dataset.shards import ShardReader
+from dataset.shards import write_shards
+
+import dataset
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Pack the images and db records of the COCO or MPII '
+                    'layout into tar shards (DATASET.DATA_FORMAT shards)')
+    # general
+    parser.add_argument('--cfg',
+                        help='experiment configure file name',
+                        required=True,
+                        type=str)
+
+    parser.add_argument('opts',
+                        help="Modify config options using the command-line",
+                        default=None,
+                        nargs=argparse.REMAINDER)
+
+    parser.add_argument('--modelDir',
+                        help='model directory',
+                        type=str,
+                        default='')
+    parser.add_argument('--logDir',
+                        help='log directory',
+                        type=str,
+                        default='')
+    parser.add_argument('--dataDir',
+                        help='data directory',
+                        type=str,
+                        default='')
+    parser.add_argument('--sets',
+                        help='image sets to pack, default train and test set',
+                        nargs='+',
+                        default=None)
+    parser.add_argument('--shardMB',
+                        help='approximate size of a shard in MB',
+                        type=int,
+                        default=256)
+    parser.add_argument('--benchmark',
+                        help='also time a sequential pass over the shards',
+                        action='store_true')
+
+    args = parser.parse_args()
+    return args
+
+
+def benchmark(prefix, root):
+    reader = ShardReader(prefix)
+    num_bytes = num_records = 0
+    tic = time.time()
+    for shard in range(reader.num_shards()):
+        for data, recs in reader.iter_shard(shard, root):
+            num_bytes += len(data)
+            num_records += len(recs)
+    elapsed = time.time() - tic
+    logger.info('=> {} records, {:.1f} MB/s, {:.1f} records/s'.format(
+        num_records, num_bytes / 1024 ** 2 / elapsed,
+        num_records / elapsed))
+
+
+def main():
+    args = parse_args()
+    update_config(cfg, args)
+    logging.basicConfig(format='%(asctime)-15s %(message)s',
+                        level=logging.INFO)
+
+    if cfg.DATASET.DATA_FORMAT == 'shards':
+        raise ValueError(
+            'set DATASET.DATA_FORMAT to the layout to read, jpg or zip')
+
+    image_sets = args.sets or [cfg.DATASET.TRAIN_SET, cfg.DATASET.TEST_SET]
+    for image_set in image_sets:
+        db = eval('dataset.' + cfg.DATASET.DATASET)(
+            cfg, cfg.DATASET.ROOT, image_set,
+            image_set == cfg.DATASET.TRAIN_SET
+        )
+        prefix = db.shard_prefix()
+        if ShardReader.exists(prefix):
+            logger.info('=> {} exists, skip'.format(prefix))
+        else:
+            logger.info('=> building {}'.format(prefix))
+            write_shards(prefix, db.db, db.root, db.read_image_bytes,
+                         shard_bytes=args.shardMB * 1024 ** 2)
+
+        if args.benchmark:
+            benchmark(prefix, db.root)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,12 +24,15 @@ import torchvision.transforms as transforms
 import _init_paths
 from config import cfg
 from config import update_config
+from core.loss import JointsIntegralLoss
 from core.loss import JointsMSELoss
 from core.function import validate
 from utils.utils import create_logger
 
 import dataset
 import models
+from dataset.collate import collate_padded_images
+from dataset.sampler import ImageGroupedSampler
 
 
 def parse_args():
@@ -98,27 +101,41 @@ def main():
     #model = torch.nn.DataParallel(model, device_ids=cfg.GPUS).cuda()
 
     # define loss function (criterion) and optimizer
-    criterion = JointsMSELoss(
-        use_target_weight=cfg.LOSS.USE_TARGET_WEIGHT
-    ).cuda()
+    if cfg.MODEL.TARGET_TYPE == 'integral':
+        criterion = JointsIntegralLoss(
+            use_target_weight=cfg.LOSS.USE_TARGET_WEIGHT
+        ).cuda()
+    else:
+        criterion = JointsMSELoss(
+            use_target_weight=cfg.LOSS.USE_TARGET_WEIGHT
+        ).cuda()
 
     # Data loading code
     normalize = transforms.Normalize(
         mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
     )
+    transform = None if cfg.DATASET.UINT8_INPUT else transforms.Compose([
+        transforms.ToTensor(),
+        normalize,
+    ])
     valid_dataset = eval('dataset.'+cfg.DATASET.DATASET)(
         cfg, cfg.DATASET.ROOT, cfg.DATASET.TEST_SET, False,
-        transforms.Compose([
-            transforms.ToTensor(),
-            normalize,
-        ])
+        transform
     )
+    valid_sampler = ImageGroupedSampler(valid_dataset) \
+        if cfg.DATASET.GROUP_BY_IMAGE else None
+    # uint8 images, normalized with the batch on the device
+    collate_fn = collate_padded_images \
+        if cfg.DATASET.CROP_BACKEND == 'torch' or cfg.DATASET.UINT8_INPUT \
+        else None
     valid_loader = torch.utils.data.DataLoader(
         valid_dataset,
         batch_size=cfg.TEST.BATCH_SIZE_PER_GPU*len(cfg.GPUS),
         shuffle=False,
+        sampler=valid_sampler,
         num_workers=cfg.WORKERS,
-        pin_memory=True
+        pin_memory=True,
+        collate_fn=collate_fn
     )
 
     # evaluate on validation set
@@ -25,6 +25,7 @@ from tensorboardX import SummaryWriter
 import _init_paths
 from config import cfg
 from config import update_config
+from core.loss import JointsIntegralLoss
 from core.loss import JointsMSELoss
 from core.function import train
 from core.function import validate
@@ -35,6 +36,9 @@ from utils.utils import get_model_summary
 
 import dataset
 import models
+from dataset.collate import collate_padded_images
+from dataset.sampler import ImageGroupedSampler
+from dataset.shards import ShardedJointsDataset
 
 
 def parse_args():
@@ -115,42 +119,66 @@ def main():
     model = torch.nn.DataParallel(model, device_ids=cfg.GPUS).cuda()
 
     # define loss function (criterion) and optimizer
-    criterion = JointsMSELoss(
-        use_target_weight=cfg.LOSS.USE_TARGET_WEIGHT
-    ).cuda()
+    if cfg.MODEL.TARGET_TYPE == 'integral':
+        criterion = JointsIntegralLoss(
+            use_target_weight=cfg.LOSS.USE_TARGET_WEIGHT
+        ).cuda()
+    else:
+        criterion = JointsMSELoss(
+            use_target_weight=cfg.LOSS.USE_TARGET_WEIGHT
+        ).cuda()
 
     # Data loading code
     normalize = transforms.Normalize(
         mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
     )
+    transform = None if cfg.DATASET.UINT8_INPUT else transforms.Compose([
+        transforms.ToTensor(),
+        normalize,
+    ])
     train_dataset = eval('dataset.'+cfg.DATASET.DATASET)(
         cfg, cfg.DATASET.ROOT, cfg.DATASET.TRAIN_SET, True,
-        transforms.Compose([
-            transforms.ToTensor(),
-            normalize,
-        ])
+        transform
     )
     valid_dataset = eval('dataset.'+cfg.DATASET.DATASET)(
         cfg, cfg.DATASET.ROOT, cfg.DATASET.TEST_SET, False,
-        transforms.Compose([
-            transforms.ToTensor(),
-            normalize,
-        ])
+        transform
     )
 
+    train_sampler = None
+    valid_sampler = None
+    if cfg.DATASET.GROUP_BY_IMAGE:
+        train_sampler = ImageGroupedSampler(train_dataset, cfg.TRAIN.SHUFFLE)
+        valid_sampler = ImageGroupedSampler(valid_dataset)
+    train_shuffle = cfg.TRAIN.SHUFFLE and train_sampler is None
+    if cfg.DATASET.DATA_FORMAT == 'shards':
+        # stream the training shards sequentially, validate by index
+        train_dataset = ShardedJointsDataset(
+            train_dataset, cfg.TRAIN.SHUFFLE, cfg.DATASET.SHUFFLE_BUFFER)
+        train_sampler = None
+        train_shuffle = False
+    # uint8 images, normalized with the batch on the device
+    collate_fn = collate_padded_images \
+        if cfg.DATASET.CROP_BACKEND == 'torch' or cfg.DATASET.UINT8_INPUT \
+        else None
+
     train_loader = torch.utils.data.DataLoader(
         train_dataset,
         batch_size=cfg.TRAIN.BATCH_SIZE_PER_GPU*len(cfg.GPUS),
-        shuffle=cfg.TRAIN.SHUFFLE,
+        shuffle=train_shuffle,
+        sampler=train_sampler,
         num_workers=cfg.WORKERS,
-        pin_memory=cfg.PIN_MEMORY
+        pin_memory=cfg.PIN_MEMORY,
+        collate_fn=collate_fn
     )
     valid_loader = torch.utils.data.DataLoader(
         valid_dataset,
         batch_size=cfg.TEST.BATCH_SIZE_PER_GPU*len(cfg.GPUS),
         shuffle=False,
+        sampler=valid_sampler,
         num_workers=cfg.WORKERS,
-        pin_memory=cfg.PIN_MEMORY
+        pin_memory=cfg.PIN_MEMORY,
+        collate_fn=collate_fn
     )
 
     best_perf = 0.0